@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Customer, Invoice, InvoiceItem
+from .models import Customer, Invoice, InvoiceItem, StatementLine, StockReservation
 
 @admin.register(Customer)
 class CustomerAdmin(admin.ModelAdmin):
@@ -52,6 +52,13 @@ class InvoiceAdmin(admin.ModelAdmin):
         }),
     )
 
+    def get_readonly_fields(self, request, obj=None):
+        fields = super().get_readonly_fields(request, obj)
+        if obj is not None and obj.stock_applied:
+            # Finalized invoices stay filed under their date in the sales cube
+            fields = [*fields, 'invoice_date']
+        return fields
+
     def save_model(self, request, obj, form, change):
         if not change:  # If creating new invoice
             obj.created_by = request.user
@@ -63,4 +70,30 @@ class InvoiceItemAdmin(admin.ModelAdmin):
     list_display = ['invoice', 'product', 'quantity', 'unit_price', 'tax_rate', 'total_with_tax']
     list_filter = ['invoice__status', 'tax_rate']
     search_fields = ['invoice__invoice_number', 'product__name', 'product__sku']
-    readonly_fields = ['line_total', 'tax_amount', 'total_with_tax']
\ No newline at end of file
+    readonly_fields = ['line_total', 'tax_amount', 'total_with_tax']
+
+
+@admin.register(StatementLine)
+class StatementLineAdmin(admin.ModelAdmin):
+    list_display = ['import_id', 'line_number', 'transaction_date', 'amount', 'reference_number', 'status', 'reason']
+    list_filter = ['status', 'transaction_date']
+    search_fields = ['reference_number', 'description', 'phone', 'gstin']
+    readonly_fields = ['import_id', 'line_number', 'candidate_invoices', 'payment', 'created_at', 'resolved_at']
+
+
+@admin.register(StockReservation)
+class StockReservationAdmin(admin.ModelAdmin):
+    list_display = ['invoice', 'product', 'quantity', 'expires_at', 'created_at']
+    list_filter = ['expires_at']
+    search_fields = ['invoice__invoice_number', 'product__sku', 'product__name']
+    raw_id_fields = ['invoice', 'product']
+
+    def has_add_permission(self, request):
+        # Reservations follow invoice items; editing them here would desync the product counters
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
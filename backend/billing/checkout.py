@@ -0,0 +1,183 @@
+"""Counter checkout: invoice, items, stock and payment in one transaction.
+
+The number of queries does not depend on the number of lines: SKUs are
+resolved with one query, totals are computed in Python before the invoice is
+inserted, stock is deducted with one guarded UPDATE, items are bulk-inserted
+and the payment is inserted with the invoice already carrying its paid amount.
+"""
+from datetime import timedelta
+from decimal import Decimal, ROUND_HALF_UP
+
+from django.db import transaction
+from django.utils import timezone
+
+from inventory.ledger import record_movements
+from inventory.models import Product, StockMovement
+from inventory.stock import deduct_stock
+from events.broker import PAYMENT, publish_invoice_changes
+from reports.cache import invalidate_shops
+from reports.cube import record_invoices
+
+from .models import Customer, Invoice, InvoiceItem, Payment
+
+WALK_IN_CUSTOMER = 'Walk-in Customer'
+CENT = Decimal('0.01')
+
+
+class CheckoutError(ValueError):
+    """Raised when a checkout payload cannot be turned into a sale"""
+
+
+def _resolve_lines(shop, lines):
+    """Merge lines per SKU and attach products with one query"""
+    merged = {}
+    for line in lines:
+        sku = line['sku'].strip()
+        if sku in merged:
+            merged[sku]['quantity'] += line['quantity']
+        else:
+            merged[sku] = dict(line, sku=sku)
+
+    products = {product.sku: product for product in Product.objects.filter(shop=shop, sku__in=list(merged))}
+    unknown = [sku for sku in merged if sku not in products]
+    if unknown:
+        raise CheckoutError(f"Unknown SKU: {', '.join(unknown)}")
+    for sku, line in merged.items():
+        line['product'] = products[sku]
+    return list(merged.values())
+
+
+def _customer(shop, customer_id):
+    if customer_id is None:
+        customer, _ = Customer.objects.get_or_create(name=WALK_IN_CUSTOMER, shop=shop)
+        return customer
+    customer = Customer.objects.filter(pk=customer_id, shop=shop).first()
+    if customer is None:
+        raise CheckoutError("Customer not found")
+    return customer
+
+
+def checkout(shop, created_by, lines, customer_id=None, payment=None, discount_amount=Decimal('0.00'), notes='',
+             location=None):
+    """Record a counter sale and return its receipt.
+
+    ``lines`` are dicts with sku, quantity and optional unit_price/tax_rate;
+    ``payment`` is an optional dict with amount, payment_method and
+    reference_number; ``location`` is the StockLocation selling the goods
+    (the shop's default location if omitted). Tendered cash above the total
+    is returned as change.
+    Raises CheckoutError, or InsufficientStock listing the shortfalls.
+    """
+    if not lines:
+        raise CheckoutError("At least one line is required")
+
+    with transaction.atomic():
+        lines = _resolve_lines(shop, lines)
+        customer = _customer(shop, customer_id)
+
+        items = []
+        subtotal = tax = Decimal('0')
+        for line in lines:
+            product = line['product']
+            item = InvoiceItem(
+                product=product,
+                description=product.name,
+                quantity=line['quantity'],
+                unit_price=line['unit_price'] if line.get('unit_price') is not None else product.price,
+                tax_rate=line['tax_rate'] if line.get('tax_rate') is not None else product.gst_rate,
+            )
+            subtotal += item.line_total
+            tax += item.tax_amount
+            items.append(item)
+
+        # Same rounding as Invoice.calculate_totals
+        subtotal = subtotal.quantize(CENT, rounding=ROUND_HALF_UP)
+        tax = tax.quantize(CENT, rounding=ROUND_HALF_UP)
+        discount_amount = Decimal(discount_amount).quantize(CENT, rounding=ROUND_HALF_UP)
+        total = subtotal + tax - discount_amount
+        if total < 0:
+            raise CheckoutError("Discount exceeds the invoice total")
+
+        tendered = Decimal(str(payment['amount'])).quantize(CENT, rounding=ROUND_HALF_UP) if payment else Decimal('0.00')
+        paid = min(tendered, total)
+        today = timezone.now().date()
+        if paid >= total:
+            invoice_status = 'paid'
+        elif paid > 0:
+            invoice_status = 'partial'
+        else:
+            invoice_status = 'due'
+
+        invoice = Invoice(
+            customer=customer,
+            shop=shop,
+            created_by=created_by,
+            status=invoice_status,
+            invoice_date=today,
+            due_date=today if invoice_status == 'paid' else today + timedelta(days=30),
+            paid_date=today if invoice_status == 'paid' else None,
+            subtotal=subtotal,
+            tax_amount=tax,
+            discount_amount=discount_amount,
+            total_amount=total,
+            paid_amount=paid,
+            notes=notes,
+            stock_applied=True,
+        )
+        # Stock goes first: a shortfall fails before an invoice number is
+        # taken, and in gapless mode the sequence row is only locked for the
+        # inserts that follow. The sale is ledgered once the number exists.
+        required = {}
+        for item in items:
+            required[item.product_id] = required.get(item.product_id, 0) + item.quantity
+        deduct_stock(required, movements=(), location=location)
+
+        invoice.save()
+        for item in items:
+            item.invoice = invoice
+        InvoiceItem.objects.bulk_create(items)
+        record_movements(
+            ((product_id, -qty, invoice.invoice_number) for product_id, qty in required.items()), StockMovement.SALE
+        )
+
+        payment_record = None
+        if paid > 0:
+            # bulk_create skips Payment.save(), which would add the amount to the invoice again
+            payment_record, = Payment.objects.bulk_create([Payment(
+                invoice=invoice,
+                amount=paid,
+                payment_method=payment.get('payment_method', 'cash'),
+                reference_number=payment.get('reference_number', ''),
+                created_by=created_by,
+            )])
+            publish_invoice_changes([invoice.pk], PAYMENT, extra={invoice.pk: {'amount': str(paid)}})
+
+        record_invoices([invoice.pk])
+        invalidate_shops(shop.pk)
+
+    return {
+        'invoice_id': invoice.pk,
+        'invoice_number': invoice.invoice_number,
+        'date': invoice.invoice_date,
+        'customer': customer.name,
+        'status': invoice.status,
+        'lines': [
+            {
+                'sku': item.product.sku,
+                'name': item.product.name,
+                'quantity': item.quantity,
+                'unit_price': item.unit_price,
+                'tax_rate': item.tax_rate,
+                'total': item.total_with_tax.quantize(CENT, rounding=ROUND_HALF_UP),
+            }
+            for item in items
+        ],
+        'subtotal': subtotal,
+        'tax_amount': tax,
+        'discount_amount': discount_amount,
+        'total_amount': total,
+        'paid_amount': paid,
+        'balance': total - paid,
+        'change': tendered - paid,
+        'payment_method': payment_record.payment_method if payment_record else None,
+    }
@@ -0,0 +1,195 @@
+"""Finalizing many draft invoices in one transaction."""
+from collections import defaultdict
+
+from django.db import transaction
+from django.db.models import Case, F, Sum, Value, When
+from django.utils import timezone
+
+from inventory.locations import location_available, stored_location_id
+from inventory.models import Product
+from inventory.stock import InsufficientStock, deduct_stock
+from events.broker import publish_invoice_changes
+from reports.cache import invalidate_shops
+from reports.cube import record_invoices
+
+from .models import Invoice, InvoiceItem
+from .reservations import forget_reservations, held_stock
+
+ALL_OR_NOTHING = 'all_or_nothing'
+BEST_EFFORT = 'best_effort'
+FINALIZE_MODES = (ALL_OR_NOTHING, BEST_EFFORT)
+
+# Re-reads of stock allowed when a concurrent deduction invalidates the plan
+MAX_ATTEMPTS = 3
+
+
+def _plan(invoice_ids, limits, mode):
+    """Decide which invoices can be finalized against the given stock snapshots.
+
+    ``limits`` is a list of (required_by_invoice, stock) pairs that must all
+    hold, e.g. unreserved stock and the units at the chosen location.
+    Returns (accepted ids, {invoice_id: shortfalls}).
+    """
+    failures = {}
+    if mode == ALL_OR_NOTHING:
+        for required_by_invoice, stock in limits:
+            totals = defaultdict(int)
+            for required in required_by_invoice.values():
+                for product_id, qty in required.items():
+                    totals[product_id] += qty
+            short = {pid for pid, qty in totals.items() if stock.get(pid, (None, 0))[1] < qty}
+            for invoice_id in invoice_ids:
+                required = required_by_invoice.get(invoice_id, {})
+                shortfalls = [
+                    _shortfall(pid, totals[pid], *stock.get(pid, (None, 0))) for pid in required if pid in short
+                ]
+                if shortfalls:
+                    failures.setdefault(invoice_id, []).extend(shortfalls)
+        return ([] if failures else list(invoice_ids)), failures
+
+    # Best effort: greedily take invoices in id order while stock remains
+    remaining = [{pid: available for pid, (_, available) in stock.items()} for _, stock in limits]
+    accepted = []
+    for invoice_id in invoice_ids:
+        shortfalls = []
+        for (required_by_invoice, stock), left in zip(limits, remaining):
+            required = required_by_invoice.get(invoice_id, {})
+            shortfalls += [
+                _shortfall(pid, qty, stock.get(pid, (None, 0))[0], left.get(pid, 0))
+                for pid, qty in required.items() if left.get(pid, 0) < qty
+            ]
+        if shortfalls:
+            failures[invoice_id] = shortfalls
+            continue
+        for (required_by_invoice, _), left in zip(limits, remaining):
+            for pid, qty in required_by_invoice.get(invoice_id, {}).items():
+                left[pid] -= qty
+        accepted.append(invoice_id)
+    return accepted, failures
+
+
+def _shortfall(product_id, required, name, available):
+    return {'product_id': product_id, 'name': name, 'required': required, 'available': available}
+
+
+def bulk_finalize(invoice_ids, mode=ALL_OR_NOTHING, queryset=None, location=None):
+    """Apply stock for many invoices with set-based queries.
+
+    Required quantities are aggregated per invoice and product in one query;
+    what the invoices already reserve is converted and the rest is validated
+    against one snapshot of unreserved stock, deducted with one guarded UPDATE
+    and the invoices are flipped with one UPDATE. ``queryset`` restricts which
+    invoices may be finalized; ``location`` is the StockLocation the stock
+    leaves from (the shop's default location if omitted). Returns a report entry per requested invoice id.
+    """
+    if mode not in FINALIZE_MODES:
+        raise ValueError(f"Unknown finalize mode: {mode}")
+
+    for attempt in range(MAX_ATTEMPTS):
+        try:
+            return _bulk_finalize(invoice_ids, mode, queryset, location)
+        except InsufficientStock:
+            # Stock moved between the snapshot and the guarded UPDATE; re-plan
+            if attempt == MAX_ATTEMPTS - 1:
+                raise
+
+
+def _bulk_finalize(invoice_ids, mode, queryset, location):
+    if queryset is None:
+        queryset = Invoice.objects.all()
+    results = {}
+    with transaction.atomic():
+        # Lock only the invoices being finalized so two batches cannot overlap
+        invoices = {
+            row['id']: row for row in
+            queryset.select_related(None).prefetch_related(None).select_for_update()
+            .filter(id__in=invoice_ids)
+            .values('id', 'invoice_number', 'stock_applied', 'status', 'shop_id')
+        }
+        pending = []
+        for invoice_id in invoice_ids:
+            row = invoices.get(invoice_id)
+            if row is None:
+                results[invoice_id] = {'id': invoice_id, 'status': 'failed', 'error': 'Invoice not found'}
+            elif row['stock_applied']:
+                results[invoice_id] = {
+                    'id': invoice_id, 'invoice_number': row['invoice_number'],
+                    'status': 'skipped', 'error': 'Invoice already finalized',
+                }
+            elif invoice_id not in pending:
+                pending.append(invoice_id)
+
+        required_by_invoice = defaultdict(dict)
+        lines = (
+            InvoiceItem.objects.filter(invoice_id__in=pending, product__isnull=False)
+            .values('invoice_id', 'product_id')
+            .annotate(quantity=Sum('quantity'))
+            .values_list('invoice_id', 'product_id', 'quantity')
+        )
+        for invoice_id, product_id, quantity in lines:
+            required_by_invoice[invoice_id][product_id] = int(quantity)
+
+        # Reserved quantities are converted, so only the rest needs unreserved stock
+        held = held_stock(pending, lock=True)
+        unreserved_by_invoice = {
+            invoice_id: {
+                pid: qty - min(qty, held.get(invoice_id, {}).get(pid, 0)) for pid, qty in required.items()
+            }
+            for invoice_id, required in required_by_invoice.items()
+        }
+        product_ids = {pid for required in required_by_invoice.values() for pid in required}
+        products = Product.objects.filter(id__in=product_ids).values_list(
+            'id', 'name', 'stock_quantity', 'reserved_quantity', 'located_quantity'
+        )
+        location_id = stored_location_id(location)
+        at_location = location_available(product_ids, location_id) if location_id is not None else {}
+        unreserved, on_hand = {}, {}
+        for pid, name, available, reserved, located in products:
+            unreserved[pid] = (name, max(available - reserved, 0))
+            # Every unit, reserved or not, must also be at the location it leaves from
+            on_hand[pid] = (name, at_location.get(pid, 0) if location_id is not None else available - located)
+
+        accepted, failures = _plan(
+            pending, [(unreserved_by_invoice, unreserved), (required_by_invoice, on_hand)], mode
+        )
+        if mode == ALL_OR_NOTHING and any(result['status'] == 'failed' for result in results.values()):
+            accepted = []
+
+        if accepted:
+            totals = defaultdict(int)
+            reserved = defaultdict(int)
+            for invoice_id in accepted:
+                for product_id, qty in required_by_invoice.get(invoice_id, {}).items():
+                    totals[product_id] += qty
+                    reserved[product_id] += qty - unreserved_by_invoice[invoice_id][product_id]
+            deduct_stock(totals, reserved=reserved, location=location, movements=[
+                (product_id, qty, invoices[invoice_id]['invoice_number'])
+                for invoice_id in accepted
+                for product_id, qty in required_by_invoice.get(invoice_id, {}).items()
+            ])
+            forget_reservations(accepted)
+            Invoice.objects.filter(id__in=accepted).update(
+                stock_applied=True,
+                status=Case(When(status='draft', then=Value('due')), default=F('status')),
+                updated_at=timezone.now(),
+            )
+            record_invoices([invoice_id for invoice_id in accepted if invoices[invoice_id]['status'] != 'cancelled'])
+            invalidate_shops(*{invoices[invoice_id]['shop_id'] for invoice_id in accepted})
+            publish_invoice_changes(accepted)
+
+    for invoice_id in pending:
+        row = invoices[invoice_id]
+        if invoice_id in failures:
+            results[invoice_id] = {
+                'id': invoice_id, 'invoice_number': row['invoice_number'],
+                'status': 'failed', 'error': 'Insufficient stock', 'shortfalls': failures[invoice_id],
+            }
+        elif invoice_id in accepted:
+            results[invoice_id] = {'id': invoice_id, 'invoice_number': row['invoice_number'], 'status': 'finalized'}
+        else:
+            # All-or-nothing batch rolled back because of other invoices
+            results[invoice_id] = {
+                'id': invoice_id, 'invoice_number': row['invoice_number'],
+                'status': 'failed', 'error': 'Batch not applied',
+            }
+    return [results[invoice_id] for invoice_id in dict.fromkeys(invoice_ids)]
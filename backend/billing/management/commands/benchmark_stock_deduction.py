@@ -0,0 +1,107 @@
+import random
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction, OperationalError
+from django.utils import timezone
+
+from billing.models import Customer, Invoice, InvoiceItem
+from inventory.models import Product
+from users.models import User
+
+
+def locking_finalize(invoice_id):
+    """Previous implementation: lock every product row and save them one at a time"""
+    with transaction.atomic():
+        invoice = Invoice.objects.select_for_update().get(pk=invoice_id)
+        if invoice.stock_applied:
+            raise ValueError("Stock already applied for this invoice")
+        required = {}
+        for item in invoice.items.all():
+            required[item.product_id] = required.get(item.product_id, 0) + int(item.quantity)
+        products = {p.id: p for p in Product.objects.select_for_update().filter(id__in=list(required))}
+        for product_id, qty in required.items():
+            if products[product_id].stock_quantity < qty:
+                raise ValueError(f"Insufficient stock for {products[product_id].name}")
+        for product_id, qty in required.items():
+            product = products[product_id]
+            product.stock_quantity -= qty
+            product.save(update_fields=['stock_quantity'])
+        invoice.stock_applied = True
+        invoice.status = 'due'
+        invoice.save(update_fields=['stock_applied', 'status', 'updated_at'])
+
+
+def conditional_finalize(invoice_id):
+    """Current implementation: one guarded UPDATE per invoice"""
+    Invoice.objects.get(pk=invoice_id).apply_stock_adjustments()
+
+
+class Command(BaseCommand):
+    help = 'Compare row-locking and conditional-UPDATE stock deduction under contention'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--invoices', type=int, default=200, help='Invoices finalized per strategy')
+        parser.add_argument('--lines', type=int, default=5, help='Line items per invoice')
+        parser.add_argument('--products', type=int, default=20, help='Size of the shared (hot) product set')
+        parser.add_argument('--threads', type=int, default=8, help='Concurrent finalizing threads')
+
+    def handle(self, *args, **options):
+        shop = User.objects.create(username=f'bench-{uuid.uuid4().hex[:12]}', role='shop_owner', shop_name='Benchmark')
+        try:
+            for name, finalize in (('locking', locking_finalize), ('conditional', conditional_finalize)):
+                invoice_ids = self._create_invoices(shop, options)
+                elapsed, failures = self._run(finalize, invoice_ids, options['threads'])
+                done = len(invoice_ids) - failures
+                self.stdout.write(
+                    f'{name:>12}: {done} invoices in {elapsed:.2f}s '
+                    f'({done / elapsed:.1f}/s), {failures} failed'
+                )
+        finally:
+            Invoice.objects.filter(shop=shop).delete()
+            Product.objects.filter(shop=shop).delete()
+            shop.delete()
+
+    def _create_invoices(self, shop, options):
+        Product.objects.filter(shop=shop).delete()
+        products = Product.objects.bulk_create([
+            Product(name=f'Bench {i}', sku=f'BENCH-{i:04d}', price=10, stock_quantity=10 ** 6,
+                    shop=shop, created_by=shop)
+            for i in range(options['products'])
+        ])
+        customer, _ = Customer.objects.get_or_create(name='Benchmark customer', shop=shop)
+        today = timezone.now().date()
+        invoices = Invoice.objects.bulk_create([
+            Invoice(invoice_number=f'BENCH-{uuid.uuid4().hex[:12]}', customer=customer, shop=shop,
+                    created_by=shop, due_date=today + timedelta(days=30))
+            for _ in range(options['invoices'])
+        ])
+        lines = min(options['lines'], len(products))
+        InvoiceItem.objects.bulk_create([
+            InvoiceItem(invoice=invoice, product=product, quantity=random.randint(1, 3), unit_price=10)
+            for invoice in invoices
+            for product in random.sample(products, lines)
+        ])
+        return [invoice.id for invoice in invoices]
+
+    def _run(self, finalize, invoice_ids, threads):
+        def work(invoice_id):
+            try:
+                for attempt in range(5):
+                    try:
+                        finalize(invoice_id)
+                        return True
+                    except OperationalError:
+                        # SQLite reports lock contention as an error; retry
+                        time.sleep(0.01 * (attempt + 1))
+                return False
+            finally:
+                connection.close()
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=threads) as pool:
+            results = list(pool.map(work, invoice_ids))
+        return time.perf_counter() - started, results.count(False)
@@ -0,0 +1,24 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from billing.reservations import EXPIRE_BATCH_SIZE, expire_reservations, rebuild_reserved_counts
+
+
+class Command(BaseCommand):
+    help = 'Release stock held by draft invoices whose reservations have expired'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=EXPIRE_BATCH_SIZE, help='Reservations released per transaction')
+        parser.add_argument('--rebuild', action='store_true',
+                            help='Also reset product reserved counts that disagree with live reservations')
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        released = expire_reservations(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Released {released} expired reservations in {time.perf_counter() - started:.1f}s'
+        ))
+        if options['rebuild']:
+            fixed = rebuild_reserved_counts()
+            self.stdout.write(self.style.SUCCESS(f'Reset reserved counts on {fixed} products'))
@@ -0,0 +1,34 @@
+import csv
+
+from django.core.management.base import BaseCommand, CommandError
+
+from billing.reconciliation import import_statement
+from users.models import User
+
+
+class Command(BaseCommand):
+    help = 'Reconcile a bank/UPI statement CSV against open invoices of a shop'
+
+    def add_arguments(self, parser):
+        parser.add_argument('statement', help='Path to the statement CSV')
+        parser.add_argument('--shop', type=int, required=True, help='Shop (user id) the statement belongs to')
+
+    def handle(self, *args, **options):
+        shop = User.objects.filter(pk=options['shop']).first()
+        if shop is None:
+            raise CommandError(f"Shop {options['shop']} not found")
+
+        try:
+            with open(options['statement'], newline='', encoding='utf-8-sig') as statement:
+                summary = import_statement(shop, csv.reader(statement), shop)
+        except OSError as e:
+            raise CommandError(f'Cannot read statement: {e}')
+        except (ValueError, csv.Error) as e:
+            raise CommandError(str(e))
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Import {summary['import_id']}: {summary['lines']} lines, "
+            f"{summary['matched']} matched ({summary['matched_amount']}), "
+            f"{summary['ambiguous']} ambiguous, {summary['unmatched']} unmatched, "
+            f"{summary['duplicates']} duplicates, {summary['skipped']} skipped"
+        ))
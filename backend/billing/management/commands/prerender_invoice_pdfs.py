@@ -0,0 +1,48 @@
+from datetime import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+
+from billing.models import Invoice
+from billing.pdf import render_invoices
+
+
+class Command(BaseCommand):
+    help = 'Pre-render and cache invoice PDFs for a date range across a process pool'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--start-date', help='First invoice date (YYYY-MM-DD)')
+        parser.add_argument('--end-date', help='Last invoice date (YYYY-MM-DD)')
+        parser.add_argument('--shop', type=int, help='Only render invoices of this shop (user id)')
+        parser.add_argument('--workers', type=int, help='Worker processes (defaults to INVOICE_PDF_WORKERS or CPU count)')
+
+    def _date(self, value, option):
+        try:
+            return datetime.strptime(value, '%Y-%m-%d').date()
+        except ValueError:
+            raise CommandError(f'{option} must be in YYYY-MM-DD format')
+
+    def handle(self, *args, **options):
+        invoices = Invoice.objects.all()
+        if options['start_date']:
+            invoices = invoices.filter(invoice_date__gte=self._date(options['start_date'], '--start-date'))
+        if options['end_date']:
+            invoices = invoices.filter(invoice_date__lte=self._date(options['end_date'], '--end-date'))
+        if options['shop']:
+            invoices = invoices.filter(shop_id=options['shop'])
+
+        invoice_ids = list(invoices.order_by('id').values_list('id', flat=True))
+        if not invoice_ids:
+            self.stdout.write('No invoices in range')
+            return
+
+        failed = 0
+        for invoice_id, result in render_invoices(invoice_ids, workers=options['workers']):
+            if isinstance(result, Exception):
+                failed += 1
+                self.stderr.write(f'Invoice {invoice_id}: {result}')
+            elif options['verbosity'] > 1:
+                self.stdout.write(f'Invoice {invoice_id}: {result}')
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Rendered {len(invoice_ids) - failed} of {len(invoice_ids)} invoice PDFs'
+        ))
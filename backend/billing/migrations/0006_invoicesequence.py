@@ -0,0 +1,54 @@
+# Generated by Django 5.2.5 on 2026-10-17 00:46
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def seed_invoice_sequences(apps, schema_editor):
+    """Start each (shop, year) counter after the highest existing INV-YYYY-NNNN number"""
+    Invoice = apps.get_model('billing', 'Invoice')
+    InvoiceSequence = apps.get_model('billing', 'InvoiceSequence')
+
+    highest = {}
+    numbers = Invoice.objects.filter(invoice_number__startswith='INV-').values_list('shop_id', 'invoice_number')
+    for shop_id, invoice_number in numbers.iterator():
+        parts = invoice_number.split('-')
+        if len(parts) != 3:
+            continue
+        try:
+            year, value = int(parts[1]), int(parts[2])
+        except ValueError:
+            continue
+        key = (shop_id, year)
+        highest[key] = max(highest.get(key, 0), value)
+
+    InvoiceSequence.objects.bulk_create([
+        InvoiceSequence(shop_id=shop_id, year=year, next_value=value + 1)
+        for (shop_id, year), value in highest.items()
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('billing', '0005_customer_shop_invoice_shop_and_more'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='InvoiceSequence',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('year', models.PositiveIntegerField()),
+                ('next_value', models.PositiveIntegerField(default=1)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('shop', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='invoice_sequences', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'unique_together': {('shop', 'year')},
+            },
+        ),
+        migrations.RunPython(seed_invoice_sequences, migrations.RunPython.noop),
+    ]
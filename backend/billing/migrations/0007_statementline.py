@@ -0,0 +1,42 @@
+# Generated by Django 5.2.5 on 2026-10-17 00:57
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('billing', '0006_invoicesequence'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StatementLine',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('import_id', models.UUIDField(db_index=True)),
+                ('line_number', models.PositiveIntegerField()),
+                ('transaction_date', models.DateField(blank=True, null=True)),
+                ('amount', models.DecimalField(blank=True, decimal_places=2, max_digits=12, null=True)),
+                ('reference_number', models.CharField(blank=True, max_length=100)),
+                ('description', models.TextField(blank=True)),
+                ('phone', models.CharField(blank=True, max_length=20)),
+                ('gstin', models.CharField(blank=True, max_length=15)),
+                ('status', models.CharField(choices=[('unmatched', 'Unmatched'), ('ambiguous', 'Ambiguous'), ('resolved', 'Resolved'), ('ignored', 'Ignored')], default='unmatched', max_length=20)),
+                ('reason', models.CharField(blank=True, max_length=200)),
+                ('candidate_invoices', models.JSONField(blank=True, default=list)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('resolved_at', models.DateTimeField(blank=True, null=True)),
+                ('created_by', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+                ('payment', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='statement_lines', to='billing.payment')),
+                ('shop', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='statement_lines', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['-created_at', 'line_number'],
+                'indexes': [models.Index(fields=['shop', 'status'], name='billing_sta_shop_id_27ba14_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.2.5 on 2026-10-17 01:13
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('billing', '0007_statementline'),
+        ('inventory', '0009_product_reserved_quantity'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StockReservation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('quantity', models.PositiveIntegerField()),
+                ('expires_at', models.DateTimeField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('invoice', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='reservations', to='billing.invoice')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='reservations', to='inventory.product')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['expires_at'], name='billing_sto_expires_e15187_idx')],
+                'unique_together': {('invoice', 'product')},
+            },
+        ),
+    ]
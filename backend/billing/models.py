@@ -1,6 +1,7 @@
 from django.db import models
+from django.db.models import Case, F, Sum, Value, When
 from django.contrib.auth import get_user_model
-from decimal import Decimal
+from decimal import Decimal, ROUND_HALF_UP
 from django.core.validators import MinValueValidator
 from django.utils import timezone
 from django.db import transaction
@@ -78,32 +79,56 @@ class Invoice(models.Model):
         ordering = ['-created_at']
         unique_together = ['invoice_number', 'shop']  # Same invoice number can exist in different shops
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember the stored status and date so save() can detect changes
+        stored = dict(zip(field_names, values))
+        instance._loaded_status = stored.get('status')
+        instance._loaded_invoice_date = stored.get('invoice_date')
+        return instance
+
     def save(self, *args, **kwargs):
-        # Generate invoice number if not provided
-        if not self.invoice_number:
-            year = timezone.now().year
-            last_invoice = Invoice.objects.filter(
-                shop=self.shop,
-                invoice_number__startswith=f'INV-{year}-'
-            ).order_by('-invoice_number').first()
-            
-            if last_invoice:
-                try:
-                    last_num = int(last_invoice.invoice_number.split('-')[-1])
-                    new_num = last_num + 1
-                except (ValueError, IndexError):
-                    new_num = 1
-            else:
-                new_num = 1
-            
-            self.invoice_number = f"INV-{year}-{new_num:04d}"
-        
         # Set due date if not provided (30 days from invoice date)
         if not self.due_date:
             from datetime import timedelta
             self.due_date = self.invoice_date + timedelta(days=30)
-        
-        super().save(*args, **kwargs)
+
+        if self.invoice_number:
+            old_status = getattr(self, '_loaded_status', None)
+            old_date = getattr(self, '_loaded_invoice_date', None)
+            # The sales cube files a finalized invoice under its date
+            if self.stock_applied and old_date is not None and old_date != self.invoice_date:
+                raise ValueError("Cannot change the date of a finalized invoice")
+            with transaction.atomic():
+                super().save(*args, **kwargs)
+                if old_status is not None and old_status != self.status:
+                    # Cancelling (or restoring) a finalized invoice moves it in the sales cube
+                    from reports.cube import sync_status_change
+                    sync_status_change(self, old_status)
+                    if self.status == 'cancelled' and not self.stock_applied:
+                        from .reservations import release_reservations
+                        release_reservations([self.pk])
+            self._loaded_status = self.status
+            self._loaded_invoice_date = self.invoice_date
+            return
+
+        # Generate invoice number from the shop's sequence. Allocation shares the
+        # insert's transaction so gapless mode rolls the number back with it.
+        from .sequences import allocate_invoice_number
+        try:
+            with transaction.atomic():
+                self.invoice_number = allocate_invoice_number(self.shop_id)
+                super().save(*args, **kwargs)
+        except Exception:
+            self.invoice_number = ''
+            raise
+
+    def delete(self, *args, **kwargs):
+        from .reservations import release_reservations
+        with transaction.atomic():
+            release_reservations([self.pk])
+            return super().delete(*args, **kwargs)
 
     def __str__(self):
         return f"{self.invoice_number} - {self.customer.name}"
@@ -119,69 +144,125 @@ class Invoice(models.Model):
         return self.total_amount - self.paid_amount
 
     def calculate_totals(self):
-        """Calculate invoice totals from items"""
-        items = self.items.all()
-        
-        self.subtotal = sum(item.line_total for item in items)
-        self.tax_amount = sum(item.tax_amount for item in items)
+        """Recalculate invoice totals from items with a single aggregate query"""
+        amount_field = models.DecimalField(max_digits=14, decimal_places=4)
+        line_total = F('quantity') * F('unit_price')
+        totals = self.items.aggregate(
+            subtotal=Sum(line_total, output_field=amount_field),
+            tax_amount=Sum(line_total * F('tax_rate') * Value(Decimal('0.01')), output_field=amount_field),
+        )
+
+        cents = Decimal('0.01')
+        self.subtotal = Decimal(totals['subtotal'] or 0).quantize(cents, rounding=ROUND_HALF_UP)
+        self.tax_amount = Decimal(totals['tax_amount'] or 0).quantize(cents, rounding=ROUND_HALF_UP)
         self.total_amount = self.subtotal + self.tax_amount - self.discount_amount
-        
+
         # Use update to avoid recursion
         Invoice.objects.filter(id=self.id).update(
             subtotal=self.subtotal,
             tax_amount=self.tax_amount,
             total_amount=self.total_amount
         )
+        from reports.cache import invalidate_shops
+        invalidate_shops(self.shop_id)
+
+    def write_items(self, items_data, replace=False):
+        """Bulk-insert line items, recalculate totals once and reserve their stock.
+
+        ``items_data`` is a list of dicts with product, description, quantity,
+        unit_price and tax_rate keys. With ``replace`` the existing items are
+        deleted first. Raises InsufficientStock if the stock cannot be reserved.
+        """
+        if self.stock_applied:
+            raise ValueError("Cannot modify items of a finalized invoice")
+
+        items = []
+        for item_data in items_data:
+            # Allow manual line items without a product
+            item = InvoiceItem(
+                invoice=self,
+                product=item_data.get('product'),
+                description=item_data.get('description', ''),
+                quantity=item_data.get('quantity', 1),
+                unit_price=item_data.get('unit_price', 0),
+                tax_rate=item_data.get('tax_rate', 0),
+            )
+            item.apply_product_defaults()
+            items.append(item)
+
+        with transaction.atomic():
+            if replace:
+                self.items.all().delete()
+            InvoiceItem.objects.bulk_create(items)
+            self.calculate_totals()
+            from .reservations import sync_reservations
+            sync_reservations(self)
+        return items
+
+    def required_stock(self):
+        """Return {product_id: quantity} needed by this invoice's product lines"""
+        rows = (
+            self.items.filter(product__isnull=False)
+            .values('product_id')
+            .annotate(quantity=Sum('quantity'))
+            .values_list('product_id', 'quantity')
+        )
+        return dict(rows)
 
-    def apply_stock_adjustments(self):
-        """Apply stock deductions for all items atomically.
+    def apply_stock_adjustments(self, location=None):
+        """Apply stock deductions for all items atomically, converting the draft's reservations.
+        Stock is taken from ``location`` (a StockLocation), or the shop's default location.
         Raises ValueError if stock is insufficient or stock already applied.
         """
         if self.stock_applied:
             raise ValueError("Stock already applied for this invoice")
 
-        # Fetch related items and lock products rows for update to avoid races
-        from inventory.models import Product
+        from inventory.stock import deduct_stock
+        from .reservations import forget_reservations, held_stock
         with transaction.atomic():
-            # Gather product ids from items
-            invoice_items = list(self.items.select_related('product'))
-            product_id_to_required_qty = {}
-            for item in invoice_items:
-                if not item.product_id:
-                    # Skip manual line items without a product
-                    continue
-                product_id_to_required_qty[item.product_id] = (
-                    product_id_to_required_qty.get(item.product_id, 0) + int(item.quantity)
-                )
-
-            # Lock all involved product rows
-            locked_products = (
-                Product.objects.select_for_update()
-                .filter(id__in=list(product_id_to_required_qty.keys()))
+            # Flip the flag first; the guard makes a concurrent finalize of the
+            # same invoice match no rows instead of deducting twice
+            marked = Invoice.objects.filter(pk=self.pk, stock_applied=False).update(
+                stock_applied=True,
+                status=Case(When(status='draft', then=Value('due')), default=F('status')),
+                updated_at=timezone.now(),
             )
-            products_by_id = {p.id: p for p in locked_products}
-
-            # Validate stock
-            for product_id, required_qty in product_id_to_required_qty.items():
-                product = products_by_id.get(product_id)
-                if product is None:
-                    raise ValueError("Product not found while applying stock")
-                if int(product.stock_quantity) < int(required_qty):
-                    raise ValueError(
-                        f"Insufficient stock for {product.name} (needed {required_qty}, available {product.stock_quantity})"
-                    )
-
-            # Apply deductions
-            for product_id, required_qty in product_id_to_required_qty.items():
-                product = products_by_id[product_id]
-                product.stock_quantity = int(product.stock_quantity) - int(required_qty)
-                product.save(update_fields=['stock_quantity'])
-
-            # Mark applied and move status if still draft
-            self.stock_applied = True
-            if self.status == 'draft':
-                self.status = 'due'
-            self.save(update_fields=['stock_applied', 'status', 'updated_at'])
+            if not marked:
+                raise ValueError("Stock already applied for this invoice")
+
+            # One guarded UPDATE for all products converts the reserved quantities;
+            # only lines whose reservation lapsed still need free stock
+            held = held_stock([self.pk], lock=True).get(self.pk, {})
+            deduct_stock(self.required_stock(), reference=self.invoice_number, reserved=held, location=location)
+            forget_reservations([self.pk])
+
+            if self.status != 'cancelled':
+                from reports.cube import record_invoices
+                record_invoices([self.pk])
+
+            from reports.cache import invalidate_shops
+            invalidate_shops(self.shop_id)
+            from events.broker import publish_invoice_changes
+            publish_invoice_changes([self.pk])
+
+        self.stock_applied = True
+        if self.status == 'draft':
+            self.status = 'due'
+        self._loaded_status = self.status
+
+
+class InvoiceSequence(models.Model):
+    """Per-shop, per-year counter backing INV-YYYY-NNNN invoice numbers"""
+    shop = models.ForeignKey(User, on_delete=models.CASCADE, related_name='invoice_sequences')
+    year = models.PositiveIntegerField()
+    next_value = models.PositiveIntegerField(default=1)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ['shop', 'year']
+
+    def __str__(self):
+        return f"{self.shop_id}/{self.year}: next {self.next_value}"
 
 
 class InvoiceItem(models.Model):
@@ -213,29 +294,37 @@ class InvoiceItem(models.Model):
         """Calculate total including tax"""
         return self.line_total + self.tax_amount
 
-    def save(self, *args, **kwargs):
-        # Set unit price from product if not provided
+    def apply_product_defaults(self):
+        """Fill unit price and tax rate from the product when not provided"""
         if not self.unit_price and self.product:
             self.unit_price = self.product.price
-        
-        # Set tax rate from product if not provided
+
         if not self.tax_rate and self.product and hasattr(self.product, 'gst_rate'):
             self.tax_rate = self.product.gst_rate
-        
-        super().save(*args, **kwargs)
-        
-        # Recalculate invoice totals
-        if self.invoice_id:
-            self.invoice.calculate_totals()
+
+    def save(self, *args, **kwargs):
+        self.apply_product_defaults()
+        from .reservations import sync_reservations
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+
+            # Recalculate invoice totals and reservations (batched writers use
+            # Invoice.write_items, which bulk-inserts and recalculates once)
+            if self.invoice_id:
+                self.invoice.calculate_totals()
+                sync_reservations(self.invoice)
 
     def delete(self, *args, **kwargs):
         invoice = self.invoice
         # Prevent deleting items if invoice is finalized
         if invoice.stock_applied:
             raise ValueError("Cannot modify items of a finalized invoice")
-        super().delete(*args, **kwargs)
-        # Recalculate totals after deletion
-        invoice.calculate_totals()
+        from .reservations import sync_reservations
+        with transaction.atomic():
+            super().delete(*args, **kwargs)
+            # Recalculate totals and give back the line's stock after deletion
+            invoice.calculate_totals()
+            sync_reservations(invoice, reserve=False)
 
 
 class Payment(models.Model):
@@ -259,17 +348,60 @@ class Payment(models.Model):
         return f"Payment {self.amount} for {self.invoice.invoice_number}"
 
     def save(self, *args, **kwargs):
-        # When saving a payment, update the invoice paid_amount and status with rounding and clamping
-        creating = self._state.adding
-        super().save(*args, **kwargs)
-        if creating:
-            from decimal import ROUND_HALF_UP
-            invoice = self.invoice
-            invoice.paid_amount = (Decimal(invoice.paid_amount) + Decimal(self.amount)).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
-            if invoice.paid_amount >= invoice.total_amount:
-                invoice.paid_amount = invoice.total_amount
-                invoice.status = 'paid'
-                invoice.paid_date = timezone.now().date()
-            elif invoice.paid_amount > Decimal('0.00'):
-                invoice.status = 'partial'
-            invoice.save(update_fields=['paid_amount', 'status', 'paid_date', 'updated_at'])
\ No newline at end of file
+        # A new payment is added to the invoice with a set-based update, never read-modify-write
+        if not self._state.adding:
+            return super().save(*args, **kwargs)
+        from .payments import apply_payment_totals, quantize_amount
+        self.amount = quantize_amount(self.amount)
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            apply_payment_totals({self.invoice_id: self.amount})
+
+class StatementLine(models.Model):
+    """Bank/UPI statement line that an import could not match to a single invoice"""
+    STATUS_CHOICES = [
+        ('unmatched', 'Unmatched'),
+        ('ambiguous', 'Ambiguous'),
+        ('resolved', 'Resolved'),
+        ('ignored', 'Ignored'),
+    ]
+
+    shop = models.ForeignKey(User, on_delete=models.CASCADE, related_name='statement_lines')
+    import_id = models.UUIDField(db_index=True)
+    line_number = models.PositiveIntegerField()
+    transaction_date = models.DateField(null=True, blank=True)
+    amount = models.DecimalField(max_digits=12, decimal_places=2, null=True, blank=True)
+    reference_number = models.CharField(max_length=100, blank=True)
+    description = models.TextField(blank=True)
+    phone = models.CharField(max_length=20, blank=True)
+    gstin = models.CharField(max_length=15, blank=True)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='unmatched')
+    reason = models.CharField(max_length=200, blank=True)
+    candidate_invoices = models.JSONField(default=list, blank=True)
+    payment = models.ForeignKey(Payment, on_delete=models.SET_NULL, null=True, blank=True, related_name='statement_lines')
+    created_by = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    created_at = models.DateTimeField(auto_now_add=True)
+    resolved_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['-created_at', 'line_number']
+        indexes = [models.Index(fields=['shop', 'status'])]
+
+    def __str__(self):
+        return f"Statement line {self.line_number} ({self.status})"
+
+
+class StockReservation(models.Model):
+    """Stock held for a draft invoice's product lines until it is finalized or the hold expires"""
+    invoice = models.ForeignKey(Invoice, on_delete=models.CASCADE, related_name='reservations')
+    product = models.ForeignKey('inventory.Product', on_delete=models.CASCADE, related_name='reservations')
+    quantity = models.PositiveIntegerField()
+    expires_at = models.DateTimeField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        unique_together = ['invoice', 'product']
+        indexes = [models.Index(fields=['expires_at'])]
+
+    def __str__(self):
+        return f"{self.invoice_id}: {self.quantity} x {self.product_id} until {self.expires_at:%Y-%m-%d %H:%M}"
@@ -0,0 +1,122 @@
+"""Posting payments against invoices.
+
+Each posting locks its invoices, checks every amount against the remaining
+balance, inserts the Payment rows and moves the invoices' ``paid_amount``,
+``status`` and ``paid_date`` with one set-based UPDATE
+(``paid_amount = paid_amount + n``), so concurrent payments on the same invoice
+cannot overwrite each other. A payment larger than the invoice's remaining
+balance is rejected, so ``paid_amount`` never exceeds the total and the Payment
+rows always add up to it.
+"""
+from collections import defaultdict
+from decimal import Decimal, ROUND_HALF_UP
+
+from django.db import transaction
+from django.db.models import Case, DecimalField, F, Q, Value, When
+from django.utils import timezone
+
+from events.broker import PAYMENT, publish_invoice_changes
+from reports.cache import invalidate_shops
+from reports.cube import record_status_changes
+
+CENT = Decimal('0.01')
+
+
+def quantize_amount(amount):
+    """Round an amount to paise the way invoices store it"""
+    return Decimal(str(amount)).quantize(CENT, rounding=ROUND_HALF_UP)
+
+
+def apply_payment_totals(totals):
+    """Add {invoice_id: amount} to the invoices' paid_amount.
+
+    Status becomes 'paid' (and paid_date is set) once the total is covered,
+    otherwise 'partial'. The invoices are locked first, in id order, and
+    ValueError is raised if an amount exceeds an invoice's remaining balance;
+    the status each one had is then moved in the sales cube. Every SET
+    expression reads the pre-update row. Returns the number of invoices updated.
+    """
+    from .models import Invoice
+
+    totals = {invoice_id: amount for invoice_id, amount in totals.items() if amount}
+    if not totals:
+        return 0
+
+    added = Case(
+        *[When(id=invoice_id, then=Value(amount)) for invoice_id, amount in totals.items()],
+        default=Value(Decimal('0.00')),
+        output_field=DecimalField(max_digits=12, decimal_places=2),
+    )
+    new_paid = F('paid_amount') + added
+    covered = Q(total_amount__lte=new_paid)
+    with transaction.atomic():
+        old_statuses = {}
+        locked = (
+            Invoice.objects.select_for_update().filter(id__in=list(totals)).order_by('id')
+            .values_list('id', 'invoice_number', 'status', 'paid_amount', 'total_amount')
+        )
+        for invoice_id, invoice_number, old_status, paid_amount, total_amount in locked:
+            balance = total_amount - paid_amount
+            if totals[invoice_id] > balance:
+                raise ValueError(
+                    f"Payment of {totals[invoice_id]} exceeds the balance of {balance} on invoice {invoice_number}"
+                )
+            old_statuses[invoice_id] = old_status
+        updated = Invoice.objects.filter(id__in=list(totals)).update(
+            paid_amount=new_paid,
+            status=Case(
+                When(covered, then=Value('paid')),
+                When(Q(paid_amount__gt=-added), then=Value('partial')),
+                default=F('status'),
+            ),
+            paid_date=Case(
+                When(covered, then=Value(timezone.now().date())),
+                default=F('paid_date'),
+            ),
+            updated_at=timezone.now(),
+        )
+        changes = {
+            invoice_id: (old_statuses[invoice_id], new_status)
+            for invoice_id, new_status in Invoice.objects.filter(id__in=list(old_statuses)).values_list('id', 'status')
+            if new_status != old_statuses[invoice_id]
+        }
+        record_status_changes(changes)
+    publish_invoice_changes(totals, PAYMENT, extra={
+        invoice_id: {'amount': str(amount)} for invoice_id, amount in totals.items()
+    })
+    return updated
+
+
+def post_payments(payments):
+    """Insert unsaved Payment instances and apply them to their invoices in one transaction.
+
+    Amounts are rounded to paise first. Raises ValueError, posting nothing, if
+    an amount is not positive or exceeds its invoice's remaining balance.
+    Returns the saved payments.
+    """
+    from .models import Invoice, Payment
+
+    payments = list(payments)
+    if not payments:
+        return payments
+
+    totals = defaultdict(Decimal)
+    for payment in payments:
+        payment.amount = quantize_amount(payment.amount)
+        if payment.amount <= 0:
+            raise ValueError("Payment amount must be positive")
+        totals[payment.invoice_id] += payment.amount
+
+    with transaction.atomic():
+        Payment.objects.bulk_create(payments)
+        apply_payment_totals(totals)
+        invalidate_shops(*Invoice.objects.filter(id__in=list(totals)).values_list('shop_id', flat=True).distinct())
+    return payments
+
+
+def post_payment(invoice, amount, created_by, **fields):
+    """Record one payment for an invoice (method, reference and notes go in fields)"""
+    from .models import Payment
+
+    payment = Payment(invoice=invoice, amount=amount, created_by=created_by, **fields)
+    return post_payments([payment])[0]
@@ -0,0 +1,333 @@
+"""Invoice PDF rendering with an on-disk cache.
+
+Rendered files live under ``MEDIA_ROOT/invoices/pdf/<shop id>/`` and are named
+after a hash of everything printed on the invoice (the invoice, customer and
+shop ``updated_at`` stamps, totals and line items). A repeat download of an
+unchanged invoice is served straight from disk; any change produces a new
+fingerprint and the stale file is replaced.
+
+This module imports no models at import time so it can be loaded by freshly
+spawned worker processes before Django is set up.
+"""
+import hashlib
+import multiprocessing
+import os
+import re
+import tempfile
+import zipfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from decimal import Decimal, ROUND_HALF_UP
+from io import BytesIO
+from pathlib import Path
+from xml.sax.saxutils import escape
+
+from django.conf import settings
+from reportlab.lib import colors
+from reportlab.lib.pagesizes import A4
+from reportlab.lib.styles import getSampleStyleSheet
+from reportlab.lib.units import mm
+from reportlab.platypus import Paragraph, SimpleDocTemplate, Spacer, Table, TableStyle
+
+CENTS = Decimal('0.01')
+
+
+def _money(value):
+    return Decimal(value or 0).quantize(CENTS, rounding=ROUND_HALF_UP)
+
+
+def pdf_directory(shop_id):
+    return Path(settings.MEDIA_ROOT) / 'invoices' / 'pdf' / str(shop_id)
+
+
+def invoice_fingerprint(invoice, items):
+    """Hash of the data printed on the invoice"""
+    parts = [
+        invoice.invoice_number, invoice.status, invoice.updated_at.isoformat(),
+        invoice.customer.updated_at.isoformat(), invoice.shop.updated_at.isoformat(),
+        invoice.subtotal, invoice.tax_amount, invoice.discount_amount,
+        invoice.total_amount, invoice.paid_amount,
+    ]
+    for item in items:
+        product = item.product
+        parts.extend([
+            item.id, item.description, item.quantity, item.unit_price, item.tax_rate,
+            product.name if product else '', product.sku if product else '',
+        ])
+    return hashlib.sha256('|'.join(str(part) for part in parts).encode()).hexdigest()
+
+
+def invoice_pdf_path(invoice, fingerprint):
+    return pdf_directory(invoice.shop_id) / f'{invoice.pk}-{fingerprint[:20]}.pdf'
+
+
+def _gst_breakdown(invoice, items):
+    """Taxable value and tax per GST rate; IGST when customer and shop states differ"""
+    shop_state = (invoice.shop.state or '').strip().lower()
+    customer_state = (invoice.customer.state or '').strip().lower()
+    inter_state = bool(shop_state and customer_state and shop_state != customer_state)
+
+    by_rate = {}
+    for item in items:
+        taxable, tax = by_rate.get(item.tax_rate, (Decimal('0'), Decimal('0')))
+        by_rate[item.tax_rate] = (taxable + item.line_total, tax + item.tax_amount)
+
+    rows = []
+    for rate in sorted(by_rate):
+        taxable, tax = by_rate[rate]
+        tax = _money(tax)
+        if inter_state:
+            rows.append([f'{rate}%', _money(taxable), '-', '-', tax])
+        else:
+            half = _money(tax / 2)
+            rows.append([f'{rate}%', _money(taxable), half, tax - half, '-'])
+    return rows
+
+
+def render_invoice_pdf(invoice, items):
+    """Render an invoice and its items to PDF bytes"""
+    styles = getSampleStyleSheet()
+    shop = invoice.shop
+    customer = invoice.customer
+    buffer = BytesIO()
+    document = SimpleDocTemplate(
+        buffer, pagesize=A4, title=invoice.invoice_number,
+        leftMargin=15 * mm, rightMargin=15 * mm, topMargin=15 * mm, bottomMargin=15 * mm,
+    )
+
+    shop_lines = [shop.shop_name or shop.username]
+    shop_lines += [part for part in [
+        shop.address,
+        ', '.join(part for part in [shop.city, shop.state, shop.postal_code] if part),
+        shop.phone and f'Phone: {shop.phone}',
+        shop.email and f'Email: {shop.email}',
+    ] if part]
+    customer_lines = [customer.name, customer.full_address]
+    if customer.gstin:
+        customer_lines.append(f'GSTIN: {customer.gstin}')
+    if customer.phone:
+        customer_lines.append(f'Phone: {customer.phone}')
+
+    story = [
+        Paragraph('<br/>'.join(escape(str(line)) for line in shop_lines), styles['Normal']),
+        Spacer(1, 6 * mm),
+        Paragraph(f'Tax Invoice {escape(invoice.invoice_number)}', styles['Title']),
+        Table([
+            ['Invoice date', str(invoice.invoice_date), 'Due date', str(invoice.due_date)],
+            ['Status', invoice.get_status_display(), 'Paid date', str(invoice.paid_date or '-')],
+        ], colWidths=[30 * mm, 55 * mm, 30 * mm, 55 * mm]),
+        Spacer(1, 4 * mm),
+        Paragraph('<b>Bill to</b><br/>' + '<br/>'.join(escape(line) for line in customer_lines if line), styles['Normal']),
+        Spacer(1, 6 * mm),
+    ]
+
+    item_rows = [['#', 'Item', 'Qty', 'Rate', 'GST %', 'Amount']]
+    for index, item in enumerate(items, start=1):
+        name = item.description or (item.product.name if item.product else '')
+        if item.product:
+            name = f'{name} ({item.product.sku})'
+        item_rows.append([
+            index, Paragraph(escape(name), styles['Normal']), item.quantity,
+            _money(item.unit_price), item.tax_rate, _money(item.line_total),
+        ])
+    item_table = Table(item_rows, colWidths=[10 * mm, 80 * mm, 15 * mm, 25 * mm, 15 * mm, 30 * mm], repeatRows=1)
+    item_table.setStyle(TableStyle([
+        ('BACKGROUND', (0, 0), (-1, 0), colors.lightgrey),
+        ('GRID', (0, 0), (-1, -1), 0.25, colors.grey),
+        ('ALIGN', (2, 1), (-1, -1), 'RIGHT'),
+        ('VALIGN', (0, 0), (-1, -1), 'TOP'),
+    ]))
+    story += [item_table, Spacer(1, 6 * mm)]
+
+    gst_rows = [['GST rate', 'Taxable value', 'CGST', 'SGST', 'IGST']] + _gst_breakdown(invoice, items)
+    gst_table = Table(gst_rows, colWidths=[25 * mm, 40 * mm, 30 * mm, 30 * mm, 30 * mm])
+    gst_table.setStyle(TableStyle([
+        ('BACKGROUND', (0, 0), (-1, 0), colors.lightgrey),
+        ('GRID', (0, 0), (-1, -1), 0.25, colors.grey),
+        ('ALIGN', (1, 1), (-1, -1), 'RIGHT'),
+    ]))
+    story += [gst_table, Spacer(1, 6 * mm)]
+
+    totals_table = Table([
+        ['Subtotal', _money(invoice.subtotal)],
+        ['Tax', _money(invoice.tax_amount)],
+        ['Discount', _money(invoice.discount_amount)],
+        ['Total', _money(invoice.total_amount)],
+        ['Paid', _money(invoice.paid_amount)],
+        ['Balance due', _money(invoice.remaining_amount)],
+    ], colWidths=[40 * mm, 35 * mm], hAlign='RIGHT')
+    totals_table.setStyle(TableStyle([
+        ('ALIGN', (1, 0), (1, -1), 'RIGHT'),
+        ('LINEABOVE', (0, 3), (-1, 3), 0.5, colors.black),
+        ('FONTNAME', (0, 3), (-1, 3), 'Helvetica-Bold'),
+    ]))
+    story.append(totals_table)
+
+    for title, text in (('Notes', invoice.notes), ('Terms', invoice.terms)):
+        if text:
+            text = escape(text).replace('\n', '<br/>')
+            story += [Spacer(1, 4 * mm), Paragraph(f'<b>{title}</b><br/>{text}', styles['Normal'])]
+
+    document.build(story)
+    return buffer.getvalue()
+
+
+def get_invoice_pdf(invoice):
+    """Return the path of the invoice's PDF, rendering it only if the cached copy is stale"""
+    items = list(invoice.items.all())
+    fingerprint = invoice_fingerprint(invoice, items)
+    path = invoice_pdf_path(invoice, fingerprint)
+    if path.exists():
+        return path
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    content = render_invoice_pdf(invoice, items)
+    # Write to a temporary file and rename so readers never see a partial PDF
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, suffix='.tmp')
+    with os.fdopen(fd, 'wb') as tmp:
+        tmp.write(content)
+    os.replace(tmp_path, path)
+
+    for stale in path.parent.glob(f'{invoice.pk}-*.pdf'):
+        if stale != path:
+            stale.unlink(missing_ok=True)
+    return path
+
+
+def load_invoice(invoice_id):
+    """Fetch an invoice with everything the PDF prints"""
+    from .models import Invoice
+    return (
+        Invoice.objects.select_related('customer', 'shop')
+        .prefetch_related('items__product')
+        .get(pk=invoice_id)
+    )
+
+
+def load_invoices(invoice_ids, chunk_size=200):
+    """Iterate invoices with everything the PDF prints, a chunk at a time"""
+    from .models import Invoice
+    return (
+        Invoice.objects.filter(id__in=invoice_ids)
+        .select_related('customer', 'shop')
+        .prefetch_related('items__product')
+        .order_by('id')
+        .iterator(chunk_size=chunk_size)
+    )
+
+
+def _init_worker():
+    import django
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
+    django.setup()
+
+
+def _render_in_worker(invoice_id):
+    from django.db import close_old_connections
+    close_old_connections()
+    return invoice_id, str(get_invoice_pdf(load_invoice(invoice_id)))
+
+
+# Worker processes per bulk download unless INVOICE_PDF_WORKERS says otherwise;
+# each download starts its own pool inside the web worker, so keep it small
+DEFAULT_PDF_WORKERS = 2
+
+
+def render_invoices(invoice_ids, workers=None):
+    """Render PDFs for many invoices across a process pool.
+
+    Yields (invoice_id, path or exception) as each invoice completes. Closing
+    the generator (a client that disconnected) cancels the renders that have
+    not started.
+    """
+    workers = workers or getattr(settings, 'INVOICE_PDF_WORKERS', None) or DEFAULT_PDF_WORKERS
+    workers = max(1, min(workers, len(invoice_ids)))
+    # Spawned (not forked) workers so open DB connections and threads are not inherited
+    context = multiprocessing.get_context('spawn')
+    pool = ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=_init_worker)
+    try:
+        futures = {pool.submit(_render_in_worker, invoice_id): invoice_id for invoice_id in invoice_ids}
+        for future in as_completed(futures):
+            try:
+                yield future.result()
+            except Exception as e:
+                yield futures[future], e
+    finally:
+        pool.shutdown(cancel_futures=True)
+
+
+# Below this many missing PDFs, rendering inline beats starting worker processes
+INLINE_RENDER_LIMIT = 2
+
+
+def invoice_pdf_files(invoice_ids, workers=None):
+    """Yield (invoice_number, path or exception) for each invoice.
+
+    Already-rendered PDFs are yielded first, straight from the cache; missing
+    ones are then rendered in parallel and yielded as each completes.
+    """
+    missing = {}
+    for invoice in load_invoices(invoice_ids):
+        path = invoice_pdf_path(invoice, invoice_fingerprint(invoice, list(invoice.items.all())))
+        if path.exists():
+            yield invoice.invoice_number, path
+        else:
+            missing[invoice.pk] = invoice
+
+    if len(missing) <= INLINE_RENDER_LIMIT:
+        for invoice in missing.values():
+            try:
+                yield invoice.invoice_number, get_invoice_pdf(invoice)
+            except Exception as e:
+                yield invoice.invoice_number, e
+        return
+
+    for invoice_id, result in render_invoices(list(missing), workers=workers):
+        yield missing[invoice_id].invoice_number, result
+
+
+class _ZipSink:
+    """Write-only, unseekable file object that buffers what ZipFile writes"""
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def stream_zip(files, block_size=64 * 1024):
+    """Generate a ZIP archive of (name, path or exception) pairs as bytes chunks.
+
+    The archive is written to an unseekable sink, so entries use data
+    descriptors and nothing is buffered beyond the current block. Failed
+    entries are listed in errors.txt at the end of the archive.
+    """
+    sink = _ZipSink()
+    errors = []
+    used_names = set()
+    with zipfile.ZipFile(sink, mode='w', compression=zipfile.ZIP_STORED) as archive:
+        for name, path in files:
+            if isinstance(path, Exception):
+                errors.append(f'{name}: {path}')
+                continue
+            arcname = re.sub(r'[^A-Za-z0-9._-]+', '_', name) or 'invoice'
+            if arcname in used_names:
+                arcname = f'{arcname}-{len(used_names)}'
+            used_names.add(arcname)
+            with open(path, 'rb') as source, archive.open(f'{arcname}.pdf', mode='w') as entry:
+                for block in iter(lambda: source.read(block_size), b''):
+                    entry.write(block)
+                    yield sink.drain()
+            yield sink.drain()
+        if errors:
+            archive.writestr('errors.txt', '\n'.join(errors) + '\n')
+    yield sink.drain()
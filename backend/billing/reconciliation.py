@@ -0,0 +1,321 @@
+"""Matching bank/UPI statement lines to open invoices.
+
+A statement is read as a stream of CSV rows. The shop's open invoices are
+loaded once and indexed in memory by invoice number, customer phone, customer
+GSTIN and outstanding amount, so each line is matched with dictionary lookups
+instead of queries. Matched lines are posted as payments in bulk; unmatched and
+ambiguous lines are stored as StatementLine rows for review. Lines whose bank
+reference was already imported are skipped, so a statement can be re-imported.
+The whole import runs in one transaction, so a failed import leaves nothing
+behind.
+"""
+import re
+import uuid
+from collections import defaultdict
+from datetime import datetime, timedelta
+from decimal import Decimal, InvalidOperation
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+
+from .models import Invoice, Payment, StatementLine
+from .payments import post_payments, quantize_amount
+
+MATCHED = 'matched'
+AMBIGUOUS = 'ambiguous'
+UNMATCHED = 'unmatched'
+
+# Statement lines written per round trip (payments and review rows)
+IMPORT_CHUNK_SIZE = 500
+
+COLUMN_ALIASES = {
+    'date': ('date', 'transaction_date', 'txn_date', 'value_date'),
+    'amount': ('amount', 'credit', 'credit_amount', 'deposit'),
+    'debit': ('debit', 'debit_amount', 'withdrawal'),
+    'reference': ('reference', 'reference_number', 'ref', 'ref_no', 'utr', 'transaction_id'),
+    'description': ('description', 'narration', 'remarks', 'particulars'),
+    'phone': ('phone', 'mobile', 'payer_phone'),
+    'gstin': ('gstin', 'payer_gstin'),
+    'method': ('method', 'mode', 'payment_method'),
+}
+
+DATE_FORMATS = ('%Y-%m-%d', '%d-%m-%Y', '%d/%m/%Y', '%d-%b-%Y', '%d %b %Y')
+
+INVOICE_NUMBER_RE = re.compile(r'INV-\d{4}-\d+', re.IGNORECASE)
+GSTIN_RE = re.compile(r'\b\d{2}[A-Z]{5}\d{4}[A-Z][A-Z\d]Z[A-Z\d]\b')
+PHONE_RE = re.compile(r'(?<!\d)(?:\+?91[- ]?)?([6-9]\d{9})(?!\d)')
+
+
+def _date_window():
+    return timedelta(days=getattr(settings, 'RECONCILE_DATE_WINDOW_DAYS', 30))
+
+
+def normalize_phone(value):
+    """Last ten digits of a phone number, or ''"""
+    digits = re.sub(r'\D', '', value or '')
+    return digits[-10:] if len(digits) >= 10 else ''
+
+
+def normalize_gstin(value):
+    return re.sub(r'\s', '', value or '').upper()
+
+
+def parse_amount(value):
+    value = re.sub(r'[^\d.\-]', '', value or '')
+    if not value:
+        return None
+    try:
+        return quantize_amount(value)
+    except InvalidOperation:
+        return None
+
+
+def parse_date(value):
+    value = (value or '').strip()
+    for date_format in DATE_FORMATS:
+        try:
+            return datetime.strptime(value, date_format).date()
+        except ValueError:
+            continue
+    return None
+
+
+class StatementRow:
+    """One parsed statement line"""
+
+    def __init__(self, line_number, row):
+        self.line_number = line_number
+        self.raw_amount = row.get('amount', '')
+        self.amount = parse_amount(self.raw_amount)
+        self.debit = parse_amount(row.get('debit', ''))
+        self.date = parse_date(row.get('date', ''))
+        self.reference = (row.get('reference') or '').strip()[:100]
+        self.description = (row.get('description') or '').strip()
+        text = f'{self.reference} {self.description}'
+        self.invoice_numbers = {number.upper() for number in INVOICE_NUMBER_RE.findall(text)}
+        self.phone = normalize_phone(row.get('phone'))
+        if not self.phone:
+            found = PHONE_RE.search(self.description)
+            self.phone = found.group(1) if found else ''
+        self.gstin = normalize_gstin(row.get('gstin'))
+        if not self.gstin:
+            found = GSTIN_RE.search(self.description.upper())
+            self.gstin = found.group(0) if found else ''
+        method = (row.get('method') or '').strip().lower()
+        self.payment_method = 'upi' if method == 'upi' or 'UPI' in text.upper() else 'bank_transfer'
+
+
+def read_statement(rows):
+    """Yield StatementRow objects from csv.reader rows, mapping header aliases"""
+    rows = iter(rows)
+    header = next(rows, None)
+    if header is None:
+        return
+    names = [name.strip().lower().replace(' ', '_') for name in header]
+    columns = {}
+    for column, aliases in COLUMN_ALIASES.items():
+        for alias in aliases:
+            if alias in names:
+                columns[column] = names.index(alias)
+                break
+    if 'amount' not in columns:
+        raise ValueError("Statement needs an amount (or credit) column")
+
+    for line_number, values in enumerate(rows, start=2):
+        if not any(value.strip() for value in values):
+            continue
+        row = {column: values[index] if index < len(values) else '' for column, index in columns.items()}
+        yield StatementRow(line_number, row)
+
+
+class OpenInvoiceIndex:
+    """Hash indexes over a shop's open invoices, built with one query.
+
+    Matched amounts are added to the in-memory ``paid_amount`` so later lines
+    see the reduced ``remaining_amount`` of an invoice.
+    """
+
+    def __init__(self, shop):
+        self.invoices = {}
+        self.by_number = {}
+        self.by_phone = defaultdict(set)
+        self.by_gstin = defaultdict(set)
+        self.by_amount = defaultdict(set)
+        invoices = (
+            Invoice.objects.filter(shop=shop, paid_amount__lt=F('total_amount'))
+            .exclude(status__in=['paid', 'cancelled'])
+            .select_related('customer')
+            .only('id', 'invoice_number', 'invoice_date', 'due_date', 'total_amount', 'paid_amount',
+                  'customer__phone', 'customer__gstin')
+        )
+        for invoice in invoices.iterator(chunk_size=2000):
+            self.invoices[invoice.id] = invoice
+            self.by_number[invoice.invoice_number.upper()] = invoice.id
+            phone = normalize_phone(invoice.customer.phone)
+            if phone:
+                self.by_phone[phone].add(invoice.id)
+            gstin = normalize_gstin(invoice.customer.gstin)
+            if gstin:
+                self.by_gstin[gstin].add(invoice.id)
+            self.by_amount[invoice.remaining_amount].add(invoice.id)
+
+    def _in_window(self, invoice_ids, date):
+        if date is None:
+            return set(invoice_ids)
+        window = _date_window()
+        return {
+            invoice_id for invoice_id in invoice_ids
+            if self.invoices[invoice_id].invoice_date - timedelta(days=1) <= date
+            <= self.invoices[invoice_id].due_date + window
+        }
+
+    def _open(self, invoice_ids):
+        return {invoice_id for invoice_id in invoice_ids if self.invoices[invoice_id].remaining_amount > 0}
+
+    def apply(self, invoice_id, amount):
+        """Record a matched amount against the in-memory invoice"""
+        invoice = self.invoices[invoice_id]
+        self.by_amount[invoice.remaining_amount].discard(invoice_id)
+        invoice.paid_amount += amount
+        if invoice.remaining_amount > 0:
+            self.by_amount[invoice.remaining_amount].add(invoice_id)
+
+    def match(self, row):
+        """Return (MATCHED/AMBIGUOUS/UNMATCHED, invoice ids, reason) for a statement row"""
+        if row.invoice_numbers:
+            hits = self._open({self.by_number[n] for n in row.invoice_numbers if n in self.by_number})
+            if len(hits) > 1:
+                return AMBIGUOUS, hits, 'Reference names several open invoices'
+            if hits:
+                invoice_id = next(iter(hits))
+                if row.amount > self.invoices[invoice_id].remaining_amount:
+                    return AMBIGUOUS, hits, 'Amount exceeds the invoice balance'
+                return MATCHED, hits, 'Invoice number'
+
+        identity = self.by_phone.get(row.phone, set()) | self.by_gstin.get(row.gstin, set())
+        if identity:
+            candidates = self._in_window(self._open(identity), row.date)
+            exact = {i for i in candidates if self.invoices[i].remaining_amount == row.amount}
+            if len(exact) == 1:
+                return MATCHED, exact, 'Customer and amount'
+            if exact:
+                return AMBIGUOUS, exact, 'Several open invoices of the customer have this balance'
+            if len(candidates) == 1:
+                invoice_id = next(iter(candidates))
+                if row.amount < self.invoices[invoice_id].remaining_amount:
+                    return MATCHED, candidates, 'Customer (part payment)'
+                return AMBIGUOUS, candidates, 'Amount exceeds the invoice balance'
+            if candidates:
+                return AMBIGUOUS, candidates, 'Several open invoices of the customer'
+            return UNMATCHED, set(), 'No open invoice of the customer in the date window'
+
+        candidates = self._in_window(self._open(self.by_amount.get(row.amount, set())), row.date)
+        if candidates:
+            return AMBIGUOUS, candidates, 'Amount matches but the payer is unknown'
+        return UNMATCHED, set(), 'No matching invoice'
+
+
+def import_statement(shop, rows, created_by, chunk_size=IMPORT_CHUNK_SIZE):
+    """Reconcile statement rows (an iterable of csv.reader rows) for a shop.
+
+    The import is one transaction: a ValueError or csv.Error part way through
+    the file posts nothing, so the statement can simply be imported again.
+    Returns a summary of what happened to the lines.
+    """
+    import_id = uuid.uuid4()
+    summary = {
+        'import_id': str(import_id), 'lines': 0, 'matched': 0, 'matched_amount': Decimal('0.00'),
+        'ambiguous': 0, 'unmatched': 0, 'duplicates': 0, 'skipped': 0,
+    }
+    payments, review = [], []
+
+    def queue_for_review(row, outcome, candidates, reason):
+        review.append(StatementLine(
+            shop=shop,
+            import_id=import_id,
+            line_number=row.line_number,
+            transaction_date=row.date,
+            amount=row.amount if row.amount and row.amount > 0 else None,
+            reference_number=row.reference,
+            description=row.description,
+            phone=row.phone,
+            gstin=row.gstin[:15],
+            status=outcome,
+            reason=reason,
+            candidate_invoices=sorted(candidates),
+            created_by=created_by,
+        ))
+        summary[outcome] += 1
+
+    def flush():
+        # The index was built before this chunk; a payment posted since then
+        # may have shrunk a balance, so re-read them under lock and send lines
+        # that no longer fit to review instead of failing the import
+        balances = dict(
+            Invoice.objects.select_for_update().filter(id__in={payment.invoice_id for payment, _ in payments})
+            .exclude(status='cancelled').order_by('id')
+            .annotate(balance=F('total_amount') - F('paid_amount')).values_list('id', 'balance')
+        )
+        accepted = []
+        for payment, row in payments:
+            if payment.amount > balances.get(payment.invoice_id, Decimal('0.00')):
+                summary['matched'] -= 1
+                summary['matched_amount'] -= payment.amount
+                queue_for_review(row, AMBIGUOUS, {payment.invoice_id}, 'Amount exceeds the invoice balance')
+            else:
+                balances[payment.invoice_id] -= payment.amount
+                accepted.append(payment)
+        post_payments(accepted)
+        StatementLine.objects.bulk_create(review)
+        payments.clear()
+        review.clear()
+
+    with transaction.atomic():
+        index = OpenInvoiceIndex(shop)
+        seen_references = set(
+            Payment.objects.filter(invoice__shop=shop).exclude(reference_number='')
+            .values_list('reference_number', flat=True)
+        )
+        seen_references.update(
+            StatementLine.objects.filter(shop=shop).exclude(reference_number='')
+            .values_list('reference_number', flat=True)
+        )
+
+        for row in read_statement(rows):
+            summary['lines'] += 1
+            if row.amount is None and row.debit:
+                # Outgoing money is not a customer payment
+                summary['skipped'] += 1
+                continue
+            if row.reference and row.reference in seen_references:
+                summary['duplicates'] += 1
+                continue
+            if row.reference:
+                seen_references.add(row.reference)
+
+            if row.amount is None or row.amount <= 0:
+                outcome, candidates, reason = UNMATCHED, set(), f'Could not read amount {row.raw_amount!r}'
+            else:
+                outcome, candidates, reason = index.match(row)
+
+            if outcome == MATCHED:
+                invoice_id = next(iter(candidates))
+                index.apply(invoice_id, row.amount)
+                payments.append((Payment(
+                    invoice_id=invoice_id,
+                    amount=row.amount,
+                    payment_method=row.payment_method,
+                    reference_number=row.reference,
+                    notes=f'Statement import {import_id}, line {row.line_number}: {row.description}'.strip(),
+                    created_by=created_by,
+                ), row))
+                summary['matched'] += 1
+                summary['matched_amount'] += row.amount
+            else:
+                queue_for_review(row, outcome, candidates, reason)
+
+            if len(payments) + len(review) >= chunk_size:
+                flush()
+        flush()
+    return summary
@@ -0,0 +1,131 @@
+"""Stock held by draft invoices.
+
+Writing a draft's items reserves the quantities its product lines need, so two
+cashiers cannot both sell the last units. Reservations only move the
+``reserved_quantity`` counter on products with guarded F-expression UPDATEs
+(see inventory.stock); no product row stays locked between requests. Each
+write pushes the draft's expiry back by ``STOCK_RESERVATION_TTL_MINUTES``, and
+the ``expire_reservations`` command returns holds that have lapsed.
+Finalizing converts a draft's reservations into the stock deduction.
+"""
+from collections import defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from inventory.models import Product
+from inventory.stock import normalize_quantities, release_stock, reserve_stock
+
+from .models import StockReservation
+
+EXPIRE_BATCH_SIZE = 1000
+
+
+def reservation_expiry():
+    return timezone.now() + timedelta(minutes=getattr(settings, 'STOCK_RESERVATION_TTL_MINUTES', 30))
+
+
+def held_stock(invoice_ids, lock=False):
+    """Return {invoice_id: {product_id: reserved quantity}}; ``lock`` holds the rows until commit"""
+    reservations = StockReservation.objects.filter(invoice_id__in=list(invoice_ids))
+    if lock:
+        reservations = reservations.select_for_update()
+    held = defaultdict(dict)
+    for invoice_id, product_id, quantity in reservations.values_list('invoice_id', 'product_id', 'quantity'):
+        held[invoice_id][product_id] = quantity
+    return held
+
+
+def sync_reservations(invoice, reserve=True):
+    """Make a draft's reservations match its product lines and renew their expiry.
+
+    Only the difference from what the draft already holds is reserved or
+    released. Raises InsufficientStock, reserving nothing, when the extra
+    quantity is not available; with ``reserve=False`` holds are only shrunk.
+    """
+    if invoice.stock_applied or invoice.status == 'cancelled':
+        return
+    with transaction.atomic():
+        # Locking the draft's rows keeps the sweep from releasing them mid-sync
+        held = held_stock([invoice.pk], lock=True).get(invoice.pk, {})
+        wanted = normalize_quantities(invoice.required_stock())
+        if not reserve:
+            wanted = {pid: min(qty, held[pid]) for pid, qty in wanted.items() if held.get(pid)}
+        reserve_stock({pid: qty - held.get(pid, 0) for pid, qty in wanted.items() if qty > held.get(pid, 0)})
+        release_stock({pid: qty - wanted.get(pid, 0) for pid, qty in held.items() if qty > wanted.get(pid, 0)})
+
+        expires_at = reservation_expiry()
+        if wanted:
+            StockReservation.objects.bulk_create(
+                [StockReservation(invoice_id=invoice.pk, product_id=pid, quantity=qty, expires_at=expires_at)
+                 for pid, qty in wanted.items()],
+                update_conflicts=True,
+                unique_fields=['invoice', 'product'],
+                update_fields=['quantity', 'expires_at'],
+            )
+        dropped = [pid for pid in held if pid not in wanted]
+        if dropped:
+            StockReservation.objects.filter(invoice_id=invoice.pk, product_id__in=dropped).delete()
+
+
+def _release(reservations):
+    """Release and delete the given reservation rows; returns how many there were"""
+    rows = list(reservations.values_list('id', 'product_id', 'quantity'))
+    totals = defaultdict(int)
+    for _, product_id, quantity in rows:
+        totals[product_id] += quantity
+    release_stock(totals)
+    StockReservation.objects.filter(id__in=[row[0] for row in rows]).delete()
+    return len(rows)
+
+
+def release_reservations(invoice_ids):
+    """Give back the stock held by the given invoices"""
+    with transaction.atomic():
+        return _release(StockReservation.objects.select_for_update().filter(invoice_id__in=list(invoice_ids)))
+
+
+def forget_reservations(invoice_ids):
+    """Drop reservations already converted by a stock deduction"""
+    StockReservation.objects.filter(invoice_id__in=list(invoice_ids)).delete()
+
+
+def expire_reservations(now=None, batch_size=EXPIRE_BATCH_SIZE):
+    """Release every reservation that expired before ``now``, a batch per transaction.
+
+    Rows a draft is renewing right now are skipped (where the database supports
+    SKIP LOCKED) and picked up by the next sweep if they still lapse.
+    """
+    now = now or timezone.now()
+    released = 0
+    while True:
+        with transaction.atomic():
+            ids = list(
+                StockReservation.objects.select_for_update(skip_locked=True)
+                .filter(expires_at__lte=now).order_by('expires_at').values_list('id', flat=True)[:batch_size]
+            )
+            if not ids:
+                return released
+            released += _release(StockReservation.objects.filter(id__in=ids))
+
+
+def rebuild_reserved_counts(products=None):
+    """Reset ``reserved_quantity`` to the sum of live reservations where they disagree.
+
+    A repair for counters left behind by queryset deletes that bypass the
+    reservation code; run it while drafts are quiet. Returns the rows fixed.
+    """
+    products = Product.objects.all() if products is None else products
+    held = (
+        StockReservation.objects.filter(product=OuterRef('pk'))
+        .values('product').annotate(total=Sum('quantity')).values('total')
+    )
+    with transaction.atomic():
+        stale = products.annotate(held=Coalesce(Subquery(held), Value(0))).exclude(reserved_quantity=F('held'))
+        return Product.objects.filter(pk__in=list(stale.values_list('pk', flat=True))).update(
+            reserved_quantity=Coalesce(Subquery(held), Value(0))
+        )
@@ -0,0 +1,103 @@
+"""Invoice number allocation backed by the per-(shop, year) InvoiceSequence table.
+
+Numbers are handed out by advancing a counter row under a row lock instead of
+scanning the shop's invoices for the highest number. Two modes are supported:
+
+* Block mode (``INVOICE_NUMBER_BLOCK_SIZE`` > 1): each worker process reserves a
+  block of numbers with one counter update and serves the block from memory.
+  The reservation is part of the caller's transaction, so the rest of a block
+  is only served once that transaction commits; a rolled back reservation is
+  returned to the counter and never served. Numbers are unique but may be
+  issued out of order across workers, and unused numbers are lost when a worker
+  exits.
+* Gapless mode (``INVOICE_NUMBER_GAPLESS``): one number per allocation, taken in
+  the same transaction as the invoice insert, so a rolled back invoice returns
+  its number. Concurrent creates for the same shop serialize on the counter row
+  until commit, so callers insert the invoice as late in their transaction as
+  they can.
+"""
+import threading
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import Invoice, InvoiceSequence
+
+INVOICE_NUMBER_FORMAT = 'INV-{year}-{value:04d}'
+
+# (shop_id, year) -> [next_value, end_value) reserved by this process
+_blocks = {}
+_blocks_lock = threading.Lock()
+
+
+def parse_invoice_number(invoice_number):
+    """Return (year, value) for an INV-YYYY-NNNN number, or None"""
+    parts = (invoice_number or '').split('-')
+    if len(parts) != 3 or parts[0] != 'INV':
+        return None
+    try:
+        return int(parts[1]), int(parts[2])
+    except ValueError:
+        return None
+
+
+def _scan_next_value(shop_id, year):
+    """Seed a missing counter from the shop's existing invoices for the year"""
+    numbers = Invoice.objects.filter(
+        shop_id=shop_id,
+        invoice_number__startswith=f'INV-{year}-'
+    ).values_list('invoice_number', flat=True)
+    values = [parsed[1] for parsed in map(parse_invoice_number, numbers) if parsed]
+    return max(values, default=0) + 1
+
+
+def reserve_invoice_numbers(shop_id, year, count=1):
+    """Advance the (shop, year) counter by ``count`` and return the first reserved value"""
+    with transaction.atomic():
+        sequence, _ = InvoiceSequence.objects.select_for_update().get_or_create(
+            shop_id=shop_id,
+            year=year,
+            defaults={'next_value': lambda: _scan_next_value(shop_id, year)},
+        )
+        start = sequence.next_value
+        InvoiceSequence.objects.filter(pk=sequence.pk).update(
+            next_value=F('next_value') + count,
+            updated_at=timezone.now(),
+        )
+    return start
+
+
+def allocate_invoice_number(shop_id, year=None):
+    """Return the next invoice number for a shop"""
+    year = year or timezone.now().year
+    block_size = max(1, int(getattr(settings, 'INVOICE_NUMBER_BLOCK_SIZE', 1)))
+
+    if getattr(settings, 'INVOICE_NUMBER_GAPLESS', False) or block_size == 1:
+        value = reserve_invoice_numbers(shop_id, year)
+    else:
+        key = (shop_id, year)
+        with _blocks_lock:
+            block = _blocks.get(key)
+            if block is not None and block[0] < block[1]:
+                value = block[0]
+                block[0] += 1
+                return INVOICE_NUMBER_FORMAT.format(year=year, value=value)
+
+        value = reserve_invoice_numbers(shop_id, year, block_size)
+
+        def keep_rest():
+            with _blocks_lock:
+                _blocks[key] = [value + 1, value + block_size]
+
+        # Runs at once outside a transaction; dropped if the reservation rolls back
+        transaction.on_commit(keep_rest)
+
+    return INVOICE_NUMBER_FORMAT.format(year=year, value=value)
+
+
+def reset_block_cache():
+    """Forget blocks reserved by this process (their unused numbers are skipped)"""
+    with _blocks_lock:
+        _blocks.clear()
@@ -1,8 +1,10 @@
 from rest_framework import serializers
+from django.db import transaction
 from django.utils import timezone
 from datetime import date
-from .models import Invoice, InvoiceItem, Customer
+from .models import Invoice, InvoiceItem, Customer, Payment, StatementLine
 from inventory.models import Product
+from inventory.stock import InsufficientStock
 from decimal import Decimal, ROUND_HALF_UP
 
 class CustomerSerializer(serializers.ModelSerializer):
@@ -15,7 +17,38 @@ class CustomerSerializer(serializers.ModelSerializer):
         read_only_fields = ['created_at', 'updated_at', 'full_address']
 
 
+class InvoiceItemProductField(serializers.PrimaryKeyRelatedField):
+    """Product lookup that reuses products preloaded by InvoiceItemListSerializer"""
+
+    def to_internal_value(self, data):
+        product_cache = self.context.get('product_cache')
+        if product_cache is not None and not isinstance(data, bool):
+            try:
+                return product_cache[int(data)]
+            except (KeyError, TypeError, ValueError):
+                pass
+        return super().to_internal_value(data)
+
+
+class InvoiceItemListSerializer(serializers.ListSerializer):
+    """Loads every referenced product with one query before validating the items"""
+
+    def to_internal_value(self, data):
+        if isinstance(data, list):
+            product_ids = set()
+            for item in data:
+                if not isinstance(item, dict):
+                    continue
+                try:
+                    product_ids.add(int(item.get('product')))
+                except (TypeError, ValueError):
+                    continue
+            self.context['product_cache'] = Product.objects.in_bulk(product_ids)
+        return super().to_internal_value(data)
+
+
 class InvoiceItemSerializer(serializers.ModelSerializer):
+    product = InvoiceItemProductField(queryset=Product.objects.all(), required=False, allow_null=True)
     product_name = serializers.SerializerMethodField()
     product_sku = serializers.SerializerMethodField()
     line_total = serializers.ReadOnlyField()
@@ -28,6 +61,7 @@ class InvoiceItemSerializer(serializers.ModelSerializer):
             'id', 'product', 'product_name', 'product_sku', 'description',
             'quantity', 'unit_price', 'tax_rate', 'line_total', 'tax_amount', 'total_with_tax'
         ]
+        list_serializer_class = InvoiceItemListSerializer
 
     def validate_quantity(self, value):
         if value <= 0:
@@ -66,6 +100,11 @@ class InvoiceSerializer(serializers.ModelSerializer):
             'is_overdue', 'remaining_amount', 'created_at', 'updated_at'
         ]
 
+    def validate_invoice_date(self, value):
+        if self.instance is not None and self.instance.stock_applied and value != self.instance.invoice_date:
+            raise serializers.ValidationError("The date of a finalized invoice cannot be changed")
+        return value
+
     def validate_due_date(self, value):
         invoice_date = self.initial_data.get('invoice_date')
         if invoice_date:
@@ -84,66 +123,44 @@ class InvoiceSerializer(serializers.ModelSerializer):
     def create(self, validated_data):
         items_data = validated_data.pop('items', [])
         # created_by may be passed via serializer.save(created_by=request.user)
-        invoice = Invoice.objects.create(**validated_data)
-        # Create items if provided
-        for item_data in items_data:
-            # Allow manual line items without a product
-            InvoiceItem.objects.create(
-                invoice=invoice,
-                product=item_data.get('product'),
-                description=item_data.get('description', ''),
-                quantity=item_data.get('quantity', 1),
-                unit_price=item_data.get('unit_price', 0),
-                tax_rate=item_data.get('tax_rate', 0),
-            )
-        # Recalculate totals and refresh instance
-        invoice.calculate_totals()
-        invoice.refresh_from_db()
-        return invoice
+        with transaction.atomic():
+            invoice = Invoice.objects.create(**validated_data)
+            # Bulk-insert items, recalculate totals once and reserve their stock
+            if items_data:
+                self._write_items(invoice, items_data)
+        return self._reload(invoice)
 
     def update(self, instance, validated_data):
         # Extract nested items from validated data to avoid assigning reverse relation directly
         items_data = validated_data.pop('items', None)
-        # Update scalar fields only
-        for attr, value in validated_data.items():
-            setattr(instance, attr, value)
-        instance.save()
-
-        # If items provided, replace existing items with new set
-        if items_data is not None:
-            # Clear existing items
-            instance.items.all().delete()
-            # Recreate items
-            for item in items_data:
-                InvoiceItem.objects.create(
-                    invoice=instance,
-                    product=item.get('product'),
-                    description=item.get('description', ''),
-                    quantity=item.get('quantity', 1),
-                    unit_price=item.get('unit_price', 0),
-                    tax_rate=item.get('tax_rate', 0),
-                )
-
-        # Recalculate totals and refresh instance
-        instance.calculate_totals()
-        # Normalize decimals to two places to avoid floating inconsistencies
-        instance.subtotal = (Decimal(instance.subtotal).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP))
-        instance.tax_amount = (Decimal(instance.tax_amount).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP))
-        instance.total_amount = (Decimal(instance.total_amount).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP))
-        instance.paid_amount = (Decimal(instance.paid_amount).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP))
-        # Clamp over/underpayment edges
-        if instance.paid_amount > instance.total_amount:
-            instance.paid_amount = instance.total_amount
-        if instance.paid_amount < Decimal('0.00'):
-            instance.paid_amount = Decimal('0.00')
-        Invoice.objects.filter(id=instance.id).update(
-            subtotal=instance.subtotal,
-            tax_amount=instance.tax_amount,
-            total_amount=instance.total_amount,
-            paid_amount=instance.paid_amount,
-        )
-        instance.refresh_from_db()
-        return instance
+        with transaction.atomic():
+            # Update scalar fields only
+            for attr, value in validated_data.items():
+                setattr(instance, attr, value)
+            instance.save()
+
+            # If items provided, replace existing items with new set
+            if items_data is not None:
+                self._write_items(instance, items_data, replace=True)
+            else:
+                instance.calculate_totals()
+
+            # Clamp over/underpayment edges
+            paid_amount = Decimal(instance.paid_amount).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
+            paid_amount = min(max(paid_amount, Decimal('0.00')), instance.total_amount)
+            if paid_amount != instance.paid_amount:
+                Invoice.objects.filter(id=instance.id).update(paid_amount=paid_amount)
+        return self._reload(instance)
+
+    def _write_items(self, invoice, items_data, replace=False):
+        try:
+            invoice.write_items(items_data, replace=replace)
+        except InsufficientStock as e:
+            raise serializers.ValidationError({'items': [str(e)]})
+
+    def _reload(self, invoice):
+        """Fetch the saved invoice with everything the representation needs"""
+        return Invoice.objects.select_related('customer', 'created_by').prefetch_related('items__product').get(pk=invoice.pk)
 
     def validate(self, attrs):
         instance = getattr(self, 'instance', None)
@@ -166,4 +183,38 @@ class InvoiceSerializer(serializers.ModelSerializer):
     def validate_customer(self, value):
         if not value:
             raise serializers.ValidationError("Customer is required")
-        return value
\ No newline at end of file
+        return value
+
+
+class StatementLineSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = StatementLine
+        fields = [
+            'id', 'import_id', 'line_number', 'transaction_date', 'amount', 'reference_number',
+            'description', 'phone', 'gstin', 'status', 'reason', 'candidate_invoices', 'payment',
+            'created_by', 'created_at', 'resolved_at'
+        ]
+        read_only_fields = fields
+
+
+class CheckoutLineSerializer(serializers.Serializer):
+    sku = serializers.CharField(max_length=100)
+    quantity = serializers.IntegerField(min_value=1)
+    unit_price = serializers.DecimalField(max_digits=10, decimal_places=2, min_value=Decimal('0'), required=False)
+    tax_rate = serializers.DecimalField(max_digits=5, decimal_places=2, min_value=Decimal('0'), required=False)
+
+
+class CheckoutPaymentSerializer(serializers.Serializer):
+    amount = serializers.DecimalField(max_digits=12, decimal_places=2, min_value=Decimal('0'))
+    payment_method = serializers.ChoiceField(choices=Payment.PAYMENT_METHODS, default='cash')
+    reference_number = serializers.CharField(max_length=100, required=False, allow_blank=True, default='')
+
+
+class CheckoutSerializer(serializers.Serializer):
+    """Payload of a counter sale; customer is omitted for walk-in sales"""
+    customer = serializers.IntegerField(required=False, allow_null=True)
+    location = serializers.IntegerField(required=False, allow_null=True)
+    lines = CheckoutLineSerializer(many=True, allow_empty=False)
+    payment = CheckoutPaymentSerializer(required=False, allow_null=True)
+    discount_amount = serializers.DecimalField(max_digits=10, decimal_places=2, min_value=Decimal('0'), default=Decimal('0.00'))
+    notes = serializers.CharField(required=False, allow_blank=True, default='')
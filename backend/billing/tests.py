@@ -1,3 +1,486 @@
-from django.test import TestCase
+import csv
+import importlib
+import random
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import timedelta
+from decimal import Decimal
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+from django.apps import apps
+from django.core.management import call_command
+from django.db import connection, transaction, OperationalError
+from django.db.models import Sum
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from inventory.models import Category, Product
+from inventory.stock import InsufficientStock
+from users.models import User
+
+from . import pdf
+from .checkout import checkout
+from .finalization import ALL_OR_NOTHING, BEST_EFFORT, bulk_finalize
+from .models import Customer, Invoice, InvoiceItem, InvoiceSequence, Payment, StatementLine, StockReservation
+from .payments import post_payment, post_payments
+from .reconciliation import import_statement
+from .sequences import allocate_invoice_number, parse_invoice_number, reserve_invoice_numbers, reset_block_cache
+
+
+def in_threads(function, calls, threads=8):
+    """Run function(*args) for each args in ``calls`` from a thread pool and return the results"""
+    def work(args):
+        try:
+            for attempt in range(50):
+                try:
+                    with transaction.atomic():
+                        return function(*args)
+                except OperationalError:
+                    # SQLite reports lock contention as an error; retry
+                    time.sleep(0.01 * (attempt + 1))
+            raise AssertionError('gave up after repeated lock contention')
+        finally:
+            connection.close()
+
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        return list(pool.map(work, calls))
+
+
+def make_products(shop, count, stock=10):
+    category = Category.objects.create(name='General', shop=shop)
+    return [
+        Product.objects.create(name=f'Product {i}', sku=f'SKU-{i}', price='10.00', stock_quantity=stock,
+                               category=category, shop=shop, created_by=shop)
+        for i in range(count)
+    ]
+
+
+def make_draft(shop, lines):
+    """A draft invoice with an item per (product, quantity) line"""
+    customer, _ = Customer.objects.get_or_create(name='Customer', shop=shop)
+    invoice = Invoice.objects.create(customer=customer, shop=shop, created_by=shop,
+                                     due_date=timezone.now().date() + timedelta(days=30))
+    InvoiceItem.objects.bulk_create([
+        InvoiceItem(invoice=invoice, product=product, quantity=quantity, unit_price=product.price)
+        for product, quantity in lines
+    ])
+    return invoice
+
+
+class FinalizeTests(TestCase):
+    def setUp(self):
+        self.shop = User.objects.create(username='finalize', role='shop_owner', shop_name='Finalize')
+        self.products = make_products(self.shop, 20)
+
+    def finalize_queries(self, invoice):
+        with CaptureQueriesContext(connection) as queries:
+            invoice.apply_stock_adjustments()
+        return len(queries)
+
+    def test_query_count_does_not_grow_with_lines(self):
+        few = make_draft(self.shop, [(product, 1) for product in self.products[:2]])
+        many = make_draft(self.shop, [(product, 2) for product in self.products])
+        self.assertEqual(self.finalize_queries(few), self.finalize_queries(many))
+        self.assertEqual(
+            list(Product.objects.filter(shop=self.shop).order_by('id').values_list('stock_quantity', flat=True)),
+            [7, 7] + [8] * 18,
+        )
+
+
+class CheckoutTests(TestCase):
+    def setUp(self):
+        self.shop = User.objects.create(username='checkout', role='shop_owner', shop_name='Checkout')
+        self.products = make_products(self.shop, 20)
+
+    def checkout_queries(self, products):
+        lines = [{'sku': product.sku, 'quantity': 1} for product in products]
+        with CaptureQueriesContext(connection) as queries:
+            checkout(self.shop, self.shop, lines, payment={'amount': Decimal('1000.00')})
+        return len(queries)
+
+    def test_query_count_does_not_grow_with_lines(self):
+        # The first sale creates the walk-in customer and the number counter
+        self.checkout_queries(self.products[:1])
+        self.assertEqual(self.checkout_queries(self.products[:1]), self.checkout_queries(self.products))
+
+    def test_explicit_zero_price_is_kept(self):
+        product = self.products[0]
+        receipt = checkout(self.shop, self.shop, [{'sku': product.sku, 'quantity': 2, 'unit_price': Decimal('0')}])
+        self.assertEqual((receipt['lines'][0]['unit_price'], receipt['status']), (Decimal('0'), 'paid'))
+
+
+class BulkPdfTests(TestCase):
+    def setUp(self):
+        self.shop = User.objects.create(username='pdf', role='shop_owner', shop_name='Pdf')
+        self.client = APIClient()
+        self.client.force_authenticate(self.shop)
+
+    def test_invalid_invoice_ids_are_rejected(self):
+        response = self.client.post('/api/invoices/bulk_pdf/', {'invoice_ids': ['x']}, format='json')
+        self.assertEqual(response.status_code, 400)
+
+    @override_settings(INVOICE_PDF_WORKERS=None)
+    def test_closing_the_stream_cancels_pending_renders(self):
+        def submit(function, invoice_id):
+            future = Future()
+            future.set_result((invoice_id, f'{invoice_id}.pdf'))
+            return future
+
+        with mock.patch.object(pdf, 'ProcessPoolExecutor') as executor:
+            executor.return_value.submit.side_effect = submit
+            rendered = pdf.render_invoices(list(range(1, 11)))
+            next(rendered)
+            rendered.close()
+        self.assertEqual(executor.call_args.kwargs['max_workers'], pdf.DEFAULT_PDF_WORKERS)
+        executor.return_value.shutdown.assert_called_once_with(cancel_futures=True)
+
+
+class ReservationTests(TestCase):
+    def setUp(self):
+        self.shop = User.objects.create(username='reserve', role='shop_owner', shop_name='Reserve')
+        self.product, = make_products(self.shop, 1)
+        self.draft = self.hold(8)
+
+    def hold(self, quantity):
+        invoice = make_draft(self.shop, [])
+        invoice.write_items([{'product': self.product, 'quantity': quantity}])
+        return invoice
+
+    def levels(self):
+        self.product.refresh_from_db()
+        return self.product.stock_quantity, self.product.reserved_quantity
+
+    def test_reservation_blocks_overselling(self):
+        self.assertEqual(self.levels(), (10, 8))
+        with self.assertRaises(InsufficientStock):
+            self.hold(3)
+        self.assertEqual(self.levels(), (10, 8))
+        self.hold(2)
+        self.assertEqual(self.levels(), (10, 10))
+
+    @override_settings(STOCK_RESERVATION_TTL_MINUTES=30)
+    def test_expired_reservations_free_their_stock(self):
+        call_command('expire_reservations', stdout=StringIO())
+        self.assertEqual(self.levels(), (10, 8))
+
+        StockReservation.objects.update(expires_at=timezone.now() - timedelta(minutes=1))
+        call_command('expire_reservations', stdout=StringIO())
+        self.assertEqual(self.levels(), (10, 0))
+        self.assertFalse(StockReservation.objects.exists())
+        self.hold(10)
+
+    def test_finalize_consumes_the_reservation(self):
+        self.draft.apply_stock_adjustments()
+        self.assertEqual(self.levels(), (2, 0))
+        self.assertFalse(StockReservation.objects.exists())
+        with self.assertRaises(InsufficientStock):
+            self.hold(3)
+
+
+class BulkFinalizeTests(TestCase):
+    def setUp(self):
+        self.shop = User.objects.create(username='bulk', role='shop_owner', shop_name='Bulk')
+        self.product, = make_products(self.shop, 1)
+        # 4 + 4 fit the 10 units in stock, the third invoice does not
+        self.invoices = [make_draft(self.shop, [(self.product, 4)]) for _ in range(3)]
+        self.ids = [invoice.pk for invoice in self.invoices]
+
+    def statuses(self, results):
+        return [result['status'] for result in results]
+
+    def stock(self):
+        self.product.refresh_from_db()
+        return self.product.stock_quantity
+
+    def test_all_or_nothing_applies_nothing_on_shortfall(self):
+        results = bulk_finalize(self.ids, mode=ALL_OR_NOTHING)
+        self.assertEqual(self.statuses(results), ['failed'] * 3)
+        self.assertEqual(self.stock(), 10)
+        self.assertFalse(Invoice.objects.filter(id__in=self.ids, stock_applied=True).exists())
+
+    def test_all_or_nothing_applies_everything_that_fits(self):
+        results = bulk_finalize(self.ids[:2], mode=ALL_OR_NOTHING)
+        self.assertEqual(self.statuses(results), ['finalized'] * 2)
+        self.assertEqual(self.stock(), 2)
+
+    def test_best_effort_applies_what_fits(self):
+        results = bulk_finalize(self.ids, mode=BEST_EFFORT)
+        self.assertEqual(self.statuses(results), ['finalized', 'finalized', 'failed'])
+        self.assertEqual(results[2]['shortfalls'][0]['available'], 2)
+        self.assertEqual(self.stock(), 2)
+        self.assertEqual(
+            list(Invoice.objects.filter(id__in=self.ids).order_by('id').values_list('stock_applied', flat=True)),
+            [True, True, False],
+        )
+
+    def test_already_finalized_invoices_are_skipped(self):
+        bulk_finalize(self.ids[:1])
+        results = bulk_finalize(self.ids[:2], mode=BEST_EFFORT)
+        self.assertEqual(self.statuses(results), ['skipped', 'finalized'])
+        self.assertEqual(self.stock(), 2)
+
+
+class InvoiceNumberTests(TransactionTestCase):
+    YEAR = 2026
+
+    def setUp(self):
+        reset_block_cache()
+        self.shop = User.objects.create(username='numbers', role='shop_owner', shop_name='Numbers')
+
+    def tearDown(self):
+        reset_block_cache()
+
+    def allocate(self, count, threads=8):
+        numbers = in_threads(allocate_invoice_number, [(self.shop.pk, self.YEAR)] * count, threads)
+        return [parse_invoice_number(number)[1] for number in numbers]
+
+    def test_parallel_allocation_is_unique_and_contiguous(self):
+        values = self.allocate(40)
+        self.assertEqual(sorted(values), list(range(1, 41)))
+
+    @override_settings(INVOICE_NUMBER_GAPLESS=True)
+    def test_gapless_rollback_returns_its_number(self):
+        with self.assertRaises(RuntimeError):
+            with transaction.atomic():
+                self.assertEqual(allocate_invoice_number(self.shop.pk, self.YEAR), 'INV-2026-0001')
+                raise RuntimeError
+        values = self.allocate(10)
+        self.assertEqual(sorted(values), list(range(1, 11)))
+
+    @override_settings(INVOICE_NUMBER_BLOCK_SIZE=5)
+    def test_parallel_block_allocation_is_unique(self):
+        values = self.allocate(40)
+        self.assertEqual(len(set(values)), 40)
+
+    @override_settings(INVOICE_NUMBER_BLOCK_SIZE=10)
+    def test_rolled_back_block_is_not_served(self):
+        with self.assertRaises(RuntimeError):
+            with transaction.atomic():
+                allocate_invoice_number(self.shop.pk, self.YEAR)
+                raise RuntimeError
+        # The rollback returned the block to the counter, so another worker gets it
+        start = reserve_invoice_numbers(self.shop.pk, self.YEAR, 10)
+        other_worker = range(start, start + 10)
+        self.assertEqual(start, 1)
+        values = self.allocate(5, threads=1)
+        self.assertFalse(set(values) & set(other_worker))
+        self.assertEqual(values, list(range(11, 16)))
+
+
+class InvoiceCreateTests(TransactionTestCase):
+    INVOICES = 1000
+
+    def setUp(self):
+        reset_block_cache()
+        self.shop = User.objects.create(username='creates', role='shop_owner', shop_name='Creates')
+        self.customer = Customer.objects.create(name='Customer', shop=self.shop)
+        self.year = timezone.now().year
+
+    def tearDown(self):
+        reset_block_cache()
+
+    def create(self):
+        return Invoice.objects.create(customer=self.customer, shop=self.shop, created_by=self.shop,
+                                      due_date=timezone.now().date()).invoice_number
+
+    def values(self):
+        numbers = Invoice.objects.filter(shop=self.shop).values_list('invoice_number', flat=True)
+        return sorted(parse_invoice_number(number)[1] for number in numbers)
+
+    def test_parallel_creates_are_numbered_in_sequence(self):
+        numbers = in_threads(self.create, [()] * self.INVOICES)
+        self.assertEqual(len(set(numbers)), self.INVOICES)
+        self.assertEqual(self.values(), list(range(1, self.INVOICES + 1)))
+
+    @override_settings(INVOICE_NUMBER_GAPLESS=True)
+    def test_parallel_gapless_creates_are_numbered_in_sequence(self):
+        in_threads(self.create, [()] * 200)
+        self.assertEqual(self.values(), list(range(1, 201)))
+
+    def existing(self, *values):
+        Invoice.objects.bulk_create([
+            Invoice(invoice_number=f'INV-{self.year}-{value:04d}', customer=self.customer, shop=self.shop,
+                    created_by=self.shop, due_date=timezone.now().date())
+            for value in values
+        ])
+
+    def test_missing_counter_is_seeded_from_existing_invoices(self):
+        self.existing(3, 41, 7)
+        self.assertEqual(self.create(), f'INV-{self.year}-0042')
+
+    def test_migration_seeds_counters_from_existing_invoices(self):
+        self.existing(3, 41)
+        Invoice.objects.bulk_create([
+            Invoice(invoice_number=number, customer=self.customer, shop=self.shop, created_by=self.shop,
+                    due_date=timezone.now().date())
+            for number in ('INV-2024-0009', 'INV-2024-BAD', 'OLD-2024-0050')
+        ])
+        migration = importlib.import_module('billing.migrations.0006_invoicesequence')
+        migration.seed_invoice_sequences(apps, None)
+        self.assertEqual(
+            dict(InvoiceSequence.objects.filter(shop=self.shop).values_list('year', 'next_value')),
+            {2024: 10, self.year: 42},
+        )
+
+
+class PaymentTests(TestCase):
+    def setUp(self):
+        self.shop = User.objects.create(username='payments', role='shop_owner', shop_name='Payments')
+        self.invoice = make_draft(self.shop, [])
+        Invoice.objects.filter(pk=self.invoice.pk).update(status='due', total_amount=Decimal('100.00'))
+
+    def test_overpayment_is_rejected(self):
+        post_payment(self.invoice, Decimal('60.00'), self.shop)
+        with self.assertRaises(ValueError):
+            post_payment(self.invoice, Decimal('40.01'), self.shop)
+        self.invoice.refresh_from_db()
+        self.assertEqual((self.invoice.paid_amount, self.invoice.status), (Decimal('60.00'), 'partial'))
+        self.assertEqual(Payment.objects.filter(invoice=self.invoice).count(), 1)
+
+        post_payment(self.invoice, Decimal('40.00'), self.shop)
+        self.invoice.refresh_from_db()
+        self.assertEqual((self.invoice.paid_amount, self.invoice.status), (Decimal('100.00'), 'paid'))
+
+
+class MarkPaidTests(TestCase):
+    def setUp(self):
+        self.shop = User.objects.create(username='markpaid', role='shop_owner', shop_name='MarkPaid')
+        self.client = APIClient()
+        self.client.force_authenticate(self.shop)
+
+    def mark_paid(self, total):
+        invoice = make_draft(self.shop, [])
+        Invoice.objects.filter(pk=invoice.pk).update(status='due', total_amount=total)
+        response = self.client.post(f'/api/invoices/{invoice.pk}/mark_paid/')
+        self.assertEqual(response.status_code, 200)
+        invoice.refresh_from_db()
+        return invoice
+
+    def test_balance_is_posted_as_a_payment(self):
+        invoice = self.mark_paid(Decimal('80.00'))
+        self.assertEqual((invoice.status, invoice.paid_amount), ('paid', Decimal('80.00')))
+        self.assertEqual(invoice.payments.get().reference_number, 'MARK_PAID')
+
+    def test_zero_balance_is_marked_paid_without_a_payment(self):
+        invoice = self.mark_paid(Decimal('0.00'))
+        self.assertEqual((invoice.status, invoice.paid_date), ('paid', timezone.now().date()))
+        self.assertFalse(invoice.payments.exists())
+
+
+class ConcurrentPaymentTests(TransactionTestCase):
+    """Payments posted from parallel threads must agree with the payment ledger"""
+    INVOICES = 5
+    PAYMENTS = 200
+    TOTAL = Decimal('1000.00')
+
+    def setUp(self):
+        self.shop = User.objects.create(username='stress', role='shop_owner', shop_name='Stress')
+        customer = Customer.objects.create(name='Stress customer', shop=self.shop)
+        today = timezone.now().date()
+        self.invoice_ids = [invoice.pk for invoice in Invoice.objects.bulk_create([
+            Invoice(invoice_number=f'STRESS-{i}', customer=customer, shop=self.shop, created_by=self.shop,
+                    status='due', subtotal=self.TOTAL, total_amount=self.TOTAL, due_date=today)
+            for i in range(self.INVOICES)
+        ])]
+
+    def post(self, batch):
+        try:
+            post_payments([
+                Payment(invoice_id=invoice_id, amount=amount, created_by=self.shop, reference_number='STRESS')
+                for invoice_id, amount in batch
+            ])
+        except ValueError:
+            # Overpayments are rejected
+            return False
+        return True
+
+    def test_parallel_payments_match_the_ledger(self):
+        # Amounts add up to about twice each total, so many payments land on nearly paid invoices
+        random.seed(11)
+        average = self.TOTAL * 2 * self.INVOICES / self.PAYMENTS
+        amounts = [
+            (random.choice(self.invoice_ids), (average * Decimal(random.uniform(0.5, 1.5))).quantize(Decimal('0.01')))
+            for _ in range(self.PAYMENTS)
+        ]
+        batches = [amounts[i:i + 3] for i in range(0, len(amounts), 3)]
+        posted = in_threads(self.post, [(batch,) for batch in batches])
+        self.assertIn(False, posted)
+
+        ledger = dict(
+            Payment.objects.filter(invoice_id__in=self.invoice_ids)
+            .values('invoice_id').annotate(total=Sum('amount')).values_list('invoice_id', 'total')
+        )
+        for invoice in Invoice.objects.filter(id__in=self.invoice_ids):
+            paid = ledger.get(invoice.id, Decimal('0.00'))
+            self.assertLessEqual(invoice.paid_amount, invoice.total_amount)
+            self.assertEqual(invoice.paid_amount, paid)
+            expected_status = 'paid' if paid == invoice.total_amount else ('partial' if paid else 'due')
+            self.assertEqual(invoice.status, expected_status)
+
+
+class ReconciliationTests(TestCase):
+    HEADER = ['Date', 'Amount', 'Reference', 'Narration']
+
+    def setUp(self):
+        self.shop = User.objects.create(username='reconcile', role='shop_owner', shop_name='Reconcile')
+        self.customer = Customer.objects.create(name='Payer', phone='9876543210', shop=self.shop)
+        self.first, self.second = (make_draft(self.shop, []) for _ in range(2))
+        Invoice.objects.filter(pk__in=[self.first.pk, self.second.pk]).update(
+            customer=self.customer, status='due', total_amount=Decimal('100.00'))
+        Invoice.objects.filter(pk=self.second.pk).update(total_amount=Decimal('250.00'))
+        self.today = timezone.now().date().isoformat()
+
+    def statement(self):
+        return [
+            self.HEADER,
+            [self.today, '100.00', 'UTR1', f'Payment for {self.first.invoice_number}'],
+            [self.today, '250.00', 'UTR2', 'UPI from 9876543210'],
+            [self.today, '75.00', 'UTR3', 'Unknown payer'],
+        ]
+
+    def paid(self):
+        return list(Invoice.objects.filter(pk__in=[self.first.pk, self.second.pk]).order_by('id')
+                    .values_list('paid_amount', 'status'))
+
+    def test_lines_are_matched_or_queued_for_review(self):
+        summary = import_statement(self.shop, self.statement(), self.shop)
+        self.assertEqual((summary['matched'], summary['matched_amount'], summary['unmatched']),
+                         (2, Decimal('350.00'), 1))
+        self.assertEqual(self.paid(), [(Decimal('100.00'), 'paid'), (Decimal('250.00'), 'paid')])
+        self.assertEqual(list(StatementLine.objects.values_list('reference_number', 'status')),
+                         [('UTR3', 'unmatched')])
+
+    def test_reimport_skips_known_references(self):
+        import_statement(self.shop, self.statement(), self.shop)
+        summary = import_statement(self.shop, self.statement(), self.shop)
+        self.assertEqual((summary['duplicates'], summary['matched']), (3, 0))
+        self.assertEqual(Payment.objects.count(), 2)
+        self.assertEqual(StatementLine.objects.count(), 1)
+
+    def test_failed_import_posts_nothing(self):
+        def rows():
+            yield from self.statement()
+            raise csv.Error('line contains NUL')
+
+        with self.assertRaises(csv.Error):
+            import_statement(self.shop, rows(), self.shop, chunk_size=1)
+        self.assertFalse(Payment.objects.exists())
+        self.assertFalse(StatementLine.objects.exists())
+        self.assertEqual(self.paid(), [(Decimal('0.00'), 'due'), (Decimal('0.00'), 'due')])
+
+    def test_payment_posted_during_import_sends_the_line_to_review(self):
+        def rows():
+            statement = self.statement()
+            yield statement[0]
+            # Lands after the open invoices were indexed
+            post_payment(self.first, Decimal('60.00'), self.shop)
+            yield from statement[1:]
+
+        summary = import_statement(self.shop, rows(), self.shop)
+        self.assertEqual((summary['matched'], summary['ambiguous']), (1, 1))
+        self.assertEqual(self.paid(), [(Decimal('60.00'), 'partial'), (Decimal('250.00'), 'paid')])
+        line = StatementLine.objects.get(reference_number='UTR1')
+        self.assertEqual((line.status, line.candidate_invoices), ('ambiguous', [self.first.pk]))
@@ -1,14 +1,97 @@
+import codecs
+import csv
+from decimal import Decimal, ROUND_HALF_UP
+
 from rest_framework import viewsets, permissions, status
 from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
 from rest_framework.response import Response
+from rest_framework.views import APIView
 from django.db.models import Q
+from django.http import FileResponse, StreamingHttpResponse
 from django.utils import timezone
 from django.db import transaction
-from .models import Invoice, InvoiceItem, Customer
-from .serializers import InvoiceSerializer, CustomerSerializer, InvoiceItemSerializer
-from inventory.models import Product
+from .models import Invoice, InvoiceItem, Customer, StatementLine
+from .serializers import (
+    InvoiceSerializer, CustomerSerializer, InvoiceItemSerializer, StatementLineSerializer, CheckoutSerializer
+)
+from inventory.models import Product, StockLocation
+from inventory.stock import InsufficientStock
 from users.permissions import IsOwnerOrAdmin
 
+# Rows fetched per database round trip when streaming exports
+EXPORT_CHUNK_SIZE = 2000
+
+INVOICE_EXPORT_COLUMNS = [
+    ('invoice_number', 'Invoice Number'),
+    ('invoice_date', 'Invoice Date'),
+    ('due_date', 'Due Date'),
+    ('status', 'Status'),
+    ('customer__name', 'Customer'),
+    ('customer__gstin', 'Customer GSTIN'),
+    ('subtotal', 'Subtotal'),
+    ('tax_amount', 'Tax Amount'),
+    ('discount_amount', 'Discount'),
+    ('total_amount', 'Total'),
+    ('paid_amount', 'Paid'),
+    ('paid_date', 'Paid Date'),
+    ('created_by__username', 'Created By'),
+    ('created_at', 'Created At'),
+]
+
+ITEM_EXPORT_COLUMNS = [
+    ('invoice__invoice_number', 'Invoice Number'),
+    ('invoice__invoice_date', 'Invoice Date'),
+    ('invoice__status', 'Status'),
+    ('invoice__customer__name', 'Customer'),
+    ('product__sku', 'SKU'),
+    ('product__name', 'Product'),
+    ('description', 'Description'),
+    ('quantity', 'Quantity'),
+    ('unit_price', 'Unit Price'),
+    ('tax_rate', 'Tax Rate'),
+]
+
+
+class _Echo:
+    """File-like object that hands back what csv.writer writes"""
+
+    def write(self, value):
+        return value
+
+
+def _csv_response(filename, header, rows):
+    """Stream rows as a CSV download; the header is sent before the query runs"""
+    writer = csv.writer(_Echo())
+
+    def lines():
+        yield writer.writerow(header)
+        for row in rows:
+            yield writer.writerow(row)
+
+    response = StreamingHttpResponse(lines(), content_type='text/csv')
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
+
+
+def _with_item_totals(row):
+    quantity, unit_price, tax_rate = row[7], row[8], row[9]
+    line_total = (quantity * unit_price).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
+    tax_amount = (line_total * tax_rate / Decimal('100')).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
+    return row + (line_total, tax_amount, line_total + tax_amount)
+
+
+def _stock_location(location_id, shop_id=None):
+    """The requested StockLocation (of the shop, if given); None selects the default location"""
+    if location_id in (None, ''):
+        return None
+    locations = StockLocation.objects.all() if shop_id is None else StockLocation.objects.filter(shop_id=shop_id)
+    try:
+        return locations.get(pk=int(location_id))
+    except (TypeError, ValueError, StockLocation.DoesNotExist):
+        raise ValidationError({'location': ['Location not found.']})
+
+
 class CustomerViewSet(viewsets.ModelViewSet):
     serializer_class = CustomerSerializer
     permission_classes = [permissions.IsAuthenticated]
@@ -31,7 +114,6 @@ class CustomerViewSet(viewsets.ModelViewSet):
     def perform_destroy(self, instance):
         # Prevent deleting customers that have invoices
         if instance.invoices.exists():
-            from rest_framework.exceptions import ValidationError
             raise ValidationError({'error': 'Cannot delete customer with existing invoices'})
         return super().perform_destroy(instance)
 
@@ -50,13 +132,18 @@ class InvoiceItemViewSet(viewsets.ModelViewSet):
 
     def perform_create(self, serializer):
         """Create invoice item and update totals"""
-        item = serializer.save()
-        # Totals will be automatically updated by the model's save method
-        
+        # Totals and stock reservations are updated by the model's save method
+        try:
+            serializer.save()
+        except InsufficientStock as e:
+            raise ValidationError({'error': str(e)})
+
     def perform_update(self, serializer):
         """Update invoice item and recalculate totals"""
-        item = serializer.save()
-        # Totals will be automatically updated by the model's save method
+        try:
+            serializer.save()
+        except InsufficientStock as e:
+            raise ValidationError({'error': str(e)})
 
     def perform_destroy(self, instance):
         """Delete invoice item and update totals"""
@@ -76,31 +163,41 @@ class InvoiceViewSet(viewsets.ModelViewSet):
         """Filter invoices by the current user's shop"""
         user = self.request.user
         if user.is_admin:
-            queryset = Invoice.objects.select_related('customer', 'created_by').prefetch_related('items__product')
+            queryset = Invoice.objects.select_related('customer', 'created_by', 'shop').prefetch_related('items__product')
         else:
-            queryset = Invoice.objects.filter(shop=user).select_related('customer', 'created_by').prefetch_related('items__product')
+            queryset = Invoice.objects.filter(shop=user).select_related('customer', 'created_by', 'shop').prefetch_related('items__product')
         
+        return self._filter_by_params(queryset)
+
+    def _filter_by_params(self, queryset, prefix='', params=None):
+        """Apply the status/start_date/end_date query params; prefix points at the invoice from related models"""
+        if params is None:
+            params = self.request.query_params
+
         # Filter by status
-        status_filter = self.request.query_params.get('status', None)
+        status_filter = params.get('status', None)
         if status_filter:
-            queryset = queryset.filter(status=status_filter)
+            queryset = queryset.filter(**{f'{prefix}status': status_filter})
         
         # Filter by date range
-        start_date = self.request.query_params.get('start_date', None)
-        end_date = self.request.query_params.get('end_date', None)
+        start_date = params.get('start_date', None)
+        end_date = params.get('end_date', None)
         
         if start_date:
-            queryset = queryset.filter(created_at__gte=start_date)
+            queryset = queryset.filter(**{f'{prefix}created_at__gte': start_date})
         if end_date:
-            queryset = queryset.filter(created_at__lte=end_date)
+            queryset = queryset.filter(**{f'{prefix}created_at__lte': end_date})
         
         return queryset
 
     def perform_create(self, serializer):
         """Create invoice with auto-generated number and shop"""
-        invoice = serializer.save(created_by=self.request.user, shop=self.request.user)
-        # Ensure computed totals are up to date when items are nested
-        invoice.refresh_from_db()
+        # Totals for nested items are recalculated once by the serializer
+        serializer.save(created_by=self.request.user, shop=self.request.user)
+
+    def _reload(self, invoice):
+        """Fetch an invoice with its items and products in a constant number of queries"""
+        return Invoice.objects.select_related('customer', 'created_by').prefetch_related('items__product').get(pk=invoice.pk)
 
     def destroy(self, request, *args, **kwargs):
         invoice = self.get_object()
@@ -127,25 +224,28 @@ class InvoiceViewSet(viewsets.ModelViewSet):
             
             # Check if item already exists
             existing_item = InvoiceItem.objects.filter(invoice=invoice, product=product).select_for_update().first()
-            if existing_item:
-                existing_item.quantity += quantity
-                existing_item.save()
-                message = 'Item quantity updated successfully'
-            else:
-                # Create new invoice item
-                InvoiceItem.objects.create(
-                    invoice=invoice,
-                    product=product,
-                    quantity=quantity,
-                    unit_price=product.price,
-                    tax_rate=getattr(product, 'gst_rate', 18),
-                    description=product.name
-                )
-                message = 'Item added successfully'
+            try:
+                # Saving the item reserves its stock for this draft
+                if existing_item:
+                    existing_item.quantity += quantity
+                    existing_item.save()
+                    message = 'Item quantity updated successfully'
+                else:
+                    # Create new invoice item
+                    InvoiceItem.objects.create(
+                        invoice=invoice,
+                        product=product,
+                        quantity=quantity,
+                        unit_price=product.price,
+                        tax_rate=getattr(product, 'gst_rate', 18),
+                        description=product.name
+                    )
+                    message = 'Item added successfully'
+            except InsufficientStock as e:
+                return Response({'error': str(e), 'shortfalls': e.shortfalls}, status=status.HTTP_409_CONFLICT)
             
             # Refresh invoice and return updated data
-            invoice.refresh_from_db()
-            serializer = self.get_serializer(invoice)
+            serializer = self.get_serializer(self._reload(invoice))
             return Response({
                 'message': message,
                 'invoice': serializer.data
@@ -166,8 +266,7 @@ class InvoiceViewSet(viewsets.ModelViewSet):
                 item.delete()
                 
                 # Refresh invoice and return updated data
-                invoice.refresh_from_db()
-                serializer = self.get_serializer(invoice)
+                serializer = self.get_serializer(self._reload(invoice))
                 return Response({
                     'message': 'Item removed successfully',
                     'invoice': serializer.data
@@ -204,35 +303,155 @@ class InvoiceViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_400_BAD_REQUEST
             )
         
-        # Create a payment to mark as paid for audit trail
-        from decimal import Decimal
-        from .models import Payment
-        Payment.objects.create(
-            invoice=invoice,
-            amount=Decimal(invoice.total_amount) - Decimal(invoice.paid_amount),
-            payment_method='cash',
-            reference_number='MARK_PAID',
-            notes='Marked fully paid',
-            created_by=self.request.user,
-        )
+        balance = invoice.total_amount - invoice.paid_amount
+        if balance <= 0:
+            # Nothing is owed (e.g. a zero total), so there is no payment to record
+            invoice.status = 'paid'
+            invoice.paid_date = invoice.paid_date or timezone.now().date()
+            invoice.save(update_fields=['status', 'paid_date', 'updated_at'])
+        else:
+            # Post the outstanding balance as a payment for the audit trail
+            from .payments import post_payment
+            try:
+                post_payment(
+                    invoice,
+                    balance,
+                    self.request.user,
+                    payment_method='cash',
+                    reference_number='MARK_PAID',
+                    notes='Marked fully paid',
+                )
+            except ValueError as e:
+                return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+            invoice.refresh_from_db(fields=['paid_amount', 'status', 'paid_date', 'updated_at'])
         
         serializer = self.get_serializer(invoice)
         return Response(serializer.data)
 
     @action(detail=True, methods=['post'])
     def finalize(self, request, pk=None):
-        """Finalize invoice: apply stock adjustments and move status to due if draft"""
+        """Finalize invoice: apply stock adjustments and move status to due if draft.
+        Pass ``location`` to take the stock from a location other than the default one.
+        """
         invoice = self.get_object()
         if invoice.stock_applied:
             return Response({'error': 'Invoice already finalized'}, status=status.HTTP_400_BAD_REQUEST)
+        location = _stock_location(request.data.get('location'), invoice.shop_id)
         try:
-            invoice.apply_stock_adjustments()
+            invoice.apply_stock_adjustments(location=location)
             invoice.refresh_from_db()
             serializer = self.get_serializer(invoice)
             return Response({'message': 'Invoice finalized and stock updated', 'invoice': serializer.data})
         except ValueError as e:
             return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
+    @action(detail=False, methods=['get'], url_path='export.csv')
+    def export_csv(self, request):
+        """Stream invoices matching the list filters as CSV"""
+        user = request.user
+        invoices = Invoice.objects.all() if user.is_admin else Invoice.objects.filter(shop=user)
+        rows = (
+            self._filter_by_params(invoices)
+            .order_by('created_at', 'id')
+            .values_list(*(field for field, _ in INVOICE_EXPORT_COLUMNS))
+            .iterator(chunk_size=EXPORT_CHUNK_SIZE)
+        )
+        return _csv_response('invoices.csv', [label for _, label in INVOICE_EXPORT_COLUMNS], rows)
+
+    @action(detail=False, methods=['get'], url_path='export-items.csv')
+    def export_items_csv(self, request):
+        """Stream line items of invoices matching the list filters as CSV"""
+        user = request.user
+        items = InvoiceItem.objects.all() if user.is_admin else InvoiceItem.objects.filter(invoice__shop=user)
+        rows = (
+            self._filter_by_params(items, prefix='invoice__')
+            .order_by('invoice__created_at', 'invoice_id', 'id')
+            .values_list(*(field for field, _ in ITEM_EXPORT_COLUMNS))
+            .iterator(chunk_size=EXPORT_CHUNK_SIZE)
+        )
+        header = [label for _, label in ITEM_EXPORT_COLUMNS] + ['Line Total', 'Tax Amount', 'Total With Tax']
+        return _csv_response('invoice-items.csv', header, (_with_item_totals(row) for row in rows))
+
+    @action(detail=True, methods=['get'])
+    def pdf(self, request, pk=None):
+        """Download the invoice as PDF, rendered once per content change"""
+        from .pdf import get_invoice_pdf
+        invoice = self.get_object()
+        path = get_invoice_pdf(invoice)
+        return FileResponse(
+            open(path, 'rb'),
+            content_type='application/pdf',
+            as_attachment=request.query_params.get('download') in ('1', 'true'),
+            filename=f'{invoice.invoice_number}.pdf',
+        )
+
+    @action(detail=False, methods=['post'])
+    def bulk_pdf(self, request):
+        """Stream a ZIP of invoice PDFs selected by invoice_ids or by status/start_date/end_date"""
+        from .pdf import invoice_pdf_files, stream_zip
+        user = request.user
+        invoices = Invoice.objects.all() if user.is_admin else Invoice.objects.filter(shop=user)
+
+        invoice_ids = request.data.get('invoice_ids')
+        if invoice_ids:
+            if not isinstance(invoice_ids, list):
+                return Response({'error': 'invoice_ids must be a list'}, status=status.HTTP_400_BAD_REQUEST)
+            try:
+                invoice_ids = [int(invoice_id) for invoice_id in invoice_ids]
+            except (TypeError, ValueError):
+                return Response({'error': 'Invalid invoice IDs'}, status=status.HTTP_400_BAD_REQUEST)
+            invoices = invoices.filter(id__in=invoice_ids)
+        else:
+            invoices = self._filter_by_params(invoices, params=request.data)
+
+        selected_ids = list(invoices.order_by('id').values_list('id', flat=True))
+        if not selected_ids:
+            return Response({'error': 'No invoices match the selection'}, status=status.HTTP_400_BAD_REQUEST)
+
+        response = StreamingHttpResponse(stream_zip(invoice_pdf_files(selected_ids)), content_type='application/zip')
+        response['Content-Disposition'] = 'attachment; filename="invoices.zip"'
+        return response
+
+    @action(detail=False, methods=['post'])
+    def bulk_finalize(self, request):
+        """Finalize many invoices in one transaction"""
+        from .finalization import bulk_finalize, ALL_OR_NOTHING, FINALIZE_MODES
+        invoice_ids = request.data.get('invoice_ids', [])
+        mode = request.data.get('mode', ALL_OR_NOTHING)
+
+        if not invoice_ids or not isinstance(invoice_ids, list):
+            return Response({'error': 'No invoice IDs provided'}, status=status.HTTP_400_BAD_REQUEST)
+        if mode not in FINALIZE_MODES:
+            return Response(
+                {'error': f"mode must be one of: {', '.join(FINALIZE_MODES)}"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        try:
+            invoice_ids = [int(invoice_id) for invoice_id in invoice_ids]
+        except (TypeError, ValueError):
+            return Response({'error': 'Invalid invoice IDs'}, status=status.HTTP_400_BAD_REQUEST)
+
+        queryset = self.get_queryset()
+        location = _stock_location(request.data.get('location'), None if request.user.is_admin else request.user.pk)
+        if location is not None:
+            # Stock leaves one shop's location, so only that shop's invoices qualify
+            queryset = queryset.filter(shop_id=location.shop_id)
+        try:
+            # Invoices outside the user's shop are reported as not found
+            results = bulk_finalize(invoice_ids, mode=mode, queryset=queryset, location=location)
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_409_CONFLICT)
+
+        finalized = sum(1 for result in results if result['status'] == 'finalized')
+        failed = sum(1 for result in results if result['status'] == 'failed')
+        response_status = status.HTTP_400_BAD_REQUEST if mode == ALL_OR_NOTHING and failed else status.HTTP_200_OK
+        return Response({
+            'mode': mode,
+            'finalized_count': finalized,
+            'failed_count': failed,
+            'results': results,
+        }, status=response_status)
+
     @action(detail=True, methods=['post'])
     def partial_payment(self, request, pk=None):
         """Record partial payment"""
@@ -253,28 +472,132 @@ class InvoiceViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_400_BAD_REQUEST
             )
         
-        # Apply with rounding to 2 decimals and clamp to not exceed total
-        from decimal import Decimal, ROUND_HALF_UP
-        invoice.paid_amount = (Decimal(invoice.paid_amount) + Decimal(str(amount))).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
-        if invoice.paid_amount >= invoice.total_amount:
-            invoice.status = 'paid'
-            invoice.paid_date = timezone.now().date()
-            # clamp exact to total
-            invoice.paid_amount = invoice.total_amount
-        else:
-            invoice.status = 'partial'
-        
-        invoice.save()
-        # Create a payment record for audit
-        from .models import Payment
-        Payment.objects.create(
-            invoice=invoice,
-            amount=Decimal(str(amount)).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP),
-            payment_method=request.data.get('payment_method', 'cash'),
-            reference_number=request.data.get('reference_number', ''),
-            notes=request.data.get('notes', ''),
-            created_by=self.request.user,
-        )
+        # Insert the payment and add it to paid_amount (capped at the total) atomically
+        from .payments import post_payment
+        try:
+            post_payment(
+                invoice,
+                amount,
+                self.request.user,
+                payment_method=request.data.get('payment_method', 'cash'),
+                reference_number=request.data.get('reference_number', ''),
+                notes=request.data.get('notes', ''),
+            )
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        invoice.refresh_from_db(fields=['paid_amount', 'status', 'paid_date', 'updated_at'])
         
         serializer = self.get_serializer(invoice)
-        return Response(serializer.data)
\ No newline at end of file
+        return Response(serializer.data)
+
+
+class StatementLineViewSet(viewsets.ReadOnlyModelViewSet):
+    """Statement lines left for review by bank statement imports"""
+    serializer_class = StatementLineSerializer
+    permission_classes = [IsOwnerOrAdmin]
+
+    def get_queryset(self):
+        user = self.request.user
+        queryset = StatementLine.objects.all() if user.is_admin else StatementLine.objects.filter(shop=user)
+        status_filter = self.request.query_params.get('status')
+        if status_filter:
+            queryset = queryset.filter(status=status_filter)
+        import_id = self.request.query_params.get('import_id')
+        if import_id:
+            queryset = queryset.filter(import_id=import_id)
+        return queryset
+
+    @action(detail=False, methods=['post'], url_path='import')
+    def import_statement(self, request):
+        """Import a bank/UPI statement CSV, posting matched payments and queueing the rest for review"""
+        from .reconciliation import import_statement
+        statement = request.FILES.get('file')
+        if statement is None:
+            return Response({'error': 'Upload the statement CSV as "file"'}, status=status.HTTP_400_BAD_REQUEST)
+
+        shop = request.user
+        if request.user.is_admin and request.data.get('shop'):
+            from users.models import User
+            shop = User.objects.filter(pk=request.data.get('shop')).first()
+            if shop is None:
+                return Response({'error': 'Shop not found'}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            summary = import_statement(shop, csv.reader(codecs.iterdecode(statement, 'utf-8-sig')), request.user)
+        except (ValueError, csv.Error) as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(summary)
+
+    @action(detail=True, methods=['post'])
+    def resolve(self, request, pk=None):
+        """Post a reviewed line as a payment against the chosen invoice"""
+        from .payments import post_payment
+        line = self.get_object()
+        if line.status in ('resolved', 'ignored'):
+            return Response({'error': f'Line is already {line.status}'}, status=status.HTTP_400_BAD_REQUEST)
+
+        invoice = Invoice.objects.filter(pk=request.data.get('invoice_id'), shop_id=line.shop_id).first()
+        if invoice is None:
+            return Response({'error': 'Invoice not found'}, status=status.HTTP_400_BAD_REQUEST)
+        amount = request.data.get('amount', line.amount)
+        try:
+            amount = Decimal(str(amount))
+        except (TypeError, ArithmeticError):
+            return Response({'error': 'Invalid amount'}, status=status.HTTP_400_BAD_REQUEST)
+
+        with transaction.atomic():
+            try:
+                line.payment = post_payment(
+                    invoice,
+                    amount,
+                    request.user,
+                    payment_method='bank_transfer',
+                    reference_number=line.reference_number,
+                    notes=f'Statement import {line.import_id}, line {line.line_number}: {line.description}'.strip(),
+                )
+            except ValueError as e:
+                return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+            line.status = 'resolved'
+            line.resolved_at = timezone.now()
+            line.save(update_fields=['payment', 'status', 'resolved_at'])
+        return Response(self.get_serializer(line).data)
+
+    @action(detail=True, methods=['post'])
+    def ignore(self, request, pk=None):
+        """Dismiss a line that is not a customer payment"""
+        line = self.get_object()
+        if line.status == 'resolved':
+            return Response({'error': 'Line is already resolved'}, status=status.HTTP_400_BAD_REQUEST)
+        line.status = 'ignored'
+        line.resolved_at = timezone.now()
+        line.save(update_fields=['status', 'resolved_at'])
+        return Response(self.get_serializer(line).data)
+
+
+class CheckoutView(APIView):
+    """Counter sale in one request: lines by SKU, optional customer and payment"""
+    permission_classes = [permissions.IsAuthenticated]
+
+    def post(self, request):
+        from .checkout import CheckoutError, checkout
+
+        serializer = CheckoutSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+        location = _stock_location(data.get('location'), request.user.pk)
+        try:
+            receipt = checkout(
+                request.user,
+                request.user,
+                data['lines'],
+                customer_id=data.get('customer'),
+                payment=data.get('payment'),
+                discount_amount=data['discount_amount'],
+                notes=data['notes'],
+                location=location,
+            )
+        except InsufficientStock as e:
+            return Response({'error': str(e), 'shortfalls': e.shortfalls}, status=status.HTTP_409_CONFLICT)
+        except CheckoutError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(receipt, status=status.HTTP_201_CREATED)
@@ -35,6 +35,7 @@ INSTALLED_APPS = [
     'inventory',
     'billing',
     'reports',
+    'events',
 ]
 
 MIDDLEWARE = [
@@ -68,6 +69,8 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = 'config.wsgi.application'
+# The event stream is async and needs the ASGI application
+ASGI_APPLICATION = 'config.asgi.application'
 
 # Database
 DATABASES = {
@@ -78,6 +81,31 @@ DATABASES = {
     )
 }
 
+# Cache: per-process local memory by default, which only suits a single worker.
+# With more workers point CACHE_BACKEND at a shared backend such as
+# django.core.cache.backends.redis.RedisCache (CACHE_LOCATION=redis://host:6379/0)
+# so cached reports, SKU lookups and their invalidation reach every worker; on
+# local memory those caches are switched off.
+CACHES = {
+    'default': {
+        'BACKEND': config('CACHE_BACKEND', default='django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': config('CACHE_LOCATION', default='stoqman'),
+    }
+}
+# Worker processes serving the app (gunicorn reads the same variable)
+WEB_CONCURRENCY = config('WEB_CONCURRENCY', default=1, cast=int)
+
+# Seconds a cached report stays valid when its shop's data does not change
+REPORT_CACHE_TIMEOUT = config('REPORT_CACHE_TIMEOUT', default=300, cast=int)
+# Threads (each keeping one connection) running async report queries per process,
+# and the most queries one request runs at once
+REPORT_QUERY_CONCURRENCY = config('REPORT_QUERY_CONCURRENCY', default=4, cast=int)
+
+# Per-worker SKU lookup cache: records kept, and seconds a shop's version token
+# is trusted before re-reading it from the shared cache
+PRODUCT_LOOKUP_CACHE_SIZE = config('PRODUCT_LOOKUP_CACHE_SIZE', default=10000, cast=int)
+PRODUCT_LOOKUP_VERSION_TTL = config('PRODUCT_LOOKUP_VERSION_TTL', default=1.0, cast=float)
+
 # Password validation
 AUTH_PASSWORD_VALIDATORS = [
     {'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator'},
@@ -127,6 +155,28 @@ SIMPLE_JWT = {
     'ROTATE_REFRESH_TOKENS': True,
 }
 
+# Invoice numbering: numbers reserved per worker at a time, and whether every
+# number must be used (gapless mode allocates inside the invoice transaction)
+INVOICE_NUMBER_BLOCK_SIZE = config('INVOICE_NUMBER_BLOCK_SIZE', default=1, cast=int)
+INVOICE_NUMBER_GAPLESS = config('INVOICE_NUMBER_GAPLESS', default=False, cast=bool)
+
+# Worker processes each bulk PDF download starts to render invoices (defaults to 2)
+INVOICE_PDF_WORKERS = config('INVOICE_PDF_WORKERS', default=0, cast=int) or None
+
+# Minutes a draft invoice holds its stock after its items last changed
+STOCK_RESERVATION_TTL_MINUTES = config('STOCK_RESERVATION_TTL_MINUTES', default=30, cast=int)
+
+# Days after an invoice's due date in which a statement line may still match it
+RECONCILE_DATE_WINDOW_DAYS = config('RECONCILE_DATE_WINDOW_DAYS', default=30, cast=int)
+
+# Live event stream broker: events.broker.InProcessBroker reaches the streams of
+# one worker; events.broker.DatabaseBroker relays through the Event table to all
+EVENTS_BROKER = config('EVENTS_BROKER', default='events.broker.InProcessBroker')
+# Seconds between Event table polls per worker with the database broker
+EVENTS_POLL_INTERVAL = config('EVENTS_POLL_INTERVAL', default=1.0, cast=float)
+# Seconds between keep-alive comments on an idle event stream
+EVENTS_KEEPALIVE_SECONDS = config('EVENTS_KEEPALIVE_SECONDS', default=15, cast=int)
+
 # CORS settings
 CORS_ALLOW_ALL_ORIGINS = False
 
@@ -10,17 +10,22 @@ from rest_framework_simplejwt.views import (
 from django.http import JsonResponse
 
 # Import viewsets
-from inventory.views import ProductViewSet, CategoryViewSet
-from billing.views import InvoiceViewSet, CustomerViewSet, InvoiceItemViewSet
+from inventory.views import ProductViewSet, CategoryViewSet, StockTakeViewSet, ProductBatchViewSet, StockLocationViewSet
+from billing.views import InvoiceViewSet, CustomerViewSet, InvoiceItemViewSet, StatementLineViewSet, CheckoutView
 from users.views import UserViewSet, ShopOwnerRegistrationView, StaffRegistrationView
+from events.views import event_stream
 
 # Create router and register viewsets
 router = DefaultRouter()
 router.register(r'products', ProductViewSet, basename='product')
 router.register(r'categories', CategoryViewSet, basename='category')
+router.register(r'stock-takes', StockTakeViewSet, basename='stocktake')
+router.register(r'batches', ProductBatchViewSet, basename='productbatch')
+router.register(r'stock-locations', StockLocationViewSet, basename='stocklocation')
 router.register(r'invoices', InvoiceViewSet, basename='invoice')
 router.register(r'invoice-items', InvoiceItemViewSet, basename='invoiceitem')
 router.register(r'customers', CustomerViewSet, basename='customer')
+router.register(r'statement-lines', StatementLineViewSet, basename='statementline')
 router.register(r'users', UserViewSet, basename='user')
 
 def health_check(request):
@@ -28,6 +33,11 @@ def health_check(request):
 
 urlpatterns = [
     path('admin/', admin.site.urls),
+    # CSV exports are also reachable without the router's trailing slash
+    path('api/invoices/export.csv', InvoiceViewSet.as_view({'get': 'export_csv'}), name='invoice-export-csv'),
+    path('api/invoices/export-items.csv', InvoiceViewSet.as_view({'get': 'export_items_csv'}), name='invoice-export-items-csv'),
+    path('api/checkout/', CheckoutView.as_view(), name='checkout'),
+    path('api/events/', event_stream, name='event-stream'),
     path('api/', include(router.urls)),
     
     # Authentication endpoints
@@ -37,6 +47,7 @@ urlpatterns = [
     path('api/auth/register/staff/', StaffRegistrationView.as_view(), name='staff_register'),
     
     path('api/reports/', include('reports.urls')),
+    path('api/notifications/', include('users.notification_urls')),
     path('api/health/', health_check, name='health_check'),
 ]
 
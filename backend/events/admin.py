@@ -0,0 +1,10 @@
+from django.contrib import admin
+
+from .models import Event
+
+
+@admin.register(Event)
+class EventAdmin(admin.ModelAdmin):
+    list_display = ['id', 'shop', 'kind', 'created_at']
+    list_filter = ['kind', 'created_at']
+    readonly_fields = ['shop', 'kind', 'payload', 'created_at']
@@ -0,0 +1,10 @@
+from django.apps import AppConfig
+
+
+class EventsConfig(AppConfig):
+    default_auto_field = 'django.db.models.BigAutoField'
+    name = 'events'
+
+    def ready(self):
+        # Publish invoice changes made through Invoice.save()/delete()
+        from . import signals  # noqa: F401
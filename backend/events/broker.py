@@ -0,0 +1,269 @@
+"""Live shop events behind the server-sent-events stream.
+
+Write paths call the publish_* helpers inside their transaction; once it
+commits, the configured broker (``EVENTS_BROKER``) sends the events on.
+InProcessBroker fans them out to the streams open in this worker: each stream
+is a bounded asyncio queue read by one coroutine, so an idle connection costs
+a queue and a suspended task, not a thread. DatabaseBroker writes the events
+to the Event table instead and runs one poller per worker that relays new rows
+to its local streams, so every worker sees every event. Payloads carry ids and
+the changed values only; clients refetch what they show.
+"""
+import asyncio
+import itertools
+import threading
+from collections import defaultdict
+from datetime import timedelta
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+STOCK = 'stock'
+INVOICE = 'invoice'
+PAYMENT = 'payment'
+KINDS = (STOCK, INVOICE, PAYMENT)
+# Sent in place of events a stream missed; the client should refetch everything
+RESYNC = 'resync'
+
+QUEUE_SIZE = 200
+PAYLOAD_CHUNK = 500
+REPLAY_LIMIT = 500
+# Event rows inserted this long before a poll may only become visible after it
+POLL_LAG = timedelta(seconds=2)
+
+
+class Subscription:
+    """One open stream: a bounded queue that any thread can feed"""
+
+    def __init__(self, shop_id, loop):
+        self.shop_id = shop_id
+        self.loop = loop
+        self.queue = asyncio.Queue(maxsize=QUEUE_SIZE)
+
+    def put(self, event):
+        try:
+            self.loop.call_soon_threadsafe(self._put, event)
+        except RuntimeError:
+            # The stream's loop has shut down
+            pass
+
+    def _put(self, event):
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            # A stalled client gets one resync instead of an unbounded backlog
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait((None, RESYNC, {}))
+
+    async def get(self):
+        return await self.queue.get()
+
+
+class InProcessBroker:
+    """Fans events out to the streams open in this worker"""
+
+    def __init__(self):
+        self._subscriptions = defaultdict(set)
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+
+    def listening(self):
+        """Whether a publish can reach anyone; writers skip building payloads otherwise"""
+        return bool(self._subscriptions)
+
+    def publish(self, events):
+        """Send (shop_id, kind, payload) events; called after commit"""
+        for shop_id, kind, payload in events:
+            self.fan_out(shop_id, (next(self._ids), kind, payload))
+
+    def fan_out(self, shop_id, event):
+        with self._lock:
+            subscriptions = list(self._subscriptions.get(shop_id, ()))
+        for subscription in subscriptions:
+            subscription.put(event)
+
+    def _register(self, shop_id):
+        subscription = Subscription(shop_id, asyncio.get_running_loop())
+        with self._lock:
+            self._subscriptions[shop_id].add(subscription)
+        return subscription
+
+    async def subscribe(self, shop_id, last_event_id=None):
+        subscription = self._register(shop_id)
+        if last_event_id is not None:
+            # Nothing is kept in memory, so a reconnecting client refetches instead
+            subscription.put((None, RESYNC, {}))
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscriptions = self._subscriptions.get(subscription.shop_id)
+            if subscriptions is not None:
+                subscriptions.discard(subscription)
+                if not subscriptions:
+                    del self._subscriptions[subscription.shop_id]
+
+
+class DatabaseBroker(InProcessBroker):
+    """Shares events between workers through the Event table, polled once per worker"""
+
+    def __init__(self):
+        super().__init__()
+        self.interval = getattr(settings, 'EVENTS_POLL_INTERVAL', 1.0)
+        self._poller = None
+        # Event ids already relayed, by created_at, for the lag window the polls overlap
+        self._relayed = {}
+
+    def listening(self):
+        # Streams in other workers may be listening
+        return True
+
+    def publish(self, events):
+        from .models import Event
+        Event.objects.bulk_create(
+            [Event(shop_id=shop_id, kind=kind, payload=payload) for shop_id, kind, payload in events]
+        )
+
+    def _replay(self, shop_id, last_event_id):
+        """Events after ``last_event_id``, or None when some may have been purged or are too many"""
+        from .models import Event
+        close_old_connections()
+        if not Event.objects.filter(id__lte=last_event_id).exists():
+            return None
+        rows = list(
+            Event.objects.filter(shop_id=shop_id, id__gt=last_event_id)
+            .order_by('id').values_list('id', 'kind', 'payload')[:REPLAY_LIMIT + 1]
+        )
+        return None if len(rows) > REPLAY_LIMIT else rows
+
+    def _fetch(self, shop_ids, since):
+        from .models import Event
+        close_old_connections()
+        return list(
+            Event.objects.filter(created_at__gte=since, shop_id__in=shop_ids)
+            .order_by('id').values_list('id', 'shop_id', 'kind', 'payload', 'created_at')
+        )
+
+    async def subscribe(self, shop_id, last_event_id=None):
+        subscription = self._register(shop_id)
+        loop = asyncio.get_running_loop()
+        if self._poller is None or self._poller.done() or self._poller.get_loop() is not loop:
+            self._poller = loop.create_task(self._poll())
+        if last_event_id is not None:
+            missed = await sync_to_async(self._replay, thread_sensitive=False)(shop_id, last_event_id)
+            for event in missed if missed is not None else [(None, RESYNC, {})]:
+                subscription.put(event)
+        return subscription
+
+    async def _poll(self):
+        since = timezone.now()
+        while self._subscriptions:
+            await asyncio.sleep(self.interval)
+            started = timezone.now()
+            try:
+                rows = await sync_to_async(self._fetch, thread_sensitive=False)(
+                    list(self._subscriptions), since - POLL_LAG
+                )
+            except Exception:
+                # Keep the streams open through a database hiccup; the next poll catches up
+                continue
+            for event_id, shop_id, kind, payload, created_at in rows:
+                if event_id not in self._relayed:
+                    self._relayed[event_id] = created_at
+                    self.fan_out(shop_id, (event_id, kind, payload))
+            since = started
+            self._relayed = {
+                event_id: created_at for event_id, created_at in self._relayed.items()
+                if created_at >= since - POLL_LAG
+            }
+
+
+_broker = None
+_broker_lock = threading.Lock()
+
+
+def get_broker():
+    global _broker
+    if _broker is None:
+        with _broker_lock:
+            if _broker is None:
+                _broker = import_string(getattr(settings, 'EVENTS_BROKER', 'events.broker.InProcessBroker'))()
+    return _broker
+
+
+def _publish_after_commit(build):
+    """Once the transaction commits, publish the events build() returns if anyone can listen"""
+    def send():
+        broker = get_broker()
+        if broker.listening():
+            events = build()
+            if events:
+                broker.publish(events)
+    # A failed publish must not turn a committed write into an error
+    transaction.on_commit(send, robust=True)
+
+
+def _events(kind, key, rows_by_shop):
+    return [
+        (shop_id, kind, {key: rows[start:start + PAYLOAD_CHUNK]})
+        for shop_id, rows in rows_by_shop.items()
+        for start in range(0, len(rows), PAYLOAD_CHUNK)
+    ]
+
+
+def publish_stock_changes(product_ids):
+    """Publish the stock of the given products to their shops after commit"""
+    product_ids = list(product_ids)
+    if not product_ids:
+        return
+
+    def build():
+        from inventory.models import Product
+        by_shop = defaultdict(list)
+        for start in range(0, len(product_ids), PAYLOAD_CHUNK):
+            rows = Product.objects.filter(id__in=product_ids[start:start + PAYLOAD_CHUNK]).values_list(
+                'id', 'shop_id', 'stock_quantity', 'reserved_quantity'
+            )
+            for product_id, shop_id, stock, reserved in rows:
+                by_shop[shop_id].append({
+                    'id': product_id, 'stock_quantity': stock, 'available_quantity': max(stock - reserved, 0),
+                })
+        return _events(STOCK, 'products', by_shop)
+
+    _publish_after_commit(build)
+
+
+def publish_invoice_changes(invoice_ids, kind=INVOICE, extra=None):
+    """Publish the status and totals of the given invoices after commit.
+
+    ``extra`` maps invoice ids to fields added to their entries, such as the
+    amount a payment added.
+    """
+    invoice_ids = list(invoice_ids)
+    if not invoice_ids:
+        return
+
+    def build():
+        from billing.models import Invoice
+        by_shop = defaultdict(list)
+        rows = Invoice.objects.filter(id__in=invoice_ids).values_list(
+            'id', 'shop_id', 'invoice_number', 'status', 'total_amount', 'paid_amount'
+        )
+        for invoice_id, shop_id, number, status, total, paid in rows:
+            by_shop[shop_id].append({
+                'id': invoice_id, 'invoice_number': number, 'status': status,
+                'total_amount': str(total), 'paid_amount': str(paid),
+                **(extra or {}).get(invoice_id, {}),
+            })
+        return _events(kind, 'invoices', by_shop)
+
+    _publish_after_commit(build)
+
+
+def publish_invoice_deleted(invoice):
+    shop_id, invoice_id = invoice.shop_id, invoice.pk
+    _publish_after_commit(lambda: [(shop_id, INVOICE, {'invoices': [{'id': invoice_id, 'deleted': True}]})])
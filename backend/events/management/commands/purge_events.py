@@ -0,0 +1,18 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from events.models import Event
+
+
+class Command(BaseCommand):
+    help = 'Delete relayed stream events older than --hours (database broker only; run from cron)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--hours', type=int, default=24, help='Keep events this many hours (default 24)')
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(hours=options['hours'])
+        deleted, _ = Event.objects.filter(created_at__lt=cutoff).delete()
+        self.stdout.write(self.style.SUCCESS(f'Deleted {deleted} events'))
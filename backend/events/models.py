@@ -0,0 +1,20 @@
+from django.contrib.auth import get_user_model
+from django.db import models
+
+User = get_user_model()
+
+
+class Event(models.Model):
+    """A published shop event, kept briefly so workers polling the table can relay it"""
+    shop = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    kind = models.CharField(max_length=20)
+    payload = models.JSONField(default=dict)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['id']
+        # Pollers and the purge both read a recent created_at range
+        indexes = [models.Index(fields=['created_at'], name='events_event_created_idx')]
+
+    def __str__(self):
+        return f"{self.shop_id}: {self.kind} #{self.pk}"
@@ -0,0 +1,18 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from billing.models import Invoice
+
+from .broker import publish_invoice_changes, publish_invoice_deleted
+
+
+@receiver(post_save, sender=Invoice)
+def publish_invoice_save(sender, instance, created, **kwargs):
+    """Publish new invoices and status changes saved through the model"""
+    if created or getattr(instance, '_loaded_status', instance.status) != instance.status:
+        publish_invoice_changes([instance.pk])
+
+
+@receiver(post_delete, sender=Invoice)
+def publish_invoice_delete(sender, instance, **kwargs):
+    publish_invoice_deleted(instance)
@@ -0,0 +1,11 @@
+from django.test import AsyncClient, TestCase
+
+
+class EventStreamTests(TestCase):
+    def test_wsgi_requests_are_refused(self):
+        response = self.client.get('/api/events/')
+        self.assertEqual(response.status_code, 503)
+
+    async def test_asgi_requests_need_a_token(self):
+        response = await AsyncClient().get('/api/events/')
+        self.assertEqual(response.status_code, 401)
@@ -0,0 +1,78 @@
+import asyncio
+import json
+
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.http import JsonResponse, StreamingHttpResponse
+from django.views.decorators.http import require_GET
+
+from users.authentication import authenticate_jwt
+
+from .broker import KINDS, RESYNC, get_broker
+
+# Milliseconds a browser EventSource waits before reconnecting
+RETRY_MS = 3000
+
+
+def _format(event_id, kind, payload):
+    lines = [] if event_id is None else [f'id: {event_id}']
+    lines.append(f'event: {kind}')
+    lines.append(f"data: {json.dumps(payload, separators=(',', ':'))}")
+    return '\n'.join(lines) + '\n\n'
+
+
+async def _stream(shop_id, kinds, last_event_id):
+    # Subscribing inside the stream ties the subscription to the response's lifetime
+    broker = get_broker()
+    subscription = await broker.subscribe(shop_id, last_event_id)
+    keepalive = getattr(settings, 'EVENTS_KEEPALIVE_SECONDS', 15)
+    try:
+        yield f'retry: {RETRY_MS}\n\n'
+        while True:
+            try:
+                event_id, kind, payload = await asyncio.wait_for(subscription.get(), keepalive)
+            except asyncio.TimeoutError:
+                yield ': keepalive\n\n'
+                continue
+            if kind == RESYNC or kind in kinds:
+                yield _format(event_id, kind, payload)
+    finally:
+        broker.unsubscribe(subscription)
+
+
+@require_GET
+async def event_stream(request):
+    """Server-sent events for a shop's stock, invoice and payment changes.
+
+    ``?types=stock,invoice`` narrows the kinds; admins pick the shop with
+    ``?shop=<id>``. Served by the ASGI process only: a WSGI worker would
+    buffer the endless stream, so it answers 503 instead.
+    """
+    if not isinstance(request, ASGIRequest):
+        return JsonResponse({'error': 'The event stream is served by the ASGI service'}, status=503)
+    user = await authenticate_jwt(request, allow_query_token=True)
+    if user is None:
+        return JsonResponse({'detail': 'Authentication credentials were not provided or are invalid.'}, status=401)
+
+    shop_id = user.pk
+    if user.is_admin:
+        try:
+            shop_id = int(request.GET['shop'])
+        except (KeyError, ValueError):
+            return JsonResponse({'error': 'shop is required for admins'}, status=400)
+
+    kinds = {kind for kind in request.GET.get('types', '').split(',') if kind} or set(KINDS)
+    if not kinds <= set(KINDS):
+        return JsonResponse({'error': f"types must be among: {', '.join(KINDS)}"}, status=400)
+
+    last_event_id = request.headers.get('Last-Event-ID') or request.GET.get('last_event_id')
+    try:
+        last_event_id = int(last_event_id) if last_event_id else None
+    except ValueError:
+        last_event_id = None
+
+    response = StreamingHttpResponse(_stream(shop_id, kinds, last_event_id), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    # Keep nginx-style proxies from buffering the stream
+    response['X-Accel-Buffering'] = 'no'
+    return response
@@ -1,5 +1,7 @@
 from django.contrib import admin
-from .models import Category, Product
+from .models import (
+    Category, LocationStock, Product, ProductBatch, StockLocation, StockMovement, StockTake, StockTakeLine, StockTransfer
+)
 
 @admin.register(Category)
 class CategoryAdmin(admin.ModelAdmin):
@@ -27,7 +29,7 @@ class ProductAdmin(admin.ModelAdmin):
     list_editable = ['price', 'stock_quantity', 'threshold']
     readonly_fields = [
         'created_at', 'updated_at', 'is_low_stock', 'is_out_of_stock',
-        'price_with_gst', 'gst_amount', 'total_value'
+        'price_with_gst', 'gst_amount', 'total_value', 'reserved_quantity', 'located_quantity'
     ]
     ordering = ['-created_at']
     
@@ -39,7 +41,7 @@ class ProductAdmin(admin.ModelAdmin):
             'fields': ('price', 'gst_rate', 'price_with_gst', 'gst_amount')
         }),
         ('Inventory', {
-            'fields': ('stock_quantity', 'threshold', 'total_value')
+            'fields': ('stock_quantity', 'reserved_quantity', 'located_quantity', 'threshold', 'total_value')
         }),
         ('Status', {
             'fields': ('is_low_stock', 'is_out_of_stock'),
@@ -68,4 +70,81 @@ class ProductAdmin(admin.ModelAdmin):
     def save_model(self, request, obj, form, change):
         if not change:  # If creating new product
             obj.created_by = request.user
-        super().save_model(request, obj, form, change)
\ No newline at end of file
+        super().save_model(request, obj, form, change)
+
+
+class StockTakeLineInline(admin.TabularInline):
+    model = StockTakeLine
+    extra = 0
+    fields = ['product', 'counted_quantity', 'expected_quantity', 'variance']
+    readonly_fields = ['expected_quantity', 'variance']
+    raw_id_fields = ['product']
+
+
+@admin.register(StockTake)
+class StockTakeAdmin(admin.ModelAdmin):
+    list_display = ['id', 'shop', 'status', 'created_by', 'created_at', 'applied_at']
+    list_filter = ['status', 'created_at']
+    readonly_fields = ['status', 'created_at', 'applied_by', 'applied_at']
+    inlines = [StockTakeLineInline]
+
+
+@admin.register(StockMovement)
+class StockMovementAdmin(admin.ModelAdmin):
+    list_display = ['product', 'quantity', 'reason', 'reference', 'created_at']
+    list_filter = ['reason', 'created_at']
+    search_fields = ['product__sku', 'product__name', 'reference']
+    raw_id_fields = ['product']
+
+    def has_change_permission(self, request, obj=None):
+        # The ledger is append-only
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(ProductBatch)
+class ProductBatchAdmin(admin.ModelAdmin):
+    list_display = ['product', 'batch_number', 'expiry_date', 'quantity', 'cost_price', 'received_at']
+    list_filter = ['expiry_date']
+    search_fields = ['batch_number', 'product__sku', 'product__name']
+    raw_id_fields = ['product']
+    # Quantities move with stock through inventory.batches
+    readonly_fields = ['quantity', 'received_at']
+
+
+class LocationStockInline(admin.TabularInline):
+    model = LocationStock
+    extra = 0
+    fields = ['product', 'quantity']
+    raw_id_fields = ['product']
+    # Quantities move through transfers so product totals stay in step
+    readonly_fields = ['product', 'quantity']
+    can_delete = False
+
+    def has_add_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(StockLocation)
+class StockLocationAdmin(admin.ModelAdmin):
+    list_display = ['name', 'shop', 'is_default', 'created_at']
+    list_filter = ['is_default']
+    search_fields = ['name']
+    readonly_fields = ['is_default', 'created_at']
+    inlines = [LocationStockInline]
+
+
+@admin.register(StockTransfer)
+class StockTransferAdmin(admin.ModelAdmin):
+    list_display = ['product', 'from_location', 'to_location', 'quantity', 'reference', 'created_by', 'created_at']
+    list_filter = ['created_at']
+    search_fields = ['product__sku', 'product__name', 'reference']
+    raw_id_fields = ['product']
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_add_permission(self, request):
+        return False
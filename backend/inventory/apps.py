@@ -4,3 +4,12 @@ from django.apps import AppConfig
 class InventoryConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'inventory'
+
+    def ready(self):
+        # Invalidate cached SKU lookups when products change
+        from . import signals  # noqa: F401
+
+        # Table remakes on SQLite drop the search triggers; put them back
+        from django.db.models.signals import post_migrate
+        from .search import reinstall_after_migrate
+        post_migrate.connect(reinstall_after_migrate, sender=self)
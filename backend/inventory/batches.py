@@ -0,0 +1,115 @@
+"""Product batches with expiry dates, drawn down first-expiry-first-out.
+
+``Product.stock_quantity`` stays the total that list endpoints read; batches
+record which lots that stock is in. Stock that predates batch tracking is
+"unbatched" (stock_quantity minus the batch total) and is used after the
+batches. Allocation is set-based: one query ranks the candidate batches with a
+running total per product (a window SUM in expiry order) and one CASE UPDATE
+takes each batch's share. Callers hold the products' rows (the guarded stock
+UPDATE or a row lock) so concurrent allocations for a product run in turn.
+"""
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import Case, DecimalField, ExpressionWrapper, F, IntegerField, Sum, Value, When, Window
+from django.utils import timezone
+
+from reports.cache import invalidate_shops
+
+from .ledger import record_movements
+from .lookup import invalidate_lookups
+from .models import Product, ProductBatch, StockMovement
+from .stock import normalize_quantities, quantity_case
+
+FEFO_ORDER = [F('expiry_date').asc(nulls_last=True), F('id').asc()]
+
+
+def allocate_fefo(quantities):
+    """Take {product_id: quantity} out of the products' batches, earliest expiry first.
+
+    Returns [(batch_id, product_id, quantity taken)]. Quantities beyond the
+    batch totals come from unbatched stock and are not listed.
+    """
+    quantities = normalize_quantities(quantities)
+    if not quantities:
+        return []
+
+    candidates = (
+        ProductBatch.objects.filter(product_id__in=list(quantities), quantity__gt=0)
+        .annotate(
+            running_total=Window(Sum('quantity'), partition_by=[F('product_id')], order_by=FEFO_ORDER),
+            wanted=quantity_case(quantities, field='product_id'),
+        )
+        .annotate(taken_before=F('running_total') - F('quantity'))
+        # Batches the need runs out before are never read back
+        .filter(taken_before__lt=F('wanted'))
+        .values_list('id', 'product_id', 'quantity', 'taken_before', 'wanted')
+    )
+    allocations = [
+        (batch_id, product_id, min(quantity, wanted - taken_before))
+        for batch_id, product_id, quantity, taken_before, wanted in candidates
+    ]
+    if allocations:
+        ProductBatch.objects.filter(id__in=[batch_id for batch_id, _, _ in allocations]).update(
+            quantity=F('quantity') - Case(
+                *[When(id=batch_id, then=Value(taken)) for batch_id, _, taken in allocations],
+                default=Value(0),
+                output_field=IntegerField(),
+            )
+        )
+    return allocations
+
+
+def trim_batches(products):
+    """Draw down batches FEFO wherever their total exceeds the product's stock.
+
+    Used after stock is set directly (stock takes, edits, bulk updates) so the
+    batches never claim more units than the product has.
+    """
+    excess = dict(
+        products.annotate(batch_total=Sum('batches__quantity'))
+        .filter(batch_total__gt=F('stock_quantity'))
+        .annotate(excess=F('batch_total') - F('stock_quantity'))
+        .values_list('id', 'excess')
+    )
+    return allocate_fefo(excess)
+
+
+def receive_batch(product, batch_number, quantity, expiry_date=None, cost_price=None, reference=''):
+    """Add a received lot to stock; a batch number already on the product is topped up"""
+    if quantity <= 0:
+        raise ValueError("Quantity must be positive")
+    with transaction.atomic():
+        # Stock first: the row lock orders this receipt with concurrent sales
+        Product.objects.filter(pk=product.pk).update(
+            stock_quantity=F('stock_quantity') + quantity, updated_at=timezone.now()
+        )
+        batch, created = ProductBatch.objects.get_or_create(
+            product=product,
+            batch_number=batch_number,
+            defaults={'expiry_date': expiry_date, 'quantity': quantity, 'cost_price': cost_price or 0},
+        )
+        if not created:
+            ProductBatch.objects.filter(pk=batch.pk).update(quantity=F('quantity') + quantity)
+            batch.refresh_from_db(fields=['quantity'])
+        record_movements([(product.pk, quantity, reference or f'Batch {batch_number}')], StockMovement.RECEIPT)
+        invalidate_shops(product.shop_id)
+        invalidate_lookups(product.shop_id)
+    return batch
+
+
+def expiring_batches(products, within_days=30, include_expired=False, today=None):
+    """Batches with stock left that expire within ``within_days``, soonest first.
+
+    Filters on the partial expiry index as one range; ``include_expired`` opens
+    the lower bound to batches already past their date.
+    """
+    today = today or timezone.localdate()
+    batches = ProductBatch.objects.filter(
+        product__in=products, quantity__gt=0, expiry_date__lte=today + timedelta(days=within_days)
+    )
+    if not include_expired:
+        batches = batches.filter(expiry_date__gte=today)
+    return batches.annotate(
+        cost_value=ExpressionWrapper(F('quantity') * F('cost_price'), output_field=DecimalField(max_digits=14, decimal_places=2)),
+    ).order_by('expiry_date', 'product__name')
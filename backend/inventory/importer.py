@@ -0,0 +1,121 @@
+"""Bulk product import from CSV.
+
+Rows are read as a stream and handled a chunk at a time: each row is checked
+with the ProductSerializer field rules, then the chunk resolves its SKU
+clashes and categories with one query each, takes generated SKUs from the
+shop's sequence in one block and is inserted with ``bulk_create``, its opening
+stock ledgered with one more bulk insert. Invalid
+rows are skipped and reported with their line number.
+"""
+from django.db import transaction
+from rest_framework.exceptions import ValidationError
+
+from reports.cache import invalidate_shops
+
+from .ledger import record_movements
+from .lookup import invalidate_lookups
+from .models import Category, Product, StockMovement
+from .sequences import allocate_skus
+from .serializers import ProductImportSerializer
+
+IMPORT_CHUNK_SIZE = 1000
+# Row errors returned in full; the rest are only counted
+MAX_REPORTED_ERRORS = 1000
+
+
+def _read_rows(reader, chunk_size):
+    """Group csv.DictReader rows into chunks of (line number, cleaned dict)"""
+    chunk = []
+    for row in reader:
+        data = {
+            (key or '').strip().lower(): value.strip()
+            for key, value in row.items()
+            if key and isinstance(value, str) and value.strip()
+        }
+        if not data:
+            continue
+        chunk.append((reader.line_num, data))
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def import_products(shop, reader, created_by, dry_run=False, chunk_size=IMPORT_CHUNK_SIZE):
+    """Import products for a shop from a csv.DictReader.
+
+    With ``dry_run`` every row is validated and the report is built, but
+    nothing is written and no SKUs are allocated. Returns the report.
+    """
+    report = {'dry_run': dry_run, 'rows': 0, 'created': 0, 'categories_created': 0, 'error_count': 0, 'errors': []}
+    categories = {}
+    seen_skus = set()
+
+    def reject(line_number, errors):
+        report['error_count'] += 1
+        if len(report['errors']) < MAX_REPORTED_ERRORS:
+            report['errors'].append({'line': line_number, 'errors': errors})
+
+    # One serializer validates every row, so its fields are built only once
+    validator = ProductImportSerializer()
+
+    with transaction.atomic():
+        for chunk in _read_rows(reader, chunk_size):
+            report['rows'] += len(chunk)
+            valid = []
+            for line_number, data in chunk:
+                try:
+                    valid.append((line_number, validator.run_validation(data)))
+                except ValidationError as e:
+                    reject(line_number, e.detail)
+
+            # SKUs clashing with the shop's products or earlier rows: one query per chunk
+            given = [data['sku'] for _, data in valid if data.get('sku')]
+            existing = set(Product.objects.filter(shop=shop, sku__in=given).values_list('sku', flat=True))
+            accepted = []
+            for line_number, data in valid:
+                sku = data.get('sku')
+                if sku and (sku in existing or sku in seen_skus):
+                    reject(line_number, {'sku': ['A product with this SKU already exists.']})
+                    continue
+                if sku:
+                    seen_skus.add(sku)
+                accepted.append(data)
+
+            # Categories by name: one query for the names not seen in earlier chunks
+            names = {data['category'] for data in accepted if data.get('category')} - set(categories)
+            if names:
+                categories.update(
+                    (category.name, category) for category in Category.objects.filter(shop=shop, name__in=names)
+                )
+                missing = [Category(name=name, shop=shop) for name in sorted(names - set(categories))]
+                if missing and not dry_run:
+                    Category.objects.bulk_create(missing)
+                categories.update((category.name, category) for category in missing)
+                report['categories_created'] += len(missing)
+
+            products = [
+                Product(
+                    shop=shop,
+                    created_by=created_by,
+                    category=categories.get(data.pop('category', '') or None),
+                    **data,
+                )
+                for data in accepted
+            ]
+            if not dry_run:
+                unnamed = [product for product in products if not product.sku]
+                for product, sku in zip(unnamed, allocate_skus(shop.pk, len(unnamed))):
+                    product.sku = sku
+                Product.objects.bulk_create(products)
+                record_movements(
+                    ((product.pk, product.stock_quantity, 'CSV import') for product in products), StockMovement.IMPORT
+                )
+            report['created'] += len(products)
+
+        if report['created'] and not dry_run:
+            # bulk_create sends no post_save signals
+            invalidate_shops(shop.pk)
+            invalidate_lookups(shop.pk)
+    return report
@@ -0,0 +1,113 @@
+"""Stock movement ledger and point-in-time stock.
+
+Every change to ``Product.stock_quantity`` is appended to StockMovement with
+bulk inserts. StockSnapshot rows checkpoint each product's level, so the stock
+at a moment is the nearest earlier snapshot plus the movements after it,
+computed for any number of products with correlated subqueries over the
+(product, created_at) and (product, taken_at) indexes. The net change per
+product is passed on to the low-stock alerts and the live event stream as it
+is recorded.
+"""
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.db import transaction
+from django.db.models import F, IntegerField, OuterRef, Q, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .models import Product, StockMovement, StockSnapshot
+
+LEDGER_BATCH_SIZE = 1000
+# Movements stamped before a commit can become visible after it; snapshots stay
+# this far behind the clock so none is missed
+SNAPSHOT_LAG = timedelta(minutes=5)
+_BEGINNING = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+
+
+def record_movements(rows, reason):
+    """Bulk-insert movements from (product_id, signed quantity, reference) rows; zero rows are skipped.
+
+    Call it after the stock change, in the same transaction, so the alerts
+    compare the new stock with the stock before it.
+    """
+    now = timezone.now()
+    batch = []
+    net = defaultdict(int)
+    for product_id, quantity, reference in rows:
+        if quantity:
+            net[product_id] += quantity
+            batch.append(StockMovement(
+                product_id=product_id, quantity=quantity, reason=reason, reference=reference[:100], created_at=now
+            ))
+        if len(batch) >= LEDGER_BATCH_SIZE:
+            StockMovement.objects.bulk_create(batch)
+            batch = []
+    StockMovement.objects.bulk_create(batch)
+    from users.notifications import notify_stock_levels
+    notify_stock_levels(net)
+    from events.broker import publish_stock_changes
+    publish_stock_changes(net)
+
+
+def with_stock_at(products, at):
+    """Annotate a Product queryset with ``stock_at``: the stock level at the given moment"""
+    snapshots = StockSnapshot.objects.filter(product=OuterRef('pk'), taken_at__lte=at).order_by('-taken_at')
+    products = products.annotate(
+        snapshot_at=Subquery(snapshots.values('taken_at')[:1]),
+        snapshot_quantity=Coalesce(Subquery(snapshots.values('quantity')[:1]), Value(0)),
+    )
+    moved = (
+        StockMovement.objects.filter(
+            product=OuterRef('pk'),
+            created_at__lte=at,
+            created_at__gt=Coalesce(OuterRef('snapshot_at'), Value(_BEGINNING)),
+        )
+        .values('product')
+        .annotate(total=Sum('quantity'))
+        .values('total')
+    )
+    return products.annotate(
+        stock_at=F('snapshot_quantity') + Coalesce(Subquery(moved, output_field=IntegerField()), Value(0))
+    )
+
+
+def stock_at(product_ids, at):
+    """Return {product_id: stock level at ``at``}"""
+    return dict(with_stock_at(Product.objects.filter(id__in=product_ids), at).values_list('id', 'stock_at'))
+
+
+def take_snapshots(at=None, products=None):
+    """Checkpoint products whose stock moved since their last snapshot.
+
+    ``at`` defaults to SNAPSHOT_LAG ago. Returns the number of snapshots written.
+    """
+    at = at or timezone.now() - SNAPSHOT_LAG
+    products = Product.objects.all() if products is None else products
+    last_snapshot = StockSnapshot.objects.filter(product=OuterRef('pk'), taken_at__lte=at).order_by('-taken_at')
+    moved = products.annotate(last_snapshot_at=Subquery(last_snapshot.values('taken_at')[:1])).filter(
+        Q(last_snapshot_at__isnull=True)
+        | Q(stock_movements__created_at__gt=F('last_snapshot_at'), stock_movements__created_at__lte=at)
+    ).values('pk').distinct()
+
+    written = 0
+    with transaction.atomic():
+        rows = with_stock_at(Product.objects.filter(pk__in=moved), at).values_list('id', 'stock_at')
+        batch = []
+        for product_id, quantity in rows.iterator(chunk_size=LEDGER_BATCH_SIZE):
+            batch.append(StockSnapshot(product_id=product_id, taken_at=at, quantity=quantity))
+            if len(batch) >= LEDGER_BATCH_SIZE:
+                written += len(StockSnapshot.objects.bulk_create(batch, ignore_conflicts=True))
+                batch = []
+        written += len(StockSnapshot.objects.bulk_create(batch, ignore_conflicts=True))
+    return written
+
+
+def discrepancies(products=None):
+    """Products whose stock_quantity disagrees with the ledger, as (id, sku, stock_quantity, ledger)"""
+    products = Product.objects.all() if products is None else products
+    return (
+        with_stock_at(products, timezone.now())
+        .exclude(stock_at=F('stock_quantity'))
+        .values_list('id', 'sku', 'stock_quantity', 'stock_at')
+    )
@@ -0,0 +1,170 @@
+"""Stock held across a shop's locations.
+
+``Product.stock_quantity`` stays the total over all locations, so list filters
+such as ``stock_status=low_stock`` remain single-table. LocationStock rows hold
+the units at non-default locations and ``Product.located_quantity`` is their
+sum; the default location (the counter) holds the remainder. Every path that
+changes stock without naming a location therefore works on the default
+location, and ``stock_quantity >= located_quantity`` is enforced by a check
+constraint.
+
+Transfers are applied in bulk: quantities are netted per (product,
+location), then one guarded UPDATE moves ``located_quantity`` on the products
+and one guarded UPDATE per direction moves the LocationStock rows. A shortfall
+anywhere rolls the whole batch back.
+"""
+from collections import defaultdict
+
+from django.db import IntegrityError, transaction
+from django.db.models import Case, F, IntegerField, Q, Value, When
+
+from .models import LocationStock, Product, StockLocation, StockTransfer
+from .stock import _guarded_update, _Shortfall, quantity_case
+
+DEFAULT_LOCATION_NAME = 'Main'
+
+
+class TransferError(ValueError):
+    """Raised when a transfer batch cannot be applied; ``shortfalls`` lists the short sources"""
+
+    def __init__(self, shortfalls):
+        self.shortfalls = shortfalls
+        super().__init__("Insufficient stock at the source location" if shortfalls else "Stock moved, please retry")
+
+
+def default_location(shop_id):
+    """Return the shop's default location, creating it on first use"""
+    location = StockLocation.objects.filter(shop_id=shop_id, is_default=True).first()
+    if location is not None:
+        return location
+    try:
+        with transaction.atomic():
+            return StockLocation.objects.create(shop_id=shop_id, name=DEFAULT_LOCATION_NAME, is_default=True)
+    except IntegrityError:
+        # Created concurrently, or a non-default location already uses the name
+        location = StockLocation.objects.filter(shop_id=shop_id, is_default=True).first()
+        if location is None:
+            raise
+        return location
+
+
+def stored_location_id(location):
+    """LocationStock location id for a location; None for the default location"""
+    if location is None or location.is_default:
+        return None
+    return location.pk
+
+
+def _pair_case(deltas):
+    return Case(
+        *[When(product_id=product_id, location_id=location_id, then=Value(delta))
+          for (product_id, location_id), delta in deltas.items()],
+        default=Value(0),
+        output_field=IntegerField(),
+    )
+
+
+def take_from_location(required, location_id):
+    """Guarded decrement of {product_id: quantity} at a non-default location; raises _Shortfall"""
+    guard = Q()
+    for product_id, qty in required.items():
+        guard |= Q(product_id=product_id, quantity__gte=qty)
+    with transaction.atomic():
+        updated = LocationStock.objects.filter(guard, location_id=location_id).update(
+            quantity=F('quantity') - quantity_case(required, field='product_id')
+        )
+        if updated != len(required):
+            raise _Shortfall()
+
+
+def location_available(product_ids, location_id):
+    """Return {product_id: units at the location}"""
+    if location_id is None:
+        return {
+            product_id: stock - located for product_id, stock, located in
+            Product.objects.filter(id__in=list(product_ids)).values_list('id', 'stock_quantity', 'located_quantity')
+        }
+    return dict(
+        LocationStock.objects.filter(location_id=location_id, product_id__in=list(product_ids))
+        .values_list('product_id', 'quantity')
+    )
+
+
+def _transfer_shortfalls(outflows):
+    """List (product, location) sources that cannot cover their net outflow"""
+    by_location = defaultdict(dict)
+    for (product_id, location_id), qty in outflows.items():
+        by_location[location_id][product_id] = qty
+    shortfalls = []
+    for location_id, required in by_location.items():
+        available = location_available(required, location_id)
+        for product_id, qty in required.items():
+            if available.get(product_id, 0) < qty:
+                shortfalls.append({
+                    'product_id': product_id, 'location_id': location_id,
+                    'required': qty, 'available': available.get(product_id, 0),
+                })
+    return shortfalls
+
+
+def transfer_stock(shop_id, transfers, created_by, reference=''):
+    """Move stock between a shop's locations, all or nothing.
+
+    ``transfers`` are dicts with product_id, from_location, to_location
+    (StockLocation instances of the shop) and a positive quantity. Raises
+    TransferError listing the sources that are short. Returns the
+    StockTransfer records.
+    """
+    # Net change per (product, stored location id); None is the default location
+    net = defaultdict(int)
+    records = []
+    for transfer in transfers:
+        product_id, qty = transfer['product_id'], transfer['quantity']
+        source, target = transfer['from_location'], transfer['to_location']
+        net[product_id, stored_location_id(source)] -= qty
+        net[product_id, stored_location_id(target)] += qty
+        records.append(StockTransfer(
+            shop_id=shop_id, product_id=product_id, from_location=source, to_location=target,
+            quantity=qty, reference=reference, created_by=created_by,
+        ))
+
+    located = defaultdict(int)
+    decreases, increases = {}, {}
+    for (product_id, location_id), delta in net.items():
+        if location_id is None or not delta:
+            continue
+        located[product_id] += delta
+        (increases if delta > 0 else decreases)[product_id, location_id] = delta
+    located = {product_id: delta for product_id, delta in located.items() if delta}
+    outflows = {pair: -delta for pair, delta in net.items() if delta < 0}
+
+    try:
+        with transaction.atomic():
+            if located:
+                # The default location keeps stock_quantity - located_quantity >= 0
+                guard = Q()
+                for product_id, delta in located.items():
+                    guard |= Q(id=product_id, stock_quantity__gte=F('located_quantity') + delta)
+                _guarded_update(
+                    guard, len(located), located_quantity=F('located_quantity') + quantity_case(located)
+                )
+            if decreases:
+                guard = Q()
+                for (product_id, location_id), delta in decreases.items():
+                    guard |= Q(product_id=product_id, location_id=location_id, quantity__gte=-delta)
+                updated = LocationStock.objects.filter(guard).update(quantity=F('quantity') + _pair_case(decreases))
+                if updated != len(decreases):
+                    raise _Shortfall()
+            if increases:
+                LocationStock.objects.bulk_create(
+                    [LocationStock(product_id=product_id, location_id=location_id) for product_id, location_id in increases],
+                    ignore_conflicts=True,
+                )
+                pairs = Q()
+                for product_id, location_id in increases:
+                    pairs |= Q(product_id=product_id, location_id=location_id)
+                LocationStock.objects.filter(pairs).update(quantity=F('quantity') + _pair_case(increases))
+            StockTransfer.objects.bulk_create(records)
+    except _Shortfall:
+        raise TransferError(_transfer_shortfalls(outflows))
+    return records
@@ -0,0 +1,134 @@
+"""Per-worker cache of products by (shop, SKU) for counter scanning.
+
+Each worker keeps an LRU of compact product records tagged with the shop's
+lookup version, a token stored in the shared cache. Saving a product or
+changing stock replaces the shop's token after commit, so stale records in
+every worker stop matching without being tracked individually. The token is
+re-read from the shared cache at most every ``PRODUCT_LOOKUP_VERSION_TTL``
+seconds, which keeps cache hits free of network round trips.
+
+The tokens only reach every worker through a shared cache; on a process-local
+backend with several workers (see ``reports.cache.cache_is_shared``) every
+lookup goes to the database instead.
+"""
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from decimal import Decimal, ROUND_HALF_UP
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from reports.cache import cache_is_shared
+
+from .models import Product
+
+LOOKUP_FIELDS = ('id', 'sku', 'name', 'price', 'gst_rate', 'stock_quantity', 'threshold', 'category_id')
+
+_MISSING = object()
+
+
+class _LRU:
+    """Thread-safe least-recently-used mapping"""
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._data.get(key, _MISSING)
+            if value is not _MISSING:
+                self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+_records = _LRU(getattr(settings, 'PRODUCT_LOOKUP_CACHE_SIZE', 10000))
+# shop_id -> (version, monotonic time it was read)
+_versions = {}
+
+
+def _version_key(shop_id):
+    return f'inventory:lookup:version:{shop_id}'
+
+
+def _shop_version(shop_id):
+    now = time.monotonic()
+    known = _versions.get(shop_id)
+    if known is not None and now - known[1] < getattr(settings, 'PRODUCT_LOOKUP_VERSION_TTL', 1.0):
+        return known[0]
+
+    key = _version_key(shop_id)
+    version = cache.get(key)
+    if version is None:
+        version = uuid.uuid4().hex[:12]
+        if not cache.add(key, version, timeout=None):
+            version = cache.get(key, version)
+    _versions[shop_id] = (version, now)
+    return version
+
+
+def _bump(shop_ids):
+    cache.set_many({_version_key(shop_id): uuid.uuid4().hex[:12] for shop_id in shop_ids}, timeout=None)
+    for shop_id in shop_ids:
+        _versions.pop(shop_id, None)
+
+
+def invalidate_lookups(*shop_ids):
+    """Drop cached lookups for the given shops once the current transaction commits"""
+    shop_ids = {shop_id for shop_id in shop_ids if shop_id is not None}
+    if shop_ids:
+        transaction.on_commit(lambda: _bump(shop_ids))
+
+
+def _compact(row):
+    price, gst_rate = row['price'], row['gst_rate']
+    return dict(
+        row,
+        price_with_gst=(price * (1 + gst_rate / 100)).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
+        if gst_rate is not None else price,
+        is_low_stock=row['stock_quantity'] <= row['threshold'],
+    )
+
+
+def _fetch(shop_id, sku):
+    # Exact match served by the (sku, shop) unique index
+    row = Product.objects.filter(shop_id=shop_id, sku=sku).values(*LOOKUP_FIELDS).first()
+    return _compact(row) if row else None
+
+
+def lookup_product(shop_id, sku):
+    """Return (compact product record or None, served from cache) for an exact SKU"""
+    if not cache_is_shared():
+        return _fetch(shop_id, sku), False
+
+    version = _shop_version(shop_id)
+    key = (shop_id, sku)
+    cached = _records.get(key)
+    if cached is not _MISSING and cached[0] == version:
+        return cached[1], True
+
+    record = _fetch(shop_id, sku)
+    # Unknown SKUs are cached too; creating the product bumps the version
+    _records.set(key, (version, record))
+    return record, False
+
+
+def clear_local_cache():
+    """Forget this worker's records and versions"""
+    _records.clear()
+    _versions.clear()
@@ -0,0 +1,47 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from inventory.ledger import discrepancies, take_snapshots
+from inventory.models import Product
+
+
+class Command(BaseCommand):
+    help = 'Snapshot the stock of products that moved since their last snapshot, keeping history replays short'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--at', help='Snapshot time (ISO 8601); defaults to a few minutes ago')
+        parser.add_argument('--shop', type=int, help='Only products of this shop (user id)')
+        parser.add_argument('--check', action='store_true', help='Report products whose stock disagrees with the ledger')
+
+    def handle(self, *args, **options):
+        products = Product.objects.all()
+        if options['shop']:
+            products = products.filter(shop_id=options['shop'])
+
+        at = None
+        if options['at']:
+            at = parse_datetime(options['at'])
+            if at is None:
+                raise CommandError('--at must be an ISO 8601 datetime')
+            if timezone.is_naive(at):
+                at = timezone.make_aware(at)
+            if at > timezone.now():
+                raise CommandError('--at cannot be in the future')
+
+        started = time.perf_counter()
+        written = take_snapshots(at=at, products=products)
+        self.stdout.write(self.style.SUCCESS(
+            f'Wrote {written} snapshots in {time.perf_counter() - started:.1f}s'
+        ))
+
+        if options['check']:
+            mismatched = 0
+            for product_id, sku, stock, ledger in discrepancies(products).iterator():
+                mismatched += 1
+                self.stderr.write(f'{sku} (#{product_id}): stock {stock}, ledger {ledger}')
+            if mismatched:
+                raise CommandError(f'{mismatched} products disagree with the ledger')
+            self.stdout.write(self.style.SUCCESS('Stock matches the ledger'))
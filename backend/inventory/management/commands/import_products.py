@@ -0,0 +1,42 @@
+import csv
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from inventory.importer import IMPORT_CHUNK_SIZE, import_products
+from users.models import User
+
+
+class Command(BaseCommand):
+    help = 'Bulk import products for a shop from a CSV file'
+
+    def add_arguments(self, parser):
+        parser.add_argument('csv_file', help='CSV with name, sku, description, price, stock_quantity, threshold, gst_rate, category columns')
+        parser.add_argument('--shop', type=int, required=True, help='Shop (user id) to import into')
+        parser.add_argument('--dry-run', action='store_true', help='Validate and report without writing')
+        parser.add_argument('--chunk-size', type=int, default=IMPORT_CHUNK_SIZE, help='Rows validated and inserted per chunk')
+
+    def handle(self, *args, **options):
+        shop = User.objects.filter(pk=options['shop']).first()
+        if shop is None:
+            raise CommandError(f"Shop {options['shop']} not found")
+
+        started = time.perf_counter()
+        try:
+            with open(options['csv_file'], newline='', encoding='utf-8-sig') as source:
+                report = import_products(
+                    shop, csv.DictReader(source), shop, dry_run=options['dry_run'], chunk_size=options['chunk_size']
+                )
+        except OSError as e:
+            raise CommandError(f'Cannot read {options["csv_file"]}: {e}')
+        except (UnicodeDecodeError, csv.Error) as e:
+            raise CommandError(f'Cannot read CSV: {e}')
+
+        for error in report['errors']:
+            self.stderr.write(f"Line {error['line']}: {error['errors']}")
+        verb = 'Would import' if options['dry_run'] else 'Imported'
+        self.stdout.write(self.style.SUCCESS(
+            f"{verb} {report['created']} of {report['rows']} rows "
+            f"({report['categories_created']} new categories, {report['error_count']} errors) "
+            f"in {time.perf_counter() - started:.1f}s"
+        ))
@@ -0,0 +1,86 @@
+from django.db import migrations
+
+# The statements are frozen here rather than imported from inventory.search, so
+# later changes to that module cannot change what this migration did.
+FTS_TABLE = 'inventory_product_fts'
+
+POSTGRES_SETUP = [
+    'CREATE EXTENSION IF NOT EXISTS pg_trgm',
+    """
+    ALTER TABLE inventory_product ADD COLUMN IF NOT EXISTS search_vector tsvector
+    GENERATED ALWAYS AS (
+        setweight(to_tsvector('simple', coalesce(sku, '')), 'A') ||
+        setweight(to_tsvector('simple', coalesce(name, '')), 'A') ||
+        setweight(to_tsvector('simple', coalesce(description, '')), 'C')
+    ) STORED
+    """,
+    'CREATE INDEX IF NOT EXISTS inventory_product_search_vector ON inventory_product USING gin (search_vector)',
+    'CREATE INDEX IF NOT EXISTS inventory_product_name_trgm ON inventory_product USING gin (name gin_trgm_ops)',
+    'CREATE INDEX IF NOT EXISTS inventory_product_sku_trgm ON inventory_product USING gin (sku gin_trgm_ops)',
+]
+
+POSTGRES_TEARDOWN = [
+    'DROP INDEX IF EXISTS inventory_product_sku_trgm',
+    'DROP INDEX IF EXISTS inventory_product_name_trgm',
+    'DROP INDEX IF EXISTS inventory_product_search_vector',
+    'ALTER TABLE inventory_product DROP COLUMN IF EXISTS search_vector',
+]
+
+SQLITE_SETUP = [
+    f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+    "name, sku, description, content='inventory_product', content_rowid='id', "
+    "tokenize='unicode61 remove_diacritics 2', prefix='2 3')",
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ai AFTER INSERT ON inventory_product BEGIN
+        INSERT INTO {FTS_TABLE}(rowid, name, sku, description)
+        VALUES (new.id, new.name, new.sku, new.description);
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ad AFTER DELETE ON inventory_product BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, name, sku, description)
+        VALUES ('delete', old.id, old.name, old.sku, old.description);
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_au AFTER UPDATE OF name, sku, description ON inventory_product BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, name, sku, description)
+        VALUES ('delete', old.id, old.name, old.sku, old.description);
+        INSERT INTO {FTS_TABLE}(rowid, name, sku, description)
+        VALUES (new.id, new.name, new.sku, new.description);
+    END
+    """,
+    f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')",
+]
+
+SQLITE_TEARDOWN = [
+    f'DROP TRIGGER IF EXISTS {FTS_TABLE}_ai',
+    f'DROP TRIGGER IF EXISTS {FTS_TABLE}_ad',
+    f'DROP TRIGGER IF EXISTS {FTS_TABLE}_au',
+    f'DROP TABLE IF EXISTS {FTS_TABLE}',
+]
+
+
+def _run(schema_editor, statements):
+    for statement in statements.get(schema_editor.connection.vendor, []):
+        schema_editor.execute(statement, params=None)
+
+
+def install(apps, schema_editor):
+    _run(schema_editor, {'postgresql': POSTGRES_SETUP, 'sqlite': SQLITE_SETUP})
+
+
+def remove(apps, schema_editor):
+    _run(schema_editor, {'postgresql': POSTGRES_TEARDOWN, 'sqlite': SQLITE_TEARDOWN})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0004_product_stock_quantity_non_negative'),
+    ]
+
+    operations = [
+        # tsvector/GIN + pg_trgm on PostgreSQL, FTS5 with triggers on SQLite
+        migrations.RunPython(install, remove),
+    ]
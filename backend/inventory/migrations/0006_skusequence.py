@@ -0,0 +1,25 @@
+# Generated by Django 5.2.5 on 2026-10-17 01:03
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0005_product_search_index'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SkuSequence',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('next_value', models.PositiveIntegerField(default=1)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('shop', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='sku_sequence', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+    ]
@@ -0,0 +1,58 @@
+# Generated by Django 5.2.5 on 2026-10-17 01:08
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def seed_snapshots(apps, schema_editor):
+    """Stock that predates the ledger becomes each product's first snapshot"""
+    Product = apps.get_model('inventory', 'Product')
+    StockSnapshot = apps.get_model('inventory', 'StockSnapshot')
+    now = timezone.now()
+    batch = []
+    for product_id, quantity in Product.objects.values_list('id', 'stock_quantity').iterator(chunk_size=2000):
+        batch.append(StockSnapshot(product_id=product_id, taken_at=now, quantity=quantity))
+        if len(batch) >= 2000:
+            StockSnapshot.objects.bulk_create(batch)
+            batch = []
+    StockSnapshot.objects.bulk_create(batch)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0007_stocktake'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StockMovement',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('quantity', models.IntegerField(help_text='Signed change in stock')),
+                ('reason', models.CharField(choices=[('sale', 'Sale'), ('adjustment', 'Manual adjustment'), ('stock_take', 'Stock take'), ('import', 'Import'), ('opening', 'Opening stock'), ('bulk_update', 'Bulk update')], max_length=20)),
+                ('reference', models.CharField(blank=True, max_length=100)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='stock_movements', to='inventory.product')),
+            ],
+            options={
+                'ordering': ['-created_at', '-id'],
+                'indexes': [models.Index(fields=['product', 'created_at'], name='inventory_s_product_5919a9_idx')],
+            },
+        ),
+        migrations.CreateModel(
+            name='StockSnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('taken_at', models.DateTimeField()),
+                ('quantity', models.IntegerField()),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='stock_snapshots', to='inventory.product')),
+            ],
+            options={
+                'unique_together': {('product', 'taken_at')},
+            },
+        ),
+        migrations.RunPython(seed_snapshots, migrations.RunPython.noop),
+    ]
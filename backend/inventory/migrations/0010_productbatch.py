@@ -0,0 +1,37 @@
+# Generated by Django 5.2.5 on 2026-10-17 01:15
+
+import django.db.models.deletion
+from decimal import Decimal
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0009_product_reserved_quantity'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='stockmovement',
+            name='reason',
+            field=models.CharField(choices=[('sale', 'Sale'), ('adjustment', 'Manual adjustment'), ('stock_take', 'Stock take'), ('import', 'Import'), ('opening', 'Opening stock'), ('bulk_update', 'Bulk update'), ('receipt', 'Batch received')], max_length=20),
+        ),
+        migrations.CreateModel(
+            name='ProductBatch',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('batch_number', models.CharField(max_length=50)),
+                ('expiry_date', models.DateField(blank=True, null=True)),
+                ('quantity', models.PositiveIntegerField(default=0, help_text='Units left in this batch')),
+                ('cost_price', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=10)),
+                ('received_at', models.DateTimeField(auto_now_add=True)),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='batches', to='inventory.product')),
+            ],
+            options={
+                'ordering': [models.OrderBy(models.F('expiry_date'), nulls_last=True), 'id'],
+                'indexes': [models.Index(fields=['product', 'expiry_date'], name='inventory_p_product_fa42ce_idx'), models.Index(condition=models.Q(('quantity__gt', 0)), fields=['expiry_date'], name='inventory_batch_expiry_live')],
+                'unique_together': {('product', 'batch_number')},
+            },
+        ),
+    ]
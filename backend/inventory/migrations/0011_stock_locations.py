@@ -0,0 +1,117 @@
+# Generated by Django 5.2.5 on 2026-10-17 01:18
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0010_productbatch'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LocationStock',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('quantity', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='StockLocation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100)),
+                ('is_default', models.BooleanField(default=False, help_text='Where sales and receipts go unless told otherwise')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'ordering': ['-is_default', 'name'],
+            },
+        ),
+        migrations.CreateModel(
+            name='StockTransfer',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('quantity', models.PositiveIntegerField()),
+                ('reference', models.CharField(blank=True, max_length=100)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'ordering': ['-created_at', '-id'],
+            },
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='located_quantity',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddConstraint(
+            model_name='product',
+            constraint=models.CheckConstraint(condition=models.Q(('stock_quantity__gte', models.F('located_quantity'))), name='product_stock_covers_located'),
+        ),
+        migrations.AddField(
+            model_name='locationstock',
+            name='product',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='location_stock', to='inventory.product'),
+        ),
+        migrations.AddField(
+            model_name='stocklocation',
+            name='shop',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='stock_locations', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddField(
+            model_name='locationstock',
+            name='location',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='stock', to='inventory.stocklocation'),
+        ),
+        migrations.AddField(
+            model_name='stocktake',
+            name='location',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='stock_takes', to='inventory.stocklocation'),
+        ),
+        migrations.AddField(
+            model_name='stocktransfer',
+            name='created_by',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='+', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddField(
+            model_name='stocktransfer',
+            name='from_location',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='transfers_out', to='inventory.stocklocation'),
+        ),
+        migrations.AddField(
+            model_name='stocktransfer',
+            name='product',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='transfers', to='inventory.product'),
+        ),
+        migrations.AddField(
+            model_name='stocktransfer',
+            name='shop',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='stock_transfers', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddField(
+            model_name='stocktransfer',
+            name='to_location',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='transfers_in', to='inventory.stocklocation'),
+        ),
+        migrations.AddConstraint(
+            model_name='stocklocation',
+            constraint=models.UniqueConstraint(condition=models.Q(('is_default', True)), fields=('shop',), name='one_default_location_per_shop'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='stocklocation',
+            unique_together={('shop', 'name')},
+        ),
+        migrations.AddIndex(
+            model_name='locationstock',
+            index=models.Index(fields=['location', 'product'], name='inventory_l_locatio_3a5814_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='locationstock',
+            unique_together={('product', 'location')},
+        ),
+    ]
@@ -1,5 +1,6 @@
-from django.db import models
+from django.db import models, transaction
 from django.contrib.auth import get_user_model
+from django.utils import timezone
 from decimal import Decimal
 
 User = get_user_model()
@@ -30,6 +31,10 @@ class Product(models.Model):
     description = models.TextField(blank=True)
     price = models.DecimalField(max_digits=10, decimal_places=2)
     stock_quantity = models.PositiveIntegerField(default=0)
+    # Held by open draft invoices; only changed by the guarded UPDATEs in inventory.stock
+    reserved_quantity = models.PositiveIntegerField(default=0, editable=False)
+    # Units held at the shop's non-default locations; the rest is at the default one
+    located_quantity = models.PositiveIntegerField(default=0, editable=False)
     threshold = models.PositiveIntegerField(default=10, help_text="Minimum stock level")
     category = models.ForeignKey(Category, on_delete=models.PROTECT, null=True, blank=True, related_name='products')
     image = models.ImageField(upload_to='products/', blank=True, null=True)
@@ -42,6 +47,14 @@ class Product(models.Model):
     class Meta:
         ordering = ['-created_at']
         unique_together = ['sku', 'shop']  # Same SKU can exist in different shops
+        constraints = [
+            # Last line of defence behind the guarded stock UPDATEs in inventory.stock
+            models.CheckConstraint(condition=models.Q(stock_quantity__gte=0), name='product_stock_quantity_non_negative'),
+            models.CheckConstraint(
+                condition=models.Q(stock_quantity__gte=models.F('located_quantity')),
+                name='product_stock_covers_located',
+            ),
+        ]
 
     def __str__(self):
         return f"{self.name} ({self.sku}) - {self.shop.shop_name}"
@@ -54,6 +67,11 @@ class Product(models.Model):
     def is_out_of_stock(self):
         return self.stock_quantity == 0
 
+    @property
+    def available_quantity(self):
+        """Stock not held by draft invoices"""
+        return max(self.stock_quantity - self.reserved_quantity, 0)
+
     @property
     def price_with_gst(self):
         """Calculate price including GST"""
@@ -74,15 +92,213 @@ class Product(models.Model):
         """Calculate total inventory value for this product"""
         return self.price * Decimal(str(self.stock_quantity))
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember the stored stock so save() can ledger direct edits
+        instance._loaded_stock = dict(zip(field_names, values)).get('stock_quantity')
+        return instance
+
     def save(self, *args, **kwargs):
         # Auto-generate SKU if not provided
         if not self.sku:
-            # Get the last product ID for this shop and generate SKU
-            last_product = Product.objects.filter(shop=self.shop).order_by('id').last()
-            if last_product:
-                next_id = last_product.id + 1
-            else:
-                next_id = 1
-            self.sku = f"PRD-{next_id:04d}"
-        
-        super().save(*args, **kwargs)
\ No newline at end of file
+            # Take the next free PRD-NNNN number from the shop's SKU sequence
+            from .sequences import allocate_skus
+            self.sku = allocate_skus(self.shop_id, 1)[0]
+
+        creating = self._state.adding
+        if not creating and kwargs.get('update_fields') is None:
+            # Never write back stale reservation or location counters
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in ('reserved_quantity', 'located_quantity')
+            ]
+        old_stock = 0 if creating else getattr(self, '_loaded_stock', None)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'stock_quantity' not in update_fields:
+            old_stock = None
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            if old_stock is not None and self.stock_quantity != old_stock:
+                from .ledger import record_movements
+                record_movements(
+                    [(self.pk, self.stock_quantity - old_stock, '')],
+                    StockMovement.OPENING if creating else StockMovement.ADJUSTMENT,
+                )
+                if self.stock_quantity < old_stock:
+                    from .batches import trim_batches
+                    trim_batches(Product.objects.filter(pk=self.pk))
+        if old_stock is not None:
+            self._loaded_stock = self.stock_quantity
+
+
+class SkuSequence(models.Model):
+    """Per-shop counter backing generated PRD-NNNN SKUs"""
+    shop = models.OneToOneField(User, on_delete=models.CASCADE, related_name='sku_sequence')
+    next_value = models.PositiveIntegerField(default=1)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.shop_id}: next {self.next_value}"
+
+class StockLocation(models.Model):
+    """A place a shop keeps stock, such as the counter or a back store.
+
+    Stock at the default location is not stored per product: it is whatever
+    part of ``Product.stock_quantity`` is not at another location.
+    """
+    shop = models.ForeignKey(User, on_delete=models.CASCADE, related_name='stock_locations')
+    name = models.CharField(max_length=100)
+    is_default = models.BooleanField(default=False, help_text="Where sales and receipts go unless told otherwise")
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['-is_default', 'name']
+        unique_together = ['shop', 'name']
+        constraints = [
+            models.UniqueConstraint(fields=['shop'], condition=models.Q(is_default=True), name='one_default_location_per_shop'),
+        ]
+
+    def __str__(self):
+        return f"{self.name} ({self.shop_id})"
+
+
+class LocationStock(models.Model):
+    """Units of a product at a non-default location"""
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='location_stock')
+    location = models.ForeignKey(StockLocation, on_delete=models.CASCADE, related_name='stock')
+    quantity = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        unique_together = ['product', 'location']
+        indexes = [models.Index(fields=['location', 'product'])]
+
+    def __str__(self):
+        return f"{self.product_id} @ {self.location_id}: {self.quantity}"
+
+
+class StockTransfer(models.Model):
+    """Units moved between two of a shop's locations"""
+    shop = models.ForeignKey(User, on_delete=models.CASCADE, related_name='stock_transfers')
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='transfers')
+    from_location = models.ForeignKey(StockLocation, on_delete=models.PROTECT, related_name='transfers_out')
+    to_location = models.ForeignKey(StockLocation, on_delete=models.PROTECT, related_name='transfers_in')
+    quantity = models.PositiveIntegerField()
+    reference = models.CharField(max_length=100, blank=True)
+    created_by = models.ForeignKey(User, on_delete=models.PROTECT, related_name='+')
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['-created_at', '-id']
+
+    def __str__(self):
+        return f"{self.quantity} x {self.product_id}: {self.from_location_id} -> {self.to_location_id}"
+
+
+class StockTake(models.Model):
+    """Physical stock count session; applying it sets stock to the counted quantities"""
+    STATUS_CHOICES = [
+        ('open', 'Open'),
+        ('applied', 'Applied'),
+        ('cancelled', 'Cancelled'),
+    ]
+
+    shop = models.ForeignKey(User, on_delete=models.CASCADE, related_name='stock_takes')
+    # Counts are for this location; none means the default location
+    location = models.ForeignKey(StockLocation, on_delete=models.PROTECT, null=True, blank=True, related_name='stock_takes')
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='open')
+    notes = models.TextField(blank=True)
+    created_by = models.ForeignKey(User, on_delete=models.PROTECT, related_name='created_stock_takes')
+    created_at = models.DateTimeField(auto_now_add=True)
+    applied_by = models.ForeignKey(User, on_delete=models.PROTECT, null=True, blank=True, related_name='applied_stock_takes')
+    applied_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['-created_at']
+
+    def __str__(self):
+        return f"Stock take {self.pk} ({self.status})"
+
+
+class StockTakeLine(models.Model):
+    """Counted quantity of one product; expected quantity and variance are recorded when applied"""
+    stock_take = models.ForeignKey(StockTake, on_delete=models.CASCADE, related_name='lines')
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='stock_take_lines')
+    counted_quantity = models.PositiveIntegerField()
+    expected_quantity = models.PositiveIntegerField(null=True, blank=True)
+    variance = models.IntegerField(null=True, blank=True)
+    counted_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ['stock_take', 'product']
+
+    def __str__(self):
+        return f"{self.product_id}: counted {self.counted_quantity}"
+
+
+class StockMovement(models.Model):
+    """Append-only record of a change to a product's stock_quantity"""
+    SALE = 'sale'
+    ADJUSTMENT = 'adjustment'
+    STOCK_TAKE = 'stock_take'
+    IMPORT = 'import'
+    OPENING = 'opening'
+    BULK_UPDATE = 'bulk_update'
+    RECEIPT = 'receipt'
+    REASON_CHOICES = [
+        (SALE, 'Sale'),
+        (ADJUSTMENT, 'Manual adjustment'),
+        (STOCK_TAKE, 'Stock take'),
+        (IMPORT, 'Import'),
+        (OPENING, 'Opening stock'),
+        (BULK_UPDATE, 'Bulk update'),
+        (RECEIPT, 'Batch received'),
+    ]
+
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='stock_movements')
+    quantity = models.IntegerField(help_text="Signed change in stock")
+    reason = models.CharField(max_length=20, choices=REASON_CHOICES)
+    reference = models.CharField(max_length=100, blank=True)
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        ordering = ['-created_at', '-id']
+        indexes = [models.Index(fields=['product', 'created_at'])]
+
+    def __str__(self):
+        return f"{self.product_id}: {self.quantity:+d} ({self.reason})"
+
+
+class StockSnapshot(models.Model):
+    """Stock level of a product as of taken_at, so history replays start here"""
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='stock_snapshots')
+    taken_at = models.DateTimeField()
+    quantity = models.IntegerField()
+
+    class Meta:
+        unique_together = ['product', 'taken_at']
+
+    def __str__(self):
+        return f"{self.product_id}@{self.taken_at:%Y-%m-%d %H:%M}: {self.quantity}"
+
+
+class ProductBatch(models.Model):
+    """A received lot of a product; sales draw from batches first-expiry-first-out"""
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='batches')
+    batch_number = models.CharField(max_length=50)
+    expiry_date = models.DateField(null=True, blank=True)
+    quantity = models.PositiveIntegerField(default=0, help_text="Units left in this batch")
+    cost_price = models.DecimalField(max_digits=10, decimal_places=2, default=Decimal('0.00'))
+    received_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = [models.F('expiry_date').asc(nulls_last=True), 'id']
+        unique_together = ['product', 'batch_number']
+        indexes = [
+            models.Index(fields=['product', 'expiry_date']),
+            # Expiring-soon report: range scan over batches that still hold stock
+            models.Index(fields=['expiry_date'], condition=models.Q(quantity__gt=0), name='inventory_batch_expiry_live'),
+        ]
+
+    def __str__(self):
+        return f"{self.product_id} batch {self.batch_number} ({self.quantity}, exp {self.expiry_date})"
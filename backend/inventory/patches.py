@@ -0,0 +1,91 @@
+"""Per-product bulk patches written with ``bulk_update``.
+
+A batch is validated row by row with the ProductSerializer rules, ownership
+of the products and of any referenced categories is checked with one query
+each, and the rows are written with ``bulk_update`` grouped by the set of
+patched fields, so columns a row did not patch are never written back.
+"""
+from collections import defaultdict
+
+from django.db import transaction
+from django.utils import timezone
+from rest_framework.exceptions import ValidationError
+
+from reports.cache import invalidate_shops
+
+from .lookup import invalidate_lookups
+from .models import Category, Product
+from .serializers import ProductPatchSerializer
+
+PATCHABLE_FIELDS = tuple(ProductPatchSerializer.Meta.fields)
+BULK_UPDATE_BATCH_SIZE = 500
+
+
+def apply_product_patches(user, patches, batch_size=BULK_UPDATE_BATCH_SIZE):
+    """Apply a list of {id, field: value} patches for a user.
+
+    Products outside the user's shop are reported as not found (admins may
+    patch any product). Returns one result per patch, in order.
+    """
+    results = [None] * len(patches)
+    pending = {}
+    for index, patch in enumerate(patches):
+        if not isinstance(patch, dict) or not isinstance(patch.get('id'), int):
+            results[index] = {'id': patch.get('id') if isinstance(patch, dict) else None,
+                              'status': 'error', 'errors': {'id': ['An integer product id is required.']}}
+            continue
+        unknown = sorted(set(patch) - {'id'} - set(PATCHABLE_FIELDS))
+        if unknown:
+            results[index] = {'id': patch['id'], 'status': 'error',
+                              'errors': {field: ['This field cannot be bulk updated.'] for field in unknown}}
+        elif len(patch) == 1:
+            results[index] = {'id': patch['id'], 'status': 'error', 'errors': {'non_field_errors': ['Nothing to update.']}}
+        elif patch['id'] in pending:
+            results[index] = {'id': patch['id'], 'status': 'error', 'errors': {'id': ['Duplicate product id in batch.']}}
+        else:
+            pending[patch['id']] = index
+
+    # Ownership of products and categories: one query each
+    products = Product.objects.all() if user.is_admin else Product.objects.filter(shop=user)
+    products = products.in_bulk(list(pending))
+    category_ids = {
+        patches[index]['category'] for index in pending.values()
+        if isinstance(patches[index].get('category'), int)
+    }
+    category_shops = dict(Category.objects.filter(id__in=category_ids).values_list('id', 'shop_id'))
+
+    validator = ProductPatchSerializer(partial=True)
+    groups = defaultdict(list)
+    now = timezone.now()
+    for product_id, index in pending.items():
+        product = products.get(product_id)
+        if product is None:
+            results[index] = {'id': product_id, 'status': 'error', 'errors': {'id': ['Product not found.']}}
+            continue
+        data = {field: value for field, value in patches[index].items() if field != 'id'}
+        try:
+            values = validator.run_validation(data)
+        except ValidationError as e:
+            results[index] = {'id': product_id, 'status': 'error', 'errors': e.detail}
+            continue
+        if 'category' in values:
+            category_id = values.pop('category')
+            if category_id is not None and category_shops.get(category_id) != product.shop_id:
+                results[index] = {'id': product_id, 'status': 'error', 'errors': {'category': ['Category not found.']}}
+                continue
+            values['category_id'] = category_id
+
+        for field, value in values.items():
+            setattr(product, field, value)
+        # bulk_update bypasses auto_now
+        product.updated_at = now
+        groups[tuple(sorted(values)) + ('updated_at',)].append(product)
+        results[index] = {'id': product_id, 'status': 'updated'}
+
+    with transaction.atomic():
+        for fields, group in groups.items():
+            Product.objects.bulk_update(group, fields, batch_size=batch_size)
+        shop_ids = {product.shop_id for group in groups.values() for product in group}
+        invalidate_shops(*shop_ids)
+        invalidate_lookups(*shop_ids)
+    return results
@@ -0,0 +1,152 @@
+"""Relevance-ranked product search for the ``search`` query param.
+
+PostgreSQL: a stored, generated ``search_vector`` tsvector column (SKU and name
+weighted above description) with a GIN index, plus pg_trgm indexes on name and
+SKU so misspelt names still match by similarity.
+
+SQLite: an external-content FTS5 table kept in step with ``inventory_product``
+by triggers. Django remakes SQLite tables for some schema changes, which drops
+triggers, so they are reinstalled (and the index rebuilt) after every migrate.
+
+Both are created by migration 0005 and are not part of the model state; the
+queries below reach them with raw SQL.
+
+Every search term is matched as a prefix, so partial words work for
+search-as-you-type. Other databases fall back to DRF's ``icontains`` search.
+"""
+import re
+
+from django.db import connection
+from django.db.models import BooleanField, FloatField, Q
+from django.db.models.expressions import RawSQL
+from rest_framework import filters
+
+FTS_TABLE = 'inventory_product_fts'
+RANK_ANNOTATION = 'search_rank'
+
+SQLITE_TRIGGERS = {
+    f'{FTS_TABLE}_ai': f"""
+        CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ai AFTER INSERT ON inventory_product BEGIN
+            INSERT INTO {FTS_TABLE}(rowid, name, sku, description)
+            VALUES (new.id, new.name, new.sku, new.description);
+        END
+    """,
+    f'{FTS_TABLE}_ad': f"""
+        CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ad AFTER DELETE ON inventory_product BEGIN
+            INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, name, sku, description)
+            VALUES ('delete', old.id, old.name, old.sku, old.description);
+        END
+    """,
+    f'{FTS_TABLE}_au': f"""
+        CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_au AFTER UPDATE OF name, sku, description ON inventory_product BEGIN
+            INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, name, sku, description)
+            VALUES ('delete', old.id, old.name, old.sku, old.description);
+            INSERT INTO {FTS_TABLE}(rowid, name, sku, description)
+            VALUES (new.id, new.name, new.sku, new.description);
+        END
+    """,
+}
+
+
+def _sqlite_objects(cursor):
+    cursor.execute(
+        "SELECT name FROM sqlite_master WHERE name = %s OR (type = 'trigger' AND name LIKE %s)",
+        [FTS_TABLE, f'{FTS_TABLE}_%'],
+    )
+    return {row[0] for row in cursor.fetchall()}
+
+
+def install_sqlite_index(conn):
+    """Restore the FTS5 table and triggers on a SQLite connection; safe to run repeatedly"""
+    with conn.cursor() as cursor:
+        existing = _sqlite_objects(cursor)
+        if FTS_TABLE not in existing:
+            cursor.execute(
+                f"CREATE VIRTUAL TABLE {FTS_TABLE} USING fts5("
+                "name, sku, description, content='inventory_product', content_rowid='id', "
+                "tokenize='unicode61 remove_diacritics 2', prefix='2 3')"
+            )
+        missing = [name for name in SQLITE_TRIGGERS if name not in existing]
+        for name in missing:
+            cursor.execute(SQLITE_TRIGGERS[name])
+        if missing:
+            # Rows may have changed while the triggers were absent
+            cursor.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')")
+
+
+def reinstall_after_migrate(sender, using, **kwargs):
+    """post_migrate hook: restore SQLite triggers dropped by table remakes"""
+    from django.db import connections
+    from django.db.migrations.recorder import MigrationRecorder
+
+    conn = connections[using]
+    if conn.vendor != 'sqlite':
+        return
+    applied = MigrationRecorder(conn).applied_migrations()
+    if ('inventory', '0005_product_search_index') in applied:
+        install_sqlite_index(conn)
+
+
+def _terms(search_terms):
+    """Split search terms into word tokens (punctuation such as '-' in SKUs separates words)"""
+    return [token for term in search_terms for token in re.findall(r'\w+', term)]
+
+
+def search_products(queryset, search_terms):
+    """Filter a Product queryset to the search terms and annotate ``search_rank`` (higher is better).
+
+    Returns None when the database has no search index support.
+    """
+    terms = _terms(search_terms)
+    if not terms:
+        return queryset
+
+    table = queryset.model._meta.db_table
+    if connection.vendor == 'postgresql':
+        tsquery = ' & '.join(f'{term}:*' for term in terms)
+        text = ' '.join(search_terms)
+        matches = RawSQL(f"{table}.search_vector @@ to_tsquery('simple', %s)", [tsquery], output_field=BooleanField())
+        # name % text uses the trigram index; the cut-off is pg_trgm.similarity_threshold (0.3)
+        similar = RawSQL(f'{table}.name %% %s', [text], output_field=BooleanField())
+        rank = RawSQL(
+            f"ts_rank_cd({table}.search_vector, to_tsquery('simple', %s)) + similarity({table}.name, %s)",
+            [tsquery, text],
+            output_field=FloatField(),
+        )
+        return queryset.filter(Q(matches) | Q(similar)).annotate(**{RANK_ANNOTATION: rank})
+
+    if connection.vendor == 'sqlite':
+        match = ' '.join('"{}"*'.format(term.replace('"', '""')) for term in terms)
+        # FTS5 rank is bm25, where lower is better; negate it so both vendors sort descending
+        rank = RawSQL(
+            f"(SELECT -bm25({FTS_TABLE}, 10.0, 10.0, 1.0) FROM {FTS_TABLE} "
+            f"WHERE {FTS_TABLE} MATCH %s AND {FTS_TABLE}.rowid = {table}.id)",
+            [match],
+            output_field=FloatField(),
+        )
+        matching_ids = RawSQL(f'SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s', [match])
+        return queryset.filter(id__in=matching_ids).annotate(**{RANK_ANNOTATION: rank})
+
+    return None
+
+
+class ProductSearchFilter(filters.SearchFilter):
+    """SearchFilter backed by the product full-text index"""
+
+    def filter_queryset(self, request, queryset, view):
+        search_terms = self.get_search_terms(request)
+        if not search_terms:
+            return queryset
+        results = search_products(queryset, search_terms)
+        if results is None:
+            return super().filter_queryset(request, queryset, view)
+        return results
+
+
+class RankedOrderingFilter(filters.OrderingFilter):
+    """OrderingFilter that orders search results by relevance unless ?ordering is given"""
+
+    def get_ordering(self, request, queryset, view):
+        if not request.query_params.get(self.ordering_param) and RANK_ANNOTATION in queryset.query.annotations:
+            return [f'-{RANK_ANNOTATION}', 'name']
+        return super().get_ordering(request, queryset, view)
@@ -0,0 +1,50 @@
+"""Generated SKU allocation backed by the per-shop SkuSequence table.
+
+SKUs are reserved in blocks with one counter update under a row lock, so a
+bulk import needs a constant number of queries however many SKUs it generates.
+Numbers already taken by hand-entered SKUs are skipped.
+"""
+import re
+
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import Product, SkuSequence
+
+SKU_FORMAT = 'PRD-{value:04d}'
+SKU_RE = re.compile(r'^PRD-(\d+)$')
+
+
+def _scan_next_value(shop_id):
+    """Seed a missing counter from the shop's existing generated-looking SKUs"""
+    skus = Product.objects.filter(shop_id=shop_id, sku__startswith='PRD-').values_list('sku', flat=True)
+    values = [int(match.group(1)) for match in map(SKU_RE.match, skus) if match]
+    return max(values, default=0) + 1
+
+
+def reserve_sku_values(shop_id, count):
+    """Advance the shop's counter by ``count`` and return the first reserved value"""
+    with transaction.atomic():
+        sequence, _ = SkuSequence.objects.select_for_update().get_or_create(
+            shop_id=shop_id,
+            defaults={'next_value': lambda: _scan_next_value(shop_id)},
+        )
+        start = sequence.next_value
+        SkuSequence.objects.filter(pk=sequence.pk).update(
+            next_value=F('next_value') + count,
+            updated_at=timezone.now(),
+        )
+    return start
+
+
+def allocate_skus(shop_id, count):
+    """Return ``count`` generated SKUs not used by any product of the shop"""
+    skus = []
+    while len(skus) < count:
+        needed = count - len(skus)
+        start = reserve_sku_values(shop_id, needed)
+        block = [SKU_FORMAT.format(value=value) for value in range(start, start + needed)]
+        taken = set(Product.objects.filter(shop_id=shop_id, sku__in=block).values_list('sku', flat=True))
+        skus.extend(sku for sku in block if sku not in taken)
+    return skus
@@ -1,5 +1,5 @@
 from rest_framework import serializers
-from .models import Product, Category
+from .models import Product, ProductBatch, Category, StockLocation, StockTake, StockTransfer
 from decimal import Decimal, InvalidOperation
 
 class CategorySerializer(serializers.ModelSerializer):
@@ -17,12 +17,13 @@ class ProductSerializer(serializers.ModelSerializer):
     price_with_gst = serializers.ReadOnlyField()
     gst_amount = serializers.ReadOnlyField()
     total_value = serializers.ReadOnlyField()
+    available_quantity = serializers.ReadOnlyField()
 
     class Meta:
         model = Product
         fields = [
             'id', 'name', 'sku', 'description', 'price', 'stock_quantity', 
-            'threshold', 'category', 'category_name', 'image', 'gst_rate',
+            'reserved_quantity', 'available_quantity', 'located_quantity', 'threshold', 'category', 'category_name', 'image', 'gst_rate',
             'is_low_stock', 'is_out_of_stock', 'price_with_gst', 'gst_amount', 
             'total_value', 'created_at', 'updated_at'
         ]
@@ -52,6 +53,11 @@ class ProductSerializer(serializers.ModelSerializer):
         """Validate stock quantity is non-negative"""
         if value < 0:
             raise serializers.ValidationError("Stock quantity cannot be negative.")
+        # Stock cannot drop below the units held at other locations
+        if self.instance is not None and value < self.instance.located_quantity:
+            raise serializers.ValidationError(
+                f"{self.instance.located_quantity} units are at other locations; transfer them back first."
+            )
         return value
 
     def validate_threshold(self, value):
@@ -75,4 +81,98 @@ class ProductSerializer(serializers.ModelSerializer):
     def create(self, validated_data):
         """Create product with proper user assignment"""
         validated_data['created_by'] = self.context['request'].user
-        return super().create(validated_data)
\ No newline at end of file
+        return super().create(validated_data)
+
+class ProductImportSerializer(ProductSerializer):
+    """ProductSerializer rules for one import row; SKU clashes and categories are resolved per chunk"""
+    sku = serializers.CharField(max_length=100, required=False, allow_blank=True)
+    category = serializers.CharField(max_length=100, required=False, allow_blank=True)
+
+    class Meta(ProductSerializer.Meta):
+        fields = ['name', 'sku', 'description', 'price', 'stock_quantity', 'threshold', 'gst_rate', 'category']
+        read_only_fields = []
+
+    def validate_sku(self, value):
+        return value.strip()
+
+
+class ProductPatchSerializer(ProductSerializer):
+    """ProductSerializer rules for one bulk patch; category ownership is checked per batch"""
+    category = serializers.IntegerField(required=False, allow_null=True)
+
+    class Meta(ProductSerializer.Meta):
+        fields = ['name', 'description', 'price', 'threshold', 'gst_rate', 'category']
+        read_only_fields = []
+
+
+class StockTakeSerializer(serializers.ModelSerializer):
+    line_count = serializers.IntegerField(read_only=True)
+
+    class Meta:
+        model = StockTake
+        fields = ['id', 'location', 'status', 'notes', 'line_count', 'created_by', 'created_at', 'applied_by', 'applied_at']
+        read_only_fields = ['status', 'created_by', 'created_at', 'applied_by', 'applied_at']
+
+    def validate_location(self, value):
+        if value is not None and value.shop_id != self.context['request'].user.pk:
+            raise serializers.ValidationError("Location not found.")
+        if self.instance is not None and value != self.instance.location and self.instance.lines.exists():
+            raise serializers.ValidationError("Cannot change the location once counts are recorded.")
+        return value
+
+
+class StockCountSerializer(serializers.Serializer):
+    sku = serializers.CharField(max_length=100)
+    counted_quantity = serializers.IntegerField(min_value=0)
+
+
+class ProductBatchSerializer(serializers.ModelSerializer):
+    product_sku = serializers.CharField(source='product.sku', read_only=True)
+    product_name = serializers.CharField(source='product.name', read_only=True)
+
+    class Meta:
+        model = ProductBatch
+        fields = [
+            'id', 'product', 'product_sku', 'product_name', 'batch_number', 'expiry_date',
+            'quantity', 'cost_price', 'received_at'
+        ]
+        read_only_fields = ['received_at']
+
+    def validate_quantity(self, value):
+        if value <= 0:
+            raise serializers.ValidationError("Quantity must be positive.")
+        return value
+
+    def validate_product(self, value):
+        user = self.context['request'].user
+        if not user.is_admin and value.shop_id != user.pk:
+            raise serializers.ValidationError("Product not found.")
+        return value
+
+
+class StockLocationSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = StockLocation
+        fields = ['id', 'name', 'is_default', 'created_at']
+        read_only_fields = ['is_default', 'created_at']
+
+
+class StockTransferLineSerializer(serializers.Serializer):
+    sku = serializers.CharField(max_length=100)
+    from_location = serializers.IntegerField()
+    to_location = serializers.IntegerField()
+    quantity = serializers.IntegerField(min_value=1)
+
+    def validate(self, attrs):
+        if attrs['from_location'] == attrs['to_location']:
+            raise serializers.ValidationError("Source and destination must differ.")
+        return attrs
+
+
+class StockTransferSerializer(serializers.ModelSerializer):
+    sku = serializers.CharField(source='product.sku', read_only=True)
+
+    class Meta:
+        model = StockTransfer
+        fields = ['id', 'product', 'sku', 'from_location', 'to_location', 'quantity', 'reference', 'created_by', 'created_at']
+        read_only_fields = fields
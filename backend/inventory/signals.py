@@ -0,0 +1,11 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .lookup import invalidate_lookups
+from .models import Product
+
+
+@receiver([post_save, post_delete], sender=Product)
+def invalidate_product_lookups(sender, instance, **kwargs):
+    """Drop cached SKU lookups of the shop owning the saved or deleted product"""
+    invalidate_lookups(instance.shop_id)
@@ -0,0 +1,183 @@
+"""Set-based stock changes for products.
+
+Deductions are issued as guarded UPDATE statements
+(``stock_quantity = stock_quantity - n WHERE stock_quantity >= n``) so no product
+rows are locked while Python code runs. A shortfall shows up as a smaller
+affected-row count, and the statement is rolled back. Successful deductions are
+appended to the stock movement ledger and drawn from the products' batches
+first-expiry-first-out in the same transaction.
+
+Draft invoices reserve stock the same way: ``reserved_quantity`` is a counter
+adjusted with guarded F-expression UPDATEs, and only ``stock_quantity -
+reserved_quantity`` can be reserved or sold by anyone else.
+"""
+import operator
+from functools import reduce
+
+from django.db import transaction
+from django.db.models import Case, F, IntegerField, Q, Value, When
+from django.db.models.functions import Greatest
+
+from .ledger import record_movements
+from .lookup import invalidate_lookups
+from .models import Product, StockMovement
+
+
+class InsufficientStock(ValueError):
+    """Raised when one or more products cannot cover the requested quantity"""
+
+    def __init__(self, shortfalls):
+        self.shortfalls = shortfalls
+        if not shortfalls:
+            # Stock changed again between the failed UPDATE and the re-read
+            message = "Insufficient stock, please retry"
+        elif shortfalls[0]['name'] is None:
+            message = "Product not found while applying stock"
+        else:
+            first = shortfalls[0]
+            message = (
+                f"Insufficient stock for {first['name']} "
+                f"(needed {first['required']}, available {first['available']})"
+            )
+        super().__init__(message)
+
+
+class _Shortfall(Exception):
+    pass
+
+
+def normalize_quantities(quantities):
+    """Drop empty entries and coerce {product_id: quantity} values to int"""
+    return {product_id: int(qty) for product_id, qty in quantities.items() if product_id and int(qty)}
+
+
+def quantity_case(quantities, field='id'):
+    """CASE expression mapping each key in ``quantities`` to its quantity"""
+    return Case(
+        *[When(**{field: key}, then=Value(qty)) for key, qty in quantities.items()],
+        default=Value(0),
+        output_field=IntegerField(),
+    )
+
+
+def find_shortfalls(required, reserved=None, location_id=None):
+    """List products whose unreserved stock (plus ``reserved`` held for this caller) cannot cover the quantity.
+
+    Stock counts only at the given non-default location, or at the default one.
+    """
+    reserved = reserved or {}
+    products = Product.objects.filter(id__in=list(required)).values_list(
+        'id', 'name', 'stock_quantity', 'reserved_quantity', 'located_quantity'
+    )
+    if location_id is not None:
+        from .locations import location_available
+        at_location = location_available(required, location_id)
+    found = {
+        product_id: (name, min(
+            at_location.get(product_id, 0) if location_id is not None else stock - located,
+            max(stock - held, 0) + reserved.get(product_id, 0),
+        ))
+        for product_id, name, stock, held, located in products
+    }
+    shortfalls = []
+    for product_id, qty in required.items():
+        name, available = found.get(product_id, (None, 0))
+        if name is None or available < qty:
+            shortfalls.append({
+                'product_id': product_id,
+                'name': name,
+                'required': qty,
+                'available': available,
+            })
+    return shortfalls
+
+
+def _guarded_update(guard, expected, **changes):
+    """UPDATE the rows matching ``guard``; roll back and report unless all ``expected`` rows matched"""
+    with transaction.atomic():
+        updated = Product.objects.filter(guard).update(**changes)
+        if updated != expected:
+            # Roll back the rows that did match before reporting
+            raise _Shortfall()
+
+
+def deduct_stock(required, reference='', movements=None, reserved=None, location=None):
+    """Deduct {product_id: quantity} from stock with a single guarded UPDATE.
+
+    Units come from ``location`` (a StockLocation), or the default location.
+    Stock reserved by other drafts is not available; ``reserved`` gives the
+    {product_id: quantity} the caller itself holds, which is converted (released
+    from ``reserved_quantity``) by the same UPDATE. Either every product is
+    deducted or none is; on shortfall InsufficientStock is raised listing the
+    products that could not cover their quantity. The sale is ledgered under
+    ``reference``, or as the given (product_id, quantity, reference)
+    ``movements`` when one deduction covers several documents; an empty
+    ``movements`` leaves the ledger to the caller.
+    """
+    required = normalize_quantities(required)
+    if not required:
+        return
+    reserved = {product_id: min(qty, required[product_id])
+                for product_id, qty in normalize_quantities(reserved or {}).items() if product_id in required}
+
+    location_id = location.pk if location is not None and not location.is_default else None
+
+    guard = reduce(operator.or_, (
+        Q(id=product_id, stock_quantity__gte=qty)
+        & Q(stock_quantity__gte=F('reserved_quantity') + (qty - reserved.get(product_id, 0)))
+        # Units at other locations are not on hand at the default one
+        & (Q(stock_quantity__gte=F('located_quantity') + qty) if location_id is None else Q())
+        for product_id, qty in required.items()
+    ))
+    changes = {'stock_quantity': F('stock_quantity') - quantity_case(required)}
+    if reserved:
+        changes['reserved_quantity'] = Greatest(F('reserved_quantity') - quantity_case(reserved), Value(0))
+    if location_id is not None:
+        changes['located_quantity'] = F('located_quantity') - quantity_case(required)
+    try:
+        with transaction.atomic():
+            _guarded_update(guard, len(required), **changes)
+            if location_id is not None:
+                from .locations import take_from_location
+                take_from_location(required, location_id)
+            if movements is None:
+                movements = ((product_id, qty, reference) for product_id, qty in required.items())
+            record_movements(((product_id, -qty, ref) for product_id, qty, ref in movements), StockMovement.SALE)
+            # The UPDATE above holds the product rows, so batches are drawn down in turn
+            from .batches import allocate_fefo
+            allocate_fefo(required)
+    except _Shortfall:
+        raise InsufficientStock(find_shortfalls(required, reserved, location_id))
+
+    invalidate_lookups(*Product.objects.filter(id__in=list(required)).values_list('shop_id', flat=True).distinct())
+
+
+def reserve_stock(quantities):
+    """Add {product_id: quantity} to ``reserved_quantity`` with one guarded UPDATE.
+
+    Only unreserved stock can be reserved; on shortfall nothing is reserved and
+    InsufficientStock is raised.
+    """
+    quantities = normalize_quantities(quantities)
+    if not quantities:
+        return
+    guard = reduce(operator.or_, (
+        Q(id=product_id, stock_quantity__gte=F('reserved_quantity') + qty) for product_id, qty in quantities.items()
+    ))
+    try:
+        _guarded_update(guard, len(quantities), reserved_quantity=F('reserved_quantity') + quantity_case(quantities))
+    except _Shortfall:
+        raise InsufficientStock(find_shortfalls(quantities))
+    from events.broker import publish_stock_changes
+    publish_stock_changes(quantities)
+
+
+def release_stock(quantities):
+    """Subtract {product_id: quantity} from ``reserved_quantity`` with one UPDATE"""
+    quantities = normalize_quantities(quantities)
+    if quantities:
+        Product.objects.filter(id__in=list(quantities)).update(
+            reserved_quantity=Greatest(F('reserved_quantity') - quantity_case(quantities), Value(0))
+        )
+        from events.broker import publish_stock_changes
+        publish_stock_changes(quantities)
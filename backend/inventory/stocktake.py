@@ -0,0 +1,146 @@
+"""Stock-take sessions: bulk count entry and set-based application.
+
+Counts are upserted in chunks; variances are read with one joined query; and
+applying a stock take records each line's expected quantity and variance, then
+moves every counted product's stock by its variance, each with one correlated
+UPDATE. A stock take counts one location (the default one unless set). The
+counted products are locked for the duration of the apply so the recorded
+variances are exactly the corrections made, and those variances are
+bulk-inserted into the stock movement ledger.
+"""
+from django.db import transaction
+from django.db.models import Count, F, OuterRef, Q, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from reports.cache import invalidate_shops
+
+from .batches import trim_batches
+from .ledger import record_movements
+from .locations import stored_location_id
+from .lookup import invalidate_lookups
+from .models import LocationStock, Product, StockMovement, StockTake, StockTakeLine
+
+COUNT_CHUNK_SIZE = 1000
+
+
+def record_counts(stock_take, counts, chunk_size=COUNT_CHUNK_SIZE):
+    """Upsert {sku: counted quantity} into an open stock take.
+
+    A SKU counted again replaces its earlier count. Returns (lines written,
+    unknown SKUs).
+    """
+    skus = dict(
+        Product.objects.filter(shop_id=stock_take.shop_id, sku__in=list(counts)).values_list('sku', 'id')
+    )
+    unknown = [sku for sku in counts if sku not in skus]
+    lines = [
+        StockTakeLine(stock_take=stock_take, product_id=skus[sku], counted_quantity=quantity)
+        for sku, quantity in counts.items() if sku in skus
+    ]
+    with transaction.atomic():
+        for start in range(0, len(lines), chunk_size):
+            StockTakeLine.objects.bulk_create(
+                lines[start:start + chunk_size],
+                update_conflicts=True,
+                unique_fields=['stock_take', 'product'],
+                update_fields=['counted_quantity', 'counted_at'],
+            )
+    return len(lines), unknown
+
+
+def _on_hand(location_id, product_ref):
+    """Expression for the units of the referenced product at a location (None is the default location)"""
+    if location_id is None:
+        return Subquery(
+            Product.objects.filter(pk=product_ref)
+            .annotate(on_hand=F('stock_quantity') - F('located_quantity')).values('on_hand')[:1]
+        )
+    return Coalesce(
+        Subquery(LocationStock.objects.filter(product_id=product_ref, location_id=location_id).values('quantity')[:1]),
+        Value(0),
+    )
+
+
+def variances(stock_take):
+    """Lines with current stock at the counted location and variance (counted - current), one query"""
+    location_id = stored_location_id(stock_take.location)
+    if location_id is None:
+        current = F('product__stock_quantity') - F('product__located_quantity')
+    else:
+        current = _on_hand(location_id, OuterRef('product_id'))
+    return (
+        stock_take.lines.annotate(
+            sku=F('product__sku'),
+            name=F('product__name'),
+            current_quantity=current,
+        )
+        .annotate(current_variance=F('counted_quantity') - F('current_quantity'))
+        .values('product_id', 'sku', 'name', 'counted_quantity', 'current_quantity', 'current_variance')
+        .order_by('product__sku')
+    )
+
+
+def apply_stock_take(stock_take_id, user):
+    """Set stock at the counted location to the counted quantities and record the adjustments.
+
+    Raises ValueError if the stock take is not open. Returns a summary.
+    """
+    with transaction.atomic():
+        # Flipping the status first makes a concurrent apply match no row
+        applied = StockTake.objects.filter(pk=stock_take_id, status='open').update(
+            status='applied', applied_by=user, applied_at=timezone.now()
+        )
+        if not applied:
+            raise ValueError("Stock take is not open")
+        stock_take = StockTake.objects.select_related('location').get(pk=stock_take_id)
+        location_id = stored_location_id(stock_take.location)
+
+        lines = StockTakeLine.objects.filter(stock_take_id=stock_take_id)
+        counted_products = Product.objects.filter(id__in=lines.values('product_id'))
+        # Hold the counted products (and their rows at the location) until the corrections are written
+        list(counted_products.select_for_update().values_list('id', flat=True))
+        if location_id is not None:
+            list(LocationStock.objects.select_for_update().filter(
+                location_id=location_id, product_id__in=lines.values('product_id')
+            ).values_list('id', flat=True))
+
+        lines.update(expected_quantity=_on_hand(location_id, OuterRef('product_id')))
+        lines.update(variance=F('counted_quantity') - F('expected_quantity'))
+
+        # Stock at other locations is unchanged, so every total moves by the variance
+        adjusted = lines.exclude(variance=0)
+        variance = Subquery(lines.filter(product_id=OuterRef('pk')).values('variance')[:1])
+        changes = {'stock_quantity': F('stock_quantity') + variance, 'updated_at': timezone.now()}
+        if location_id is not None:
+            changes['located_quantity'] = F('located_quantity') + variance
+        counted_products.filter(id__in=adjusted.values('product_id')).update(**changes)
+        if location_id is not None:
+            adjusted_ids = list(adjusted.values_list('product_id', flat=True))
+            LocationStock.objects.bulk_create(
+                [LocationStock(product_id=product_id, location_id=location_id) for product_id in adjusted_ids],
+                ignore_conflicts=True,
+                batch_size=COUNT_CHUNK_SIZE,
+            )
+            LocationStock.objects.filter(location_id=location_id, product_id__in=adjusted.values('product_id')).update(
+                quantity=Subquery(lines.filter(product_id=OuterRef('product_id')).values('counted_quantity')[:1])
+            )
+        record_movements(
+            ((product_id, variance, f'Stock take #{stock_take_id}') for product_id, variance in
+             adjusted.values_list('product_id', 'variance').iterator(chunk_size=2000)),
+            StockMovement.STOCK_TAKE,
+        )
+        trim_batches(counted_products)
+
+        summary = lines.aggregate(
+            lines=Count('id'),
+            adjusted=Count('id', filter=~Q(variance=0)),
+            units_added=Sum('variance', filter=Q(variance__gt=0)),
+            units_removed=Sum('variance', filter=Q(variance__lt=0)),
+        )
+        invalidate_shops(stock_take.shop_id)
+        invalidate_lookups(stock_take.shop_id)
+
+    summary['units_added'] = summary['units_added'] or 0
+    summary['units_removed'] = -(summary['units_removed'] or 0)
+    return summary
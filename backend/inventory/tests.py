@@ -1,3 +1,433 @@
-from django.test import TestCase
+import csv
+from datetime import timedelta
+from decimal import Decimal
+from io import StringIO
 
-# Create your tests here.
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.db.models import F
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from users.models import User
+
+from .batches import receive_batch
+from .importer import import_products
+from .ledger import discrepancies, stock_at, take_snapshots
+from .locations import TransferError, default_location, location_available, transfer_stock
+from .lookup import clear_local_cache, lookup_product
+from .models import (
+    Category, LocationStock, Product, ProductBatch, SkuSequence, StockLocation, StockMovement, StockSnapshot,
+    StockTake,
+)
+from .patches import apply_product_patches
+from .search import RANK_ANNOTATION, search_products
+from .sequences import allocate_skus
+from .stock import InsufficientStock, deduct_stock
+from .stocktake import apply_stock_take, record_counts
+
+
+def make_products(shop, count, stock=10):
+    category = Category.objects.create(name='General', shop=shop)
+    return [
+        Product.objects.create(name=f'Product {i}', sku=f'SKU-{i}', price='10.00', stock_quantity=stock,
+                               category=category, shop=shop, created_by=shop)
+        for i in range(count)
+    ]
+
+
+class DeductStockTests(TestCase):
+    def setUp(self):
+        self.shop = User.objects.create(username='stock', role='shop_owner', shop_name='Stock')
+        self.products = make_products(self.shop, 3)
+
+    def stock(self):
+        return list(Product.objects.filter(shop=self.shop).order_by('id').values_list('stock_quantity', flat=True))
+
+    def test_deducts_every_product(self):
+        first, second, third = self.products
+        deduct_stock({first.pk: 4, second.pk: 10})
+        self.assertEqual(self.stock(), [6, 0, 10])
+
+    def test_shortfall_raises_and_deducts_nothing(self):
+        first, second, third = self.products
+        with self.assertRaises(InsufficientStock) as raised:
+            deduct_stock({first.pk: 4, second.pk: 11, third.pk: 1})
+        self.assertEqual(
+            raised.exception.shortfalls,
+            [{'product_id': second.pk, 'name': second.name, 'required': 11, 'available': 10}],
+        )
+        self.assertEqual(self.stock(), [10, 10, 10])
+
+
+class LookupCacheTests(TestCase):
+    def setUp(self):
+        clear_local_cache()
+        self.shop = User.objects.create(username='lookup', role='shop_owner', shop_name='Lookup')
+        self.product, = make_products(self.shop, 1)
+
+    def tearDown(self):
+        clear_local_cache()
+
+    def rename(self):
+        # A plain UPDATE: the invalidation would only run on commit anyway
+        Product.objects.filter(pk=self.product.pk).update(name='Renamed')
+
+    def test_repeat_lookups_are_served_from_the_worker(self):
+        self.assertEqual(lookup_product(self.shop.pk, 'SKU-0')[1], False)
+        self.rename()
+        record, cached = lookup_product(self.shop.pk, 'SKU-0')
+        self.assertEqual((record['name'], cached), ('Product 0', True))
+
+    @override_settings(WEB_CONCURRENCY=2)
+    def test_process_local_cache_is_bypassed_with_several_workers(self):
+        lookup_product(self.shop.pk, 'SKU-0')
+        self.rename()
+        record, cached = lookup_product(self.shop.pk, 'SKU-0')
+        self.assertEqual((record['name'], cached), ('Renamed', False))
+
+
+class SearchTests(TestCase):
+    def setUp(self):
+        if connection.vendor not in ('postgresql', 'sqlite'):
+            self.skipTest('No full-text index on this database')
+        shop = User.objects.create(username='search', role='shop_owner', shop_name='Search')
+        category = Category.objects.create(name='General', shop=shop)
+        for name, sku, description in [
+            ('Paracetamol 500mg', 'MED-001', 'Fever and pain relief'),
+            ('Vitamin C', 'MED-002', 'Take with paracetamol if advised'),
+            ('Bandage roll', 'AID-001', ''),
+        ]:
+            Product.objects.create(name=name, sku=sku, description=description, price='1.00',
+                                   category=category, shop=shop, created_by=shop)
+
+    def search(self, *terms):
+        results = search_products(Product.objects.all(), terms).order_by(f'-{RANK_ANNOTATION}', 'name')
+        return list(results.values_list('name', flat=True))
+
+    def test_name_matches_rank_above_description_matches(self):
+        self.assertEqual(self.search('paracetamol'), ['Paracetamol 500mg', 'Vitamin C'])
+
+    def test_terms_match_as_prefixes(self):
+        self.assertEqual(self.search('band'), ['Bandage roll'])
+        self.assertCountEqual(self.search('MED-00'), ['Paracetamol 500mg', 'Vitamin C'])
+
+    def test_index_follows_updates_and_deletes(self):
+        Product.objects.filter(sku='AID-001').update(name='Gauze roll')
+        self.assertEqual(self.search('band'), [])
+        self.assertEqual(self.search('gauze'), ['Gauze roll'])
+        Product.objects.filter(sku='AID-001').delete()
+        self.assertEqual(self.search('gauze'), [])
+
+
+class FefoTests(TestCase):
+    def setUp(self):
+        shop = User.objects.create(username='fefo', role='shop_owner', shop_name='FEFO')
+        # Two units predate batch tracking
+        self.product, = make_products(shop, 1, stock=2)
+        today = timezone.now().date()
+        receive_batch(self.product, 'LATE', 5, expiry_date=today + timedelta(days=60))
+        receive_batch(self.product, 'SOON', 5, expiry_date=today + timedelta(days=10))
+        receive_batch(self.product, 'NONE', 5)
+
+    def batches(self):
+        return dict(ProductBatch.objects.filter(product=self.product).values_list('batch_number', 'quantity'))
+
+    def test_earliest_expiry_is_used_first(self):
+        deduct_stock({self.product.pk: 7})
+        self.assertEqual(self.batches(), {'SOON': 0, 'LATE': 3, 'NONE': 5})
+        deduct_stock({self.product.pk: 6})
+        self.assertEqual(self.batches(), {'SOON': 0, 'LATE': 0, 'NONE': 2})
+
+    def test_unbatched_stock_is_used_last(self):
+        deduct_stock({self.product.pk: 16})
+        self.assertEqual(self.batches(), {'SOON': 0, 'LATE': 0, 'NONE': 0})
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock_quantity, 1)
+
+
+class TransferTests(TestCase):
+    def setUp(self):
+        self.shop = User.objects.create(username='transfer', role='shop_owner', shop_name='Transfer')
+        self.products = make_products(self.shop, 2)
+        self.counter = default_location(self.shop.pk)
+        self.store = StockLocation.objects.create(shop=self.shop, name='Back store')
+        self.van = StockLocation.objects.create(shop=self.shop, name='Van')
+
+    def move(self, product, source, target, quantity):
+        return {'product_id': product.pk, 'from_location': source, 'to_location': target, 'quantity': quantity}
+
+    def levels(self):
+        """{product_id: (stock_quantity, units at counter, store, van)}"""
+        ids = [product.pk for product in self.products]
+        at = [location_available(ids, location.pk if not location.is_default else None)
+              for location in (self.counter, self.store, self.van)]
+        return {
+            product_id: (stock, *[units.get(product_id, 0) for units in at])
+            for product_id, stock in Product.objects.filter(id__in=ids).values_list('id', 'stock_quantity')
+        }
+
+    def assertConserved(self, levels):
+        for stock, *units in levels.values():
+            self.assertEqual(sum(units), stock)
+
+    def test_transfers_move_units_without_changing_totals(self):
+        first, second = self.products
+        transfer_stock(self.shop.pk, [
+            self.move(first, self.counter, self.store, 6),
+            self.move(first, self.store, self.van, 2),
+            self.move(second, self.counter, self.van, 3),
+        ], created_by=self.shop)
+        levels = self.levels()
+        self.assertEqual(levels[first.pk], (10, 4, 4, 2))
+        self.assertEqual(levels[second.pk], (10, 7, 0, 3))
+        self.assertConserved(levels)
+
+        transfer_stock(self.shop.pk, [self.move(first, self.van, self.counter, 2)], created_by=self.shop)
+        levels = self.levels()
+        self.assertEqual(levels[first.pk], (10, 6, 4, 0))
+        self.assertConserved(levels)
+
+    def test_short_source_moves_nothing(self):
+        first, second = self.products
+        transfer_stock(self.shop.pk, [self.move(first, self.counter, self.store, 3)], created_by=self.shop)
+        before = self.levels()
+        with self.assertRaises(TransferError) as raised:
+            transfer_stock(self.shop.pk, [
+                self.move(second, self.counter, self.van, 5),
+                self.move(first, self.store, self.van, 4),
+            ], created_by=self.shop)
+        self.assertEqual([(s['product_id'], s['available']) for s in raised.exception.shortfalls], [(first.pk, 3)])
+        self.assertEqual(self.levels(), before)
+
+    def test_sales_from_a_location_leave_the_totals_consistent(self):
+        first, second = self.products
+        transfer_stock(self.shop.pk, [self.move(first, self.counter, self.store, 6)], created_by=self.shop)
+        deduct_stock({first.pk: 5}, location=self.store)
+        deduct_stock({first.pk: 4})
+        levels = self.levels()
+        self.assertEqual(levels[first.pk], (1, 0, 1, 0))
+        self.assertConserved(levels)
+        with self.assertRaises(InsufficientStock):
+            deduct_stock({first.pk: 1})
+
+
+class StockLocationApiTests(TestCase):
+    def setUp(self):
+        self.shop = User.objects.create(username='locations', role='shop_owner', shop_name='Locations')
+        self.product, = make_products(self.shop, 1)
+        self.client = APIClient()
+        self.client.force_authenticate(self.shop)
+
+    def test_listing_creates_the_shop_default_location(self):
+        names = [location['name'] for location in self.client.get('/api/stock-locations/').json()['results']]
+        self.assertEqual(names, [default_location(self.shop.pk).name])
+
+    def test_admin_listing_creates_no_location(self):
+        admin = User.objects.create(username='locations-admin', role='admin')
+        self.client.force_authenticate(admin)
+        self.assertEqual(self.client.get('/api/stock-locations/').status_code, 200)
+        self.assertFalse(StockLocation.objects.filter(shop=admin).exists())
+
+    def test_only_unused_locations_can_be_deleted(self):
+        default = default_location(self.shop.pk)
+        used, unused = (StockLocation.objects.create(shop=self.shop, name=name) for name in ('Store', 'Van'))
+        transfer_stock(self.shop.pk, [
+            {'product_id': self.product.pk, 'from_location': default, 'to_location': used, 'quantity': 2},
+        ], self.shop)
+
+        for location in (default, used):
+            self.assertEqual(self.client.delete(f'/api/stock-locations/{location.pk}/').status_code, 400)
+        self.assertEqual(self.client.delete(f'/api/stock-locations/{unused.pk}/').status_code, 204)
+        self.assertEqual(set(StockLocation.objects.filter(shop=self.shop)), {default, used})
+
+
+class StockTakeTests(TestCase):
+    def setUp(self):
+        self.shop = User.objects.create(username='stocktake', role='shop_owner', shop_name='Stocktake')
+        self.products = make_products(self.shop, 3)
+        self.ids = [product.pk for product in self.products]
+
+    def count(self, counts, location=None):
+        stock_take = StockTake.objects.create(shop=self.shop, location=location, created_by=self.shop)
+        record_counts(stock_take, counts)
+        return stock_take
+
+    def recorded(self, stock_take):
+        return list(stock_take.lines.order_by('product_id').values_list('expected_quantity', 'variance'))
+
+    def ledger(self):
+        return dict(StockMovement.objects.filter(reason=StockMovement.STOCK_TAKE).values_list('product_id', 'quantity'))
+
+    def stock(self):
+        return list(Product.objects.filter(id__in=self.ids).order_by('id').values_list('stock_quantity', 'located_quantity'))
+
+    def test_apply_at_the_default_location(self):
+        stock_take = self.count({'SKU-0': 7, 'SKU-1': 10, 'SKU-2': 12})
+        summary = apply_stock_take(stock_take.pk, self.shop)
+        self.assertEqual(summary, {'lines': 3, 'adjusted': 2, 'units_added': 2, 'units_removed': 3})
+        self.assertEqual(self.recorded(stock_take), [(10, -3), (10, 0), (10, 2)])
+        self.assertEqual(self.stock(), [(7, 0), (10, 0), (12, 0)])
+        self.assertEqual(self.ledger(), {self.ids[0]: -3, self.ids[2]: 2})
+
+        with self.assertRaises(ValueError):
+            apply_stock_take(stock_take.pk, self.shop)
+        self.assertEqual(self.stock(), [(7, 0), (10, 0), (12, 0)])
+        self.assertEqual(len(self.ledger()), 2)
+
+    def test_apply_at_another_location(self):
+        van = StockLocation.objects.create(shop=self.shop, name='Van')
+        transfer_stock(self.shop.pk, [{'product_id': self.ids[0], 'from_location': default_location(self.shop.pk),
+                                       'to_location': van, 'quantity': 4}], self.shop)
+        stock_take = self.count({'SKU-0': 1, 'SKU-1': 3}, location=van)
+        apply_stock_take(stock_take.pk, self.shop)
+
+        self.assertEqual(self.recorded(stock_take), [(4, -3), (0, 3)])
+        self.assertEqual(dict(LocationStock.objects.filter(location=van).values_list('product_id', 'quantity')),
+                         {self.ids[0]: 1, self.ids[1]: 3})
+        self.assertEqual(self.stock(), [(7, 1), (13, 3), (10, 0)])
+        # The default location keeps what it had
+        self.assertEqual(location_available(self.ids, None), {self.ids[0]: 6, self.ids[1]: 10, self.ids[2]: 10})
+        self.assertEqual(self.ledger(), {self.ids[0]: -3, self.ids[1]: 3})
+
+
+class LedgerTests(TestCase):
+    def setUp(self):
+        self.shop = User.objects.create(username='ledger', role='shop_owner', shop_name='Ledger')
+        self.products = make_products(self.shop, 2)
+        self.ids = [product.pk for product in self.products]
+
+    def stock(self):
+        return dict(Product.objects.filter(id__in=self.ids).values_list('id', 'stock_quantity'))
+
+    def test_snapshot_plus_later_movements_is_the_stock(self):
+        first, second = self.ids
+        deduct_stock({first: 3}, reference='Sale 1')
+        self.assertEqual(take_snapshots(at=timezone.now()), 2)
+        self.assertEqual(dict(StockSnapshot.objects.values_list('product_id', 'quantity')), {first: 7, second: 10})
+
+        deduct_stock({first: 2, second: 4}, reference='Sale 2')
+        self.assertEqual(stock_at(self.ids, timezone.now()), self.stock())
+        self.assertEqual(self.stock(), {first: 5, second: 6})
+        deduct_stock({first: 1}, reference='Sale 3')
+        # Only products that moved since their last snapshot are checkpointed
+        self.assertEqual(take_snapshots(at=timezone.now(), products=Product.objects.filter(id=second)), 1)
+        self.assertEqual(stock_at(self.ids, timezone.now()), self.stock())
+        self.assertFalse(discrepancies().exists())
+
+    def test_direct_updates_are_reported(self):
+        first, second = self.ids
+        Product.objects.filter(pk=second).update(stock_quantity=F('stock_quantity') + 5)
+        self.assertEqual(list(discrepancies()), [(second, 'SKU-1', 15, 10)])
+
+        stderr = StringIO()
+        with self.assertRaises(CommandError):
+            call_command('compact_stock_ledger', '--check', stdout=StringIO(), stderr=stderr)
+        self.assertIn('SKU-1', stderr.getvalue())
+
+
+class ImportTests(TestCase):
+    CSV = (
+        'name,sku,price,stock_quantity,category\n'
+        'Clashes with the shop,SKU-0,5.00,1,Tools\n'
+        'New,NEW-1,5.00,3,Tools\n'
+        'Repeats a row,NEW-1,5.00,1,Tools\n'
+        'Generated,,5.00,2,Tools\n'
+        'Generated too,,5.00,0,\n'
+        'Bad price,BAD-1,abc,1,\n'
+    )
+
+    def setUp(self):
+        self.shop = User.objects.create(username='import', role='shop_owner', shop_name='Import')
+        make_products(self.shop, 1)
+
+    def run_import(self, dry_run=False):
+        return import_products(self.shop, csv.DictReader(StringIO(self.CSV)), self.shop, dry_run=dry_run, chunk_size=4)
+
+    def imported(self):
+        return dict(Product.objects.filter(shop=self.shop).exclude(sku='SKU-0').values_list('name', 'sku'))
+
+    def test_import_reports_clashes_and_generates_skus(self):
+        report = self.run_import()
+        self.assertEqual((report['rows'], report['created'], report['categories_created']), (6, 3, 1))
+        self.assertEqual([(error['line'], list(error['errors'])) for error in report['errors']],
+                         [(2, ['sku']), (4, ['sku']), (7, ['price'])])
+        self.assertEqual(self.imported(), {'New': 'NEW-1', 'Generated': 'PRD-0001', 'Generated too': 'PRD-0002'})
+        self.assertEqual(
+            dict(StockMovement.objects.filter(reason=StockMovement.IMPORT).values_list('product__sku', 'quantity')),
+            {'NEW-1': 3, 'PRD-0001': 2},
+        )
+
+    def test_dry_run_writes_nothing(self):
+        report = self.run_import(dry_run=True)
+        self.assertEqual((report['created'], report['error_count']), (3, 3))
+        self.assertEqual(self.imported(), {})
+        self.assertFalse(Category.objects.filter(name='Tools').exists())
+        self.assertFalse(StockMovement.objects.filter(reason=StockMovement.IMPORT).exists())
+        self.assertFalse(SkuSequence.objects.exists())
+
+    def test_generated_skus_skip_hand_entered_ones(self):
+        self.assertEqual(allocate_skus(self.shop.pk, 1), ['PRD-0001'])
+        Product.objects.create(name='Hand entered', sku='PRD-0002', price='1.00', shop=self.shop, created_by=self.shop)
+        self.assertEqual(allocate_skus(self.shop.pk, 2), ['PRD-0003', 'PRD-0004'])
+
+
+class PatchTests(TestCase):
+    def setUp(self):
+        self.shop = User.objects.create(username='patch', role='shop_owner', shop_name='Patch')
+        self.first, self.second = make_products(self.shop, 2)
+        other = User.objects.create(username='patch-other', role='shop_owner', shop_name='Other')
+        self.foreign, = make_products(other, 1)
+        self.foreign_category = self.foreign.category
+
+    def statuses(self, results):
+        return [(result['id'], result['status'], sorted(result.get('errors', {}))) for result in results]
+
+    def test_rows_fail_on_their_own(self):
+        results = apply_product_patches(self.shop, [
+            {'id': self.first.pk, 'price': '12.50'},
+            {'id': self.first.pk, 'name': 'Again'},
+            {'id': self.second.pk, 'price': '-1'},
+            {'id': self.second.pk + 1000, 'name': 'Missing'},
+            {'id': self.foreign.pk, 'name': 'Not mine'},
+            {'id': self.second.pk, 'category': self.foreign_category.pk},
+            {'id': 'x', 'name': 'No id'},
+            {'id': self.second.pk, 'stock_quantity': 99},
+        ])
+        self.assertEqual(self.statuses(results), [
+            (self.first.pk, 'updated', []),
+            (self.first.pk, 'error', ['id']),
+            (self.second.pk, 'error', ['price']),
+            (self.second.pk + 1000, 'error', ['id']),
+            (self.foreign.pk, 'error', ['id']),
+            (self.second.pk, 'error', ['id']),
+            ('x', 'error', ['id']),
+            (self.second.pk, 'error', ['stock_quantity']),
+        ])
+        self.foreign.refresh_from_db()
+        self.second.refresh_from_db()
+        self.assertEqual((self.foreign.name, self.second.category_id), ('Product 0', self.first.category_id))
+
+    def test_foreign_category_is_not_found(self):
+        results = apply_product_patches(self.shop, [{'id': self.second.pk, 'category': self.foreign_category.pk}])
+        self.assertEqual(self.statuses(results), [(self.second.pk, 'error', ['category'])])
+
+    def test_unpatched_columns_are_not_written(self):
+        with CaptureQueriesContext(connection) as queries:
+            results = apply_product_patches(self.shop, [
+                {'id': self.first.pk, 'price': '12.50'},
+                {'id': self.second.pk, 'name': 'Renamed', 'threshold': 3},
+            ])
+        self.assertEqual([result['status'] for result in results], ['updated', 'updated'])
+        updates = [query['sql'] for query in queries if query['sql'].startswith('UPDATE')]
+        self.assertEqual(len(updates), 2)
+        self.assertFalse(any('stock_quantity' in sql or 'description' in sql for sql in updates))
+        price_update, = [sql for sql in updates if '"price"' in sql]
+        self.assertNotIn('"name"', price_update)
+
+        self.first.refresh_from_db()
+        self.second.refresh_from_db()
+        self.assertEqual((self.first.name, self.first.price, self.first.threshold), ('Product 0', Decimal('12.50'), 10))
+        self.assertEqual((self.second.name, self.second.price, self.second.threshold), ('Renamed', Decimal('10.00'), 3))
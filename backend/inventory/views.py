@@ -1,12 +1,21 @@
 from rest_framework import viewsets, permissions, status, filters
-from rest_framework.parsers import MultiPartParser, FormParser
+from rest_framework.parsers import JSONParser, MultiPartParser, FormParser
 from rest_framework.decorators import action
 from rest_framework.response import Response
 from django_filters.rest_framework import DjangoFilterBackend
-from django.db.models import Q, F
-from .models import Product, Category
+from django.db import transaction
+from django.db.models import Count, Q, F, Sum
+from .models import Product, ProductBatch, Category, LocationStock, StockLocation, StockMovement, StockTake, StockTransfer
 from users.permissions import IsOwnerOrAdmin, IsAdminOnly
-from .serializers import ProductSerializer, CategorySerializer
+from .serializers import (
+    ProductSerializer, CategorySerializer, StockTakeSerializer, StockCountSerializer, ProductBatchSerializer,
+    StockLocationSerializer, StockTransferLineSerializer, StockTransferSerializer,
+)
+from reports.cache import invalidate_shops
+from .batches import trim_batches
+from .ledger import record_movements
+from .lookup import invalidate_lookups, lookup_product
+from .search import ProductSearchFilter, RankedOrderingFilter
 
 class CategoryViewSet(viewsets.ModelViewSet):
     serializer_class = CategorySerializer
@@ -42,7 +51,7 @@ class ProductViewSet(viewsets.ModelViewSet):
     # Shop owners and admins can modify; staff can read
     permission_classes = [IsOwnerOrAdmin]
     parser_classes = (MultiPartParser, FormParser)
-    filter_backends = [DjangoFilterBackend, filters.SearchFilter, filters.OrderingFilter]
+    filter_backends = [DjangoFilterBackend, ProductSearchFilter, RankedOrderingFilter]
     filterset_fields = ['category']
     search_fields = ['name', 'sku', 'description']
     ordering_fields = ['name', 'price', 'stock_quantity', 'created_at']
@@ -83,6 +92,69 @@ class ProductViewSet(viewsets.ModelViewSet):
         serializer = self.get_serializer(out_of_stock_products, many=True)
         return Response(serializer.data)
 
+    @action(detail=True, methods=['get'])
+    def stock_history(self, request, pk=None):
+        """Recent stock movements, and the stock level at ?at=<ISO datetime> if given"""
+        from django.utils import timezone
+        from django.utils.dateparse import parse_datetime
+        from .ledger import stock_at
+
+        product = self.get_object()
+        data = {'product_id': product.pk, 'stock_quantity': product.stock_quantity}
+        if request.query_params.get('at'):
+            at = parse_datetime(request.query_params['at'])
+            if at is None:
+                return Response({'error': 'at must be an ISO 8601 datetime'}, status=status.HTTP_400_BAD_REQUEST)
+            if timezone.is_naive(at):
+                at = timezone.make_aware(at)
+            data['at'] = at
+            data['stock_at'] = stock_at([product.pk], at)[product.pk]
+        data['movements'] = list(
+            product.stock_movements.values('quantity', 'reason', 'reference', 'created_at')[:100]
+        )
+        return Response(data)
+
+    @action(detail=False, methods=['get'])
+    def lookup(self, request):
+        """Resolve a scanned SKU/barcode to a compact product record"""
+        sku = request.query_params.get('sku', '').strip()
+        if not sku:
+            return Response({'error': 'sku is required'}, status=status.HTTP_400_BAD_REQUEST)
+
+        shop_id = request.user.pk
+        if request.user.is_admin and request.query_params.get('shop'):
+            try:
+                shop_id = int(request.query_params['shop'])
+            except ValueError:
+                return Response({'error': 'shop must be an integer'}, status=status.HTTP_400_BAD_REQUEST)
+
+        record, hit = lookup_product(shop_id, sku)
+        if record is None:
+            response = Response({'error': 'Product not found'}, status=status.HTTP_404_NOT_FOUND)
+        else:
+            response = Response(record)
+        response['X-Lookup-Cache'] = 'hit' if hit else 'miss'
+        return response
+
+    @action(detail=False, methods=['post'], url_path='import')
+    def import_products(self, request):
+        """Import products from an uploaded CSV; pass dry_run=true to only validate"""
+        import codecs
+        import csv
+        from .importer import import_products
+
+        upload = request.FILES.get('file')
+        if upload is None:
+            return Response({'error': 'Upload the product CSV as "file"'}, status=status.HTTP_400_BAD_REQUEST)
+        dry_run = str(request.data.get('dry_run', '')).lower() in ('1', 'true', 'yes')
+        try:
+            report = import_products(
+                request.user, csv.DictReader(codecs.iterdecode(upload, 'utf-8-sig')), request.user, dry_run=dry_run
+            )
+        except (UnicodeDecodeError, csv.Error) as e:
+            return Response({'error': f'Cannot read CSV: {e}'}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(report, status=status.HTTP_200_OK if dry_run else status.HTTP_201_CREATED)
+
     @action(detail=False, methods=['post'])
     def bulk_update(self, request):
         """Bulk update products"""
@@ -99,7 +171,20 @@ class ProductViewSet(viewsets.ModelViewSet):
         
         try:
             products = Product.objects.filter(id__in=product_ids)
-            updated_count = products.update(**update_data)
+            shop_ids = set(products.values_list('shop_id', flat=True))
+            with transaction.atomic():
+                if 'stock_quantity' in update_data:
+                    new_stock = int(update_data['stock_quantity'])
+                    old_stock = list(products.select_for_update().values_list('id', 'stock_quantity'))
+                updated_count = products.update(**update_data)
+                if 'stock_quantity' in update_data:
+                    record_movements(
+                        ((product_id, new_stock - stock, 'Bulk update') for product_id, stock in old_stock),
+                        StockMovement.BULK_UPDATE,
+                    )
+                    trim_batches(products)
+            invalidate_shops(*shop_ids)
+            invalidate_lookups(*shop_ids)
             
             return Response({
                 'message': f'Successfully updated {updated_count} products',
@@ -111,6 +196,18 @@ class ProductViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_400_BAD_REQUEST
             )
 
+    @action(detail=False, methods=['post', 'patch'], parser_classes=[JSONParser])
+    def bulk_patch(self, request):
+        """Apply per-product patches ([{id, price, gst_rate, threshold, ...}]) in one request"""
+        from .patches import apply_product_patches
+        patches = request.data.get('updates') if isinstance(request.data, dict) else request.data
+        if not isinstance(patches, list) or not patches:
+            return Response({'error': 'Provide a non-empty list of updates'}, status=status.HTTP_400_BAD_REQUEST)
+
+        results = apply_product_patches(request.user, patches)
+        updated = sum(1 for result in results if result['status'] == 'updated')
+        return Response({'updated': updated, 'failed': len(results) - updated, 'results': results})
+
     @action(detail=False, methods=['delete'])
     def bulk_delete(self, request):
         """Bulk delete products"""
@@ -150,4 +247,218 @@ class ProductViewSet(viewsets.ModelViewSet):
 
     def perform_create(self, serializer):
         """Automatically set the shop and created_by when creating products"""
-        serializer.save(shop=self.request.user, created_by=self.request.user)
\ No newline at end of file
+        serializer.save(shop=self.request.user, created_by=self.request.user)
+
+
+class StockTakeViewSet(viewsets.ModelViewSet):
+    """Stock-take sessions: enter counts in bulk, review variances, apply"""
+    serializer_class = StockTakeSerializer
+    permission_classes = [IsOwnerOrAdmin]
+    http_method_names = ['get', 'post', 'patch', 'head', 'options']
+
+    def get_queryset(self):
+        user = self.request.user
+        queryset = StockTake.objects.all() if user.is_admin else StockTake.objects.filter(shop=user)
+        return queryset.annotate(line_count=Count('lines'))
+
+    def perform_create(self, serializer):
+        serializer.save(shop=self.request.user, created_by=self.request.user)
+
+    @action(detail=True, methods=['post'])
+    def counts(self, request, pk=None):
+        """Add or replace counts: {"counts": [{"sku": ..., "counted_quantity": ...}]}"""
+        from .stocktake import record_counts
+        stock_take = self.get_object()
+        if stock_take.status != 'open':
+            return Response({'error': 'Stock take is not open'}, status=status.HTTP_400_BAD_REQUEST)
+
+        serializer = StockCountSerializer(data=request.data.get('counts'), many=True, allow_empty=False)
+        serializer.is_valid(raise_exception=True)
+        # A SKU listed twice keeps its last count
+        counts = {row['sku'].strip(): row['counted_quantity'] for row in serializer.validated_data}
+        written, unknown = record_counts(stock_take, counts)
+        return Response({'recorded': written, 'unknown_skus': unknown})
+
+    @action(detail=True, methods=['get'])
+    def variances(self, request, pk=None):
+        """Counted vs current stock; ?all=1 includes lines without a variance"""
+        from .stocktake import variances
+        rows = variances(self.get_object())
+        if request.query_params.get('all') not in ('1', 'true'):
+            rows = rows.exclude(current_variance=0)
+        page = self.paginate_queryset(rows)
+        if page is not None:
+            return self.get_paginated_response(page)
+        return Response(list(rows))
+
+    @action(detail=True, methods=['post'])
+    def apply(self, request, pk=None):
+        """Set stock to the counted quantities and record the variances"""
+        from .stocktake import apply_stock_take
+        stock_take = self.get_object()
+        try:
+            summary = apply_stock_take(stock_take.pk, request.user)
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_409_CONFLICT)
+        return Response(summary)
+
+    @action(detail=True, methods=['post'])
+    def cancel(self, request, pk=None):
+        """Discard an open stock take"""
+        cancelled = StockTake.objects.filter(pk=self.get_object().pk, status='open').update(status='cancelled')
+        if not cancelled:
+            return Response({'error': 'Stock take is not open'}, status=status.HTTP_409_CONFLICT)
+        return Response({'status': 'cancelled'})
+
+
+class ProductBatchViewSet(viewsets.ModelViewSet):
+    """Received batches; stock is drawn from them first-expiry-first-out"""
+    serializer_class = ProductBatchSerializer
+    permission_classes = [IsOwnerOrAdmin]
+    http_method_names = ['get', 'post', 'head', 'options']
+    filter_backends = [DjangoFilterBackend, filters.OrderingFilter]
+    filterset_fields = ['product']
+    ordering_fields = ['expiry_date', 'received_at', 'quantity']
+    def get_queryset(self):
+        user = self.request.user
+        queryset = ProductBatch.objects.select_related('product')
+        return queryset if user.is_admin else queryset.filter(product__shop=user)
+
+    def perform_create(self, serializer):
+        """Receive the batch: stock goes up with it"""
+        from .batches import receive_batch
+        data = serializer.validated_data
+        serializer.instance = receive_batch(
+            data['product'],
+            data['batch_number'],
+            data['quantity'],
+            expiry_date=data.get('expiry_date'),
+            cost_price=data.get('cost_price'),
+        )
+
+    @action(detail=False, methods=['get'])
+    def expiring(self, request):
+        """Batches expiring within ?days= (default 30); ?expired=1 includes those already expired"""
+        from .batches import expiring_batches
+        try:
+            days = int(request.query_params.get('days', 30))
+        except ValueError:
+            return Response({'error': 'days must be an integer'}, status=status.HTTP_400_BAD_REQUEST)
+        user = request.user
+        products = Product.objects.all() if user.is_admin else Product.objects.filter(shop=user)
+        batches = expiring_batches(
+            products, within_days=days, include_expired=request.query_params.get('expired') in ('1', 'true')
+        )
+        rows = batches.values(
+            'id', 'product_id', 'batch_number', 'expiry_date', 'quantity', 'cost_price', 'cost_value',
+            sku=F('product__sku'), name=F('product__name'),
+        )
+        summary = batches.aggregate(batches=Count('id'), units=Sum('quantity'), total_cost=Sum('cost_value'))
+        page = self.paginate_queryset(rows)
+        if page is not None:
+            response = self.get_paginated_response(page)
+            response.data['summary'] = summary
+            return response
+        return Response({'summary': summary, 'results': list(rows)})
+
+
+class StockLocationViewSet(viewsets.ModelViewSet):
+    """A shop's stock locations, their stock and bulk transfers between them"""
+    serializer_class = StockLocationSerializer
+    permission_classes = [permissions.IsAuthenticated]
+    http_method_names = ['get', 'post', 'patch', 'delete', 'head', 'options']
+
+    def get_queryset(self):
+        user = self.request.user
+        return StockLocation.objects.all() if user.is_admin else StockLocation.objects.filter(shop=user)
+
+    def list(self, request, *args, **kwargs):
+        from .locations import default_location
+        # Every shop has a default location to transfer from; admins own no stock
+        if request.user.is_shop_owner:
+            default_location(request.user.pk)
+        return super().list(request, *args, **kwargs)
+
+    def perform_create(self, serializer):
+        serializer.save(shop=self.request.user)
+
+    def destroy(self, request, *args, **kwargs):
+        location = self.get_object()
+        if location.is_default:
+            return Response({'error': 'The default location cannot be deleted'}, status=status.HTTP_400_BAD_REQUEST)
+        if location.stock.filter(quantity__gt=0).exists():
+            return Response({'error': 'Transfer the stock out of this location first'}, status=status.HTTP_400_BAD_REQUEST)
+        if location.transfers_in.exists() or location.transfers_out.exists() or location.stock_takes.exists():
+            return Response({'error': 'Location has history and cannot be deleted'}, status=status.HTTP_400_BAD_REQUEST)
+        return super().destroy(request, *args, **kwargs)
+
+    @action(detail=True, methods=['get'])
+    def stock(self, request, pk=None):
+        """Products with stock at this location"""
+        location = self.get_object()
+        products = Product.objects.filter(shop_id=location.shop_id)
+        if location.is_default:
+            rows = products.annotate(quantity=F('stock_quantity') - F('located_quantity'))
+        else:
+            rows = products.filter(location_stock__location=location).annotate(quantity=F('location_stock__quantity'))
+        rows = rows.filter(quantity__gt=0).values('id', 'sku', 'name', 'quantity', 'stock_quantity').order_by('sku')
+        page = self.paginate_queryset(rows)
+        if page is not None:
+            return self.get_paginated_response(page)
+        return Response(list(rows))
+
+    @action(detail=False, methods=['post'])
+    def transfer(self, request):
+        """Move stock in bulk: {"transfers": [{"sku", "from_location", "to_location", "quantity"}], "reference"}"""
+        from .locations import TransferError, transfer_stock
+        serializer = StockTransferLineSerializer(data=request.data.get('transfers'), many=True, allow_empty=False)
+        serializer.is_valid(raise_exception=True)
+        rows = serializer.validated_data
+
+        shop_id = request.user.pk
+        skus = dict(
+            Product.objects.filter(shop_id=shop_id, sku__in={row['sku'].strip() for row in rows}).values_list('sku', 'id')
+        )
+        locations = StockLocation.objects.filter(shop_id=shop_id).in_bulk(
+            {row['from_location'] for row in rows} | {row['to_location'] for row in rows}
+        )
+        errors = {}
+        for index, row in enumerate(rows):
+            if row['sku'].strip() not in skus:
+                errors[index] = {'sku': ['Product not found.']}
+            elif row['from_location'] not in locations or row['to_location'] not in locations:
+                errors[index] = {'location': ['Location not found.']}
+        if errors:
+            return Response({'errors': errors}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            records = transfer_stock(shop_id, [
+                {
+                    'product_id': skus[row['sku'].strip()],
+                    'from_location': locations[row['from_location']],
+                    'to_location': locations[row['to_location']],
+                    'quantity': row['quantity'],
+                }
+                for row in rows
+            ], request.user, reference=str(request.data.get('reference', ''))[:100])
+        except TransferError as e:
+            return Response({'error': str(e), 'shortfalls': e.shortfalls}, status=status.HTTP_409_CONFLICT)
+        return Response({'transferred': len(records)}, status=status.HTTP_201_CREATED)
+
+    @action(detail=False, methods=['get'])
+    def transfers(self, request):
+        """Transfer history, newest first; ?product= and ?location= narrow it"""
+        user = request.user
+        queryset = StockTransfer.objects.select_related('product')
+        if not user.is_admin:
+            queryset = queryset.filter(shop=user)
+        if request.query_params.get('product'):
+            queryset = queryset.filter(product_id=request.query_params['product'])
+        if request.query_params.get('location'):
+            location = request.query_params['location']
+            queryset = queryset.filter(Q(from_location_id=location) | Q(to_location_id=location))
+        page = self.paginate_queryset(queryset)
+        serializer = StockTransferSerializer(page if page is not None else queryset, many=True)
+        if page is not None:
+            return self.get_paginated_response(serializer.data)
+        return Response(serializer.data)
@@ -1,4 +1,18 @@
 from django.contrib import admin
+from .models import SalesFact, InventoryValuation
 
-# Register your models here.
-# No models to register yet
\ No newline at end of file
+
+@admin.register(SalesFact)
+class SalesFactAdmin(admin.ModelAdmin):
+    list_display = ['day', 'shop', 'level', 'category', 'product', 'created_by', 'revenue', 'quantity', 'invoice_count']
+    list_filter = ['level', 'day']
+    search_fields = ['key']
+    ordering = ['-day']
+    readonly_fields = [field.name for field in SalesFact._meta.fields]
+
+
+@admin.register(InventoryValuation)
+class InventoryValuationAdmin(admin.ModelAdmin):
+    list_display = ['date', 'shop', 'product_count', 'stock_units', 'total_value', 'low_stock_products', 'out_of_stock_products']
+    list_filter = ['date']
+    ordering = ['-date']
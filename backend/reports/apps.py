@@ -4,3 +4,8 @@ from django.apps import AppConfig
 class ReportsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'reports'
+
+    def ready(self):
+        # Invalidate cached reports when shop data changes
+        from . import signals  # noqa: F401
+        from . import checks  # noqa: F401
@@ -0,0 +1,125 @@
+"""Async report endpoints that run a report's independent queries concurrently.
+
+Each query of a ReportSection runs through sync_to_async(thread_sensitive=False)
+on a process-wide pool of REPORT_QUERY_CONCURRENCY threads; Django's async ORM
+methods would hand every query to the same thread and run them in turn. Each
+pool thread keeps its connection between queries and requests, and checks it
+against CONN_MAX_AGE before use the way Django does at the start of a request,
+so a query does not pay for a new connection. A per-request semaphore caps the
+queries in flight at the same number, so a request's latency is about that of
+its slowest query rather than the sum. Results share the sync actions' cache
+entries and invalidation.
+
+These views are meant for the ASGI service (config.asgi); under WSGI they still
+answer, but each request runs its own event loop through async_to_sync.
+"""
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections, connections
+from django.http import JsonResponse
+from django.views.decorators.http import require_GET
+from rest_framework.request import Request
+
+from users.authentication import authenticate_jwt
+
+from . import cache as report_cache
+from .views import CATEGORY_PERFORMANCE, CUSTOMER_ANALYTICS, INVENTORY_SUMMARY, SALES_SUMMARY, _cache_params
+
+SECTIONS = {
+    'sales': SALES_SUMMARY,
+    'inventory': INVENTORY_SUMMARY,
+    'customers': CUSTOMER_ANALYTICS,
+    'categories': CATEGORY_PERFORMANCE,
+}
+
+
+# Bounded, so the pool holds at most this many connections per process
+_executor = ThreadPoolExecutor(
+    max_workers=getattr(settings, 'REPORT_QUERY_CONCURRENCY', 4), thread_name_prefix='reports'
+)
+
+
+def _in_thread(function, *args):
+    def run():
+        # Pool threads never see request_started/request_finished, so expired
+        # or broken connections are dropped here instead
+        close_old_connections()
+        return function(*args)
+    return sync_to_async(run, thread_sensitive=False, executor=_executor)()
+
+
+def close_pool_connections():
+    """Close the connection held by every pool thread (for tests and shutdown)"""
+    workers = _executor._max_workers
+    # Each task waits for the others, so every one of them runs on its own thread
+    barrier = threading.Barrier(workers)
+
+    def close(_):
+        barrier.wait(timeout=10)
+        connections.close_all()
+
+    list(_executor.map(close, range(workers)))
+
+
+async def _run_section(section, request, semaphore):
+    """A section's data from the cache, or from its queries run concurrently"""
+    key, hit, data = await _in_thread(report_cache.lookup, section.name, _cache_params(request))
+    if hit:
+        return data
+
+    async def run(query):
+        async with semaphore:
+            return await _in_thread(query)
+
+    queries = section.queries(request)
+    results = await asyncio.gather(*(run(query) for query in queries.values()))
+    data = section.combine(request, dict(zip(queries, results)))
+    await _in_thread(report_cache.store, key, data)
+    return data
+
+
+async def _admin_request(request):
+    """The request wrapped for the report helpers, or an error response"""
+    user = await authenticate_jwt(request)
+    if user is None:
+        return None, JsonResponse({'detail': 'Authentication credentials were not provided or are invalid.'}, status=401)
+    if not user.is_admin:
+        return None, JsonResponse({'detail': 'You do not have permission to perform this action.'}, status=403)
+    return Request(request), None
+
+
+@require_GET
+async def dashboard(request):
+    """Sales, inventory, customer and category reports in one round trip.
+
+    Takes the same parameters as the individual reports; ``?sections=`` picks
+    a subset of sales, inventory, customers and categories.
+    """
+    report_request, error = await _admin_request(request)
+    if error is not None:
+        return error
+    names = [name for name in request.GET.get('sections', '').split(',') if name] or list(SECTIONS)
+    unknown = [name for name in names if name not in SECTIONS]
+    if unknown:
+        return JsonResponse({'error': f"sections must be among: {', '.join(SECTIONS)}"}, status=400)
+
+    semaphore = asyncio.Semaphore(getattr(settings, 'REPORT_QUERY_CONCURRENCY', 4))
+    data = await asyncio.gather(*(_run_section(SECTIONS[name], report_request, semaphore) for name in names))
+    return JsonResponse(dict(zip(names, data)))
+
+
+@require_GET
+async def section(request, name):
+    """One report section, served async: /api/reports/async/<sales|inventory|customers|categories>/"""
+    if name not in SECTIONS:
+        return JsonResponse({'error': f"Unknown report; use one of: {', '.join(SECTIONS)}"}, status=404)
+    report_request, error = await _admin_request(request)
+    if error is not None:
+        return error
+    semaphore = asyncio.Semaphore(getattr(settings, 'REPORT_QUERY_CONCURRENCY', 4))
+    data = await _run_section(SECTIONS[name], report_request, semaphore)
+    return JsonResponse(data, safe=False)
@@ -0,0 +1,222 @@
+"""Report result caching with shop-scoped invalidation.
+
+Cache keys embed a per-shop version token (plus a global token for reports
+that span all shops). Writes to invoices, payments and products replace the
+shop's token after the transaction commits, so every cached report for that
+shop becomes unreachable at once without tracking individual keys.
+
+Concurrent identical misses are collapsed: threads in a worker wait on a
+shared lock, and workers sharing a cache backend wait on a short-lived
+``cache.add`` lease, so the report is computed once.
+
+Invalidation only reaches the workers that share the cache. With a
+process-local backend (LocMemCache) and more than one worker process
+(``WEB_CONCURRENCY``), another worker would keep serving stale reports, so
+caching is switched off and every report is computed.
+"""
+import functools
+import hashlib
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from rest_framework.response import Response
+
+KEY_PREFIX = 'reports'
+GLOBAL_SCOPE = 'all'
+# Bumped only by invalidate_all(); part of every key
+EPOCH_SCOPE = 'epoch'
+STATS_EVENTS = ('hits', 'misses')
+
+PROCESS_LOCAL_BACKENDS = ('django.core.cache.backends.locmem.LocMemCache',)
+
+_MISSING = object()
+
+
+class _Uncacheable(Exception):
+    pass
+
+
+_inflight = {}
+_inflight_lock = threading.Lock()
+
+
+def cache_is_shared():
+    """Whether every worker process reads the same cache, so invalidation reaches them all"""
+    if settings.CACHES['default']['BACKEND'] not in PROCESS_LOCAL_BACKENDS:
+        return True
+    return getattr(settings, 'WEB_CONCURRENCY', 1) <= 1
+
+
+def _timeout():
+    return getattr(settings, 'REPORT_CACHE_TIMEOUT', 300)
+
+
+def _version_key(scope):
+    return f'{KEY_PREFIX}:version:{scope}'
+
+
+def scope_versions(*scopes):
+    """Current version tokens for shop ids, GLOBAL_SCOPE or EPOCH_SCOPE"""
+    keys = [_version_key(scope) for scope in scopes]
+    found = cache.get_many(keys)
+    versions = []
+    for key in keys:
+        version = found.get(key)
+        if version is None:
+            version = uuid.uuid4().hex[:12]
+            if not cache.add(key, version, timeout=None):
+                version = cache.get(key, version)
+        versions.append(version)
+    return versions
+
+
+def _bump(shop_ids):
+    versions = {_version_key(GLOBAL_SCOPE): uuid.uuid4().hex[:12]}
+    for shop_id in shop_ids:
+        versions[_version_key(shop_id)] = uuid.uuid4().hex[:12]
+    cache.set_many(versions, timeout=None)
+
+
+def invalidate_shops(*shop_ids):
+    """Invalidate cached reports for the given shops once the current transaction commits"""
+    shop_ids = {shop_id for shop_id in shop_ids if shop_id is not None}
+    transaction.on_commit(lambda: _bump(shop_ids))
+
+
+def invalidate_all():
+    """Invalidate every cached report (e.g. after rebuilding the sales cube)"""
+    transaction.on_commit(lambda: cache.set(_version_key(EPOCH_SCOPE), uuid.uuid4().hex[:12], timeout=None))
+
+
+def _record(report, event):
+    key = f'{KEY_PREFIX}:stats:{report}:{event}'
+    try:
+        cache.incr(key)
+    except ValueError:
+        if not cache.add(key, 1, timeout=None):
+            cache.incr(key)
+
+
+def stats(reports):
+    """Hit/miss counters per report"""
+    keys = {
+        (report, event): f'{KEY_PREFIX}:stats:{report}:{event}'
+        for report in reports for event in STATS_EVENTS
+    }
+    values = cache.get_many(list(keys.values()))
+    result = {}
+    for (report, event), key in keys.items():
+        result.setdefault(report, {})[event] = values.get(key, 0)
+    return result
+
+
+def build_key(report, scope, params):
+    """Cache key for a report, scope and already-normalized params"""
+    normalized = '&'.join(f'{name}={params[name]}' for name in sorted(params))
+    digest = hashlib.sha1(normalized.encode()).hexdigest()[:16]
+    epoch, version = scope_versions(EPOCH_SCOPE, scope)
+    return f'{KEY_PREFIX}:{report}:{scope}:{epoch}.{version}:{digest}'
+
+
+def get_or_compute(report, key, compute):
+    """Return the cached value for key, computing it at most once across concurrent callers"""
+    value = cache.get(key, _MISSING)
+    if value is not _MISSING:
+        _record(report, 'hits')
+        return value
+
+    with _inflight_lock:
+        lock = _inflight.setdefault(key, threading.Lock())
+    with lock:
+        try:
+            value = cache.get(key, _MISSING)
+            if value is not _MISSING:
+                _record(report, 'hits')
+                return value
+
+            # Another worker may be computing the same report; wait for its result
+            lease_key = f'{key}:lease'
+            lease_timeout = getattr(settings, 'REPORT_CACHE_LEASE_TIMEOUT', 10)
+            if not cache.add(lease_key, 1, timeout=lease_timeout):
+                deadline = time.monotonic() + lease_timeout
+                while time.monotonic() < deadline:
+                    time.sleep(0.05)
+                    value = cache.get(key, _MISSING)
+                    if value is not _MISSING:
+                        _record(report, 'hits')
+                        return value
+
+            _record(report, 'misses')
+            try:
+                value = compute()
+                cache.set(key, value, timeout=_timeout())
+            finally:
+                cache.delete(lease_key)
+            return value
+        finally:
+            with _inflight_lock:
+                _inflight.pop(key, None)
+
+
+def lookup(report, params):
+    """(key, hit, value) for a report's normalized params, counting the hit or miss.
+
+    For callers that compute on a miss themselves (the async views) and then
+    call store(); concurrent misses are not collapsed there. Always a miss
+    with a None key when the cache is not shared.
+    """
+    if not cache_is_shared():
+        return None, False, None
+    scope = params.get('shop')
+    key = build_key(report, GLOBAL_SCOPE if scope is None else scope, params)
+    value = cache.get(key, _MISSING)
+    hit = value is not _MISSING
+    _record(report, 'hits' if hit else 'misses')
+    return key, hit, (value if hit else None)
+
+
+def store(key, value):
+    if key is not None:
+        cache.set(key, value, timeout=_timeout())
+
+
+def cached_report(params):
+    """Cache a ReportViewSet action's response data.
+
+    ``params`` maps a request to the normalized parameters that identify the
+    result (parsed dates rather than raw strings); the ``shop`` entry selects
+    the invalidation scope.
+    """
+    def decorator(view_method):
+        report = view_method.__name__
+
+        @functools.wraps(view_method)
+        def wrapper(self, request, *args, **kwargs):
+            if not cache_is_shared():
+                return view_method(self, request, *args, **kwargs)
+            key_params = params(request)
+            scope = key_params.get('shop')
+            if scope is None:
+                scope = GLOBAL_SCOPE
+            key = build_key(report, scope, key_params)
+            errors = []
+
+            def compute():
+                response = view_method(self, request, *args, **kwargs)
+                if response.status_code != 200:
+                    # Do not cache errors; hand the response back as-is
+                    errors.append(response)
+                    raise _Uncacheable()
+                return response.data
+
+            try:
+                data = get_or_compute(report, key, compute)
+            except _Uncacheable:
+                return errors[0]
+            return Response(data)
+        return wrapper
+    return decorator
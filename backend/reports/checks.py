@@ -0,0 +1,17 @@
+from django.conf import settings
+from django.core.checks import Warning, register
+
+from .cache import cache_is_shared
+
+
+@register()
+def check_shared_cache(app_configs, **kwargs):
+    """Warn when the cache is per process but several workers serve the app"""
+    if cache_is_shared():
+        return []
+    return [Warning(
+        f"The default cache is process-local but WEB_CONCURRENCY is {settings.WEB_CONCURRENCY}, "
+        "so report caching and the SKU lookup cache are disabled.",
+        hint="Set CACHE_BACKEND and CACHE_LOCATION to a shared backend such as Redis.",
+        id='reports.W001',
+    )]
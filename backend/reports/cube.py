@@ -0,0 +1,190 @@
+"""Incremental maintenance of the SalesFact cube.
+
+Finalized invoices are added to the cube and cancelled ones removed. The
+contribution of a set of invoices is computed with two grouped aggregates and
+applied as additive deltas: missing rows are inserted as zeros (ignoring
+conflicts), then the affected rows are locked in key order and bulk-updated.
+Payment status changes of counted invoices move one invoice between the paid
+and pending counts of their invoice-level row the same way.
+"""
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Case, CharField, Count, DecimalField, ExpressionWrapper, F, Q, Sum, Value, When
+
+from billing.models import Invoice, InvoiceItem
+
+from .cache import invalidate_all
+from .models import SalesFact
+
+AMOUNT_FIELD = DecimalField(max_digits=14, decimal_places=2)
+MEASURES = ('revenue', 'tax', 'quantity', 'invoice_count', 'paid_count', 'pending_count')
+PAID_STATUSES = ('paid',)
+PENDING_STATUSES = ('due', 'partial')
+
+
+def _status_counts(status):
+    return int(status in PAID_STATUSES), int(status in PENDING_STATUSES)
+
+
+def _contributions(invoice_ids, statuses=None):
+    """Return {dimension tuple: measures} for the given invoices.
+
+    ``statuses`` ({invoice_id: status}) overrides the stored status of some
+    invoices, e.g. the status an invoice was counted under before it changed.
+    """
+    rows = {}
+
+    status = F('status')
+    if statuses:
+        status = Case(*[When(id=invoice_id, then=Value(value)) for invoice_id, value in statuses.items()],
+                      default=F('status'), output_field=CharField())
+    invoices = (
+        Invoice.objects.filter(id__in=invoice_ids)
+        .annotate(counted_status=status)
+        .values('shop_id', 'invoice_date', 'created_by_id')
+        .annotate(
+            revenue=Sum('total_amount'), tax=Sum('tax_amount'), invoice_count=Count('id'),
+            paid_count=Count('id', filter=Q(counted_status__in=PAID_STATUSES)),
+            pending_count=Count('id', filter=Q(counted_status__in=PENDING_STATUSES)),
+        )
+    )
+    for row in invoices:
+        dims = (row['shop_id'], row['invoice_date'], SalesFact.LEVEL_INVOICE, None, None, row['created_by_id'])
+        rows[dims] = {
+            'revenue': row['revenue'] or Decimal('0'),
+            'tax': row['tax'] or Decimal('0'),
+            'quantity': 0,
+            'invoice_count': row['invoice_count'],
+            'paid_count': row['paid_count'],
+            'pending_count': row['pending_count'],
+        }
+
+    line_total = F('quantity') * F('unit_price')
+    line_tax = ExpressionWrapper(line_total * F('tax_rate') * Value(Decimal('0.01')), output_field=AMOUNT_FIELD)
+    items = (
+        InvoiceItem.objects.filter(invoice_id__in=invoice_ids)
+        .values('invoice__shop_id', 'invoice__invoice_date', 'invoice__created_by_id',
+                'product__category_id', 'product_id')
+        .annotate(
+            revenue=Sum(line_total + line_tax, output_field=AMOUNT_FIELD),
+            tax=Sum(line_tax, output_field=AMOUNT_FIELD),
+            quantity_total=Sum('quantity'),
+            invoice_count=Count('invoice_id', distinct=True),
+        )
+    )
+    for row in items:
+        dims = (
+            row['invoice__shop_id'], row['invoice__invoice_date'], SalesFact.LEVEL_ITEM,
+            row['product__category_id'], row['product_id'], row['invoice__created_by_id'],
+        )
+        rows[dims] = {
+            'revenue': row['revenue'] or Decimal('0'),
+            'tax': row['tax'] or Decimal('0'),
+            'quantity': row['quantity_total'] or 0,
+            'invoice_count': row['invoice_count'],
+        }
+    return rows
+
+
+def _apply(deltas, sign):
+    if not deltas:
+        return
+    by_key = {SalesFact.make_key(*dims): (dims, measures) for dims, measures in deltas.items()}
+    with transaction.atomic():
+        SalesFact.objects.bulk_create([
+            SalesFact(
+                key=key, shop_id=dims[0], day=dims[1], level=dims[2],
+                category_id=dims[3], product_id=dims[4], created_by_id=dims[5],
+            )
+            for key, (dims, _) in by_key.items()
+        ], ignore_conflicts=True)
+
+        # Lock in key order so concurrent writers cannot deadlock
+        facts = list(SalesFact.objects.select_for_update().filter(key__in=list(by_key)).order_by('key'))
+        cents = Decimal('0.01')
+        for fact in facts:
+            measures = by_key[fact.key][1]
+            fact.revenue = (fact.revenue + sign * Decimal(measures['revenue'])).quantize(cents)
+            fact.tax = (fact.tax + sign * Decimal(measures['tax'])).quantize(cents)
+            fact.quantity += sign * int(measures['quantity'])
+            fact.invoice_count += sign * int(measures['invoice_count'])
+            fact.paid_count += sign * int(measures.get('paid_count', 0))
+            fact.pending_count += sign * int(measures.get('pending_count', 0))
+        SalesFact.objects.bulk_update(facts, MEASURES, batch_size=500)
+
+
+def record_invoices(invoice_ids, sign=1, statuses=None):
+    """Add (sign=1) or remove (sign=-1) the invoices' contribution to the cube"""
+    invoice_ids = list(invoice_ids)
+    if invoice_ids:
+        _apply(_contributions(invoice_ids, statuses), sign)
+
+
+def record_status_changes(changes):
+    """Move counted invoices between the paid and pending counts.
+
+    ``changes`` is {invoice_id: (old status, new status)}; invoices that are
+    not finalized, or are cancelled, are not in the cube and are skipped.
+    """
+    moves = {}
+    for invoice_id, (old_status, new_status) in changes.items():
+        old_paid, old_pending = _status_counts(old_status)
+        new_paid, new_pending = _status_counts(new_status)
+        if (old_paid, old_pending) != (new_paid, new_pending):
+            moves[invoice_id] = (new_paid - old_paid, new_pending - old_pending)
+    if not moves:
+        return
+
+    deltas = {}
+    invoices = (
+        Invoice.objects.filter(id__in=list(moves), stock_applied=True).exclude(status='cancelled')
+        .values_list('id', 'shop_id', 'invoice_date', 'created_by_id')
+    )
+    for invoice_id, shop_id, day, created_by_id in invoices:
+        dims = (shop_id, day, SalesFact.LEVEL_INVOICE, None, None, created_by_id)
+        measures = deltas.setdefault(dims, {
+            'revenue': 0, 'tax': 0, 'quantity': 0, 'invoice_count': 0, 'paid_count': 0, 'pending_count': 0,
+        })
+        measures['paid_count'] += moves[invoice_id][0]
+        measures['pending_count'] += moves[invoice_id][1]
+    _apply(deltas, 1)
+
+
+def sync_status_change(invoice, old_status):
+    """Keep a finalized invoice's contribution in line with a status change"""
+    if not invoice.stock_applied or old_status is None:
+        return
+    was_counted = old_status != 'cancelled'
+    is_counted = invoice.status != 'cancelled'
+    if was_counted != is_counted:
+        # A cancelled invoice leaves with the status it was counted under
+        record_invoices([invoice.pk], sign=1 if is_counted else -1,
+                        statuses=None if is_counted else {invoice.pk: old_status})
+    elif is_counted:
+        record_status_changes({invoice.pk: (old_status, invoice.status)})
+
+
+def rebuild(shop_id=None, chunk_size=1000):
+    """Recompute the cube from every finalized, non-cancelled invoice"""
+    facts = SalesFact.objects.all()
+    invoices = Invoice.objects.filter(stock_applied=True).exclude(status='cancelled')
+    if shop_id is not None:
+        facts = facts.filter(shop_id=shop_id)
+        invoices = invoices.filter(shop_id=shop_id)
+
+    with transaction.atomic():
+        facts.delete()
+        chunk = []
+        count = 0
+        for invoice_id in invoices.values_list('id', flat=True).iterator(chunk_size=chunk_size):
+            chunk.append(invoice_id)
+            if len(chunk) >= chunk_size:
+                record_invoices(chunk)
+                count += len(chunk)
+                chunk = []
+        record_invoices(chunk)
+        count += len(chunk)
+        invalidate_all()
+    return count
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from reports.cube import rebuild
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the pre-aggregated sales cube from finalized invoices'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--shop', type=int, help='Only rebuild rows for this shop (user id)')
+        parser.add_argument('--chunk-size', type=int, default=1000, help='Invoices aggregated per batch')
+
+    def handle(self, *args, **options):
+        count = rebuild(shop_id=options['shop'], chunk_size=options['chunk_size'])
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt sales cube from {count} invoices'))
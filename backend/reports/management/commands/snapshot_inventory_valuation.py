@@ -0,0 +1,22 @@
+from datetime import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+
+from reports.models import InventoryValuation
+
+
+class Command(BaseCommand):
+    help = 'Record the current inventory value of every shop (run daily, e.g. from cron)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--date', help='Snapshot date (YYYY-MM-DD), defaults to today')
+
+    def handle(self, *args, **options):
+        date = None
+        if options['date']:
+            try:
+                date = datetime.strptime(options['date'], '%Y-%m-%d').date()
+            except ValueError:
+                raise CommandError('--date must be in YYYY-MM-DD format')
+        count = InventoryValuation.take_snapshot(date)
+        self.stdout.write(self.style.SUCCESS(f'Recorded inventory valuation for {count} shops'))
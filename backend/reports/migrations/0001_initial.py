@@ -0,0 +1,41 @@
+# Generated by Django 5.2.5 on 2026-10-17 00:50
+
+import django.db.models.deletion
+from decimal import Decimal
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        ('inventory', '0004_product_stock_quantity_non_negative'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SalesFact',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=120, unique=True)),
+                ('day', models.DateField()),
+                ('level', models.CharField(choices=[('invoice', 'Invoice'), ('item', 'Item')], max_length=10)),
+                ('revenue', models.DecimalField(decimal_places=2, default=Decimal('0.00'), help_text='Amount including tax', max_digits=14)),
+                ('tax', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=14)),
+                ('quantity', models.IntegerField(default=0)),
+                ('invoice_count', models.IntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('category', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='inventory.category')),
+                ('created_by', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL)),
+                ('product', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='inventory.product')),
+                ('shop', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='sales_facts', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['day'],
+                'indexes': [models.Index(fields=['shop', 'level', 'day'], name='salesfact_shop_level_day'), models.Index(fields=['level', 'day'], name='salesfact_level_day')],
+            },
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 5.2.5 on 2026-10-17 00:51
+
+import django.db.models.deletion
+from decimal import Decimal
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reports', '0001_initial'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='InventoryValuation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('product_count', models.PositiveIntegerField(default=0)),
+                ('stock_units', models.PositiveBigIntegerField(default=0)),
+                ('total_value', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=16)),
+                ('low_stock_products', models.PositiveIntegerField(default=0)),
+                ('out_of_stock_products', models.PositiveIntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('shop', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='inventory_valuations', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['-date'],
+                'unique_together': {('shop', 'date')},
+            },
+        ),
+    ]
@@ -0,0 +1,50 @@
+# Generated by Django 5.2.5 on 2026-10-17 01:39
+
+from django.db import migrations, models
+from django.db.models import Count, Q
+
+
+def seed_status_counts(apps, schema_editor):
+    """Count the paid and pending invoices already in the cube's invoice-level rows"""
+    Invoice = apps.get_model('billing', 'Invoice')
+    SalesFact = apps.get_model('reports', 'SalesFact')
+    rows = (
+        Invoice.objects.filter(stock_applied=True).exclude(status='cancelled')
+        .values('shop_id', 'invoice_date', 'created_by_id')
+        .annotate(paid=Count('id', filter=Q(status='paid')),
+                  pending=Count('id', filter=Q(status__in=['due', 'partial'])))
+    )
+    counts = {}
+    for row in rows.iterator():
+        if row['paid'] or row['pending']:
+            parts = [row['shop_id'], row['invoice_date'].isoformat(), 'invoice', None, None, row['created_by_id']]
+            counts[':'.join('-' if part is None else str(part) for part in parts)] = (row['paid'], row['pending'])
+
+    keys = list(counts)
+    for start in range(0, len(keys), 1000):
+        facts = list(SalesFact.objects.filter(key__in=keys[start:start + 1000]))
+        for fact in facts:
+            fact.paid_count, fact.pending_count = counts[fact.key]
+        SalesFact.objects.bulk_update(facts, ['paid_count', 'pending_count'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reports', '0002_inventoryvaluation'),
+        ('billing', '0008_stockreservation'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='salesfact',
+            name='paid_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='salesfact',
+            name='pending_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.RunPython(seed_status_counts, migrations.RunPython.noop),
+    ]
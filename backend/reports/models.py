@@ -1,3 +1,121 @@
 from django.db import models
+from django.db.models import Count, F, Q, Sum
+from django.contrib.auth import get_user_model
+from django.utils import timezone
+from decimal import Decimal
 
-# Create your models here.
+User = get_user_model()
+
+
+class SalesFact(models.Model):
+    """Pre-aggregated sales of finalized invoices.
+
+    Invoice-level rows (product/category empty) hold invoice totals and counts,
+    including how many of the invoices are paid or still pending; item-level
+    rows hold line revenue and quantities per product. Rows are kept
+    up to date incrementally by reports.cube and can be rebuilt with
+    ``manage.py rebuild_sales_cube``.
+    """
+    LEVEL_INVOICE = 'invoice'
+    LEVEL_ITEM = 'item'
+    LEVEL_CHOICES = [
+        (LEVEL_INVOICE, 'Invoice'),
+        (LEVEL_ITEM, 'Item'),
+    ]
+
+    # Dimension key; nullable dimensions cannot take part in a unique constraint portably
+    key = models.CharField(max_length=120, unique=True)
+    shop = models.ForeignKey(User, on_delete=models.CASCADE, related_name='sales_facts')
+    day = models.DateField()
+    level = models.CharField(max_length=10, choices=LEVEL_CHOICES)
+    category = models.ForeignKey('inventory.Category', on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    product = models.ForeignKey('inventory.Product', on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    created_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+
+    # Measures
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=Decimal('0.00'), help_text="Amount including tax")
+    tax = models.DecimalField(max_digits=14, decimal_places=2, default=Decimal('0.00'))
+    quantity = models.IntegerField(default=0)
+    invoice_count = models.IntegerField(default=0)
+    paid_count = models.IntegerField(default=0)
+    pending_count = models.IntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ['day']
+        indexes = [
+            models.Index(fields=['shop', 'level', 'day'], name='salesfact_shop_level_day'),
+            models.Index(fields=['level', 'day'], name='salesfact_level_day'),
+        ]
+
+    def __str__(self):
+        return f"{self.key}: {self.revenue}"
+
+    @staticmethod
+    def make_key(shop_id, day, level, category_id, product_id, created_by_id):
+        parts = [shop_id, day.isoformat(), level, category_id, product_id, created_by_id]
+        return ':'.join('-' if part is None else str(part) for part in parts)
+
+
+def inventory_aggregates():
+    """Aggregate expressions valuing a Product queryset in a single query"""
+    return {
+        'total_products': Count('id'),
+        'stock_units': Sum('stock_quantity'),
+        'total_inventory_value': Sum(
+            F('price') * F('stock_quantity'),
+            output_field=models.DecimalField(max_digits=16, decimal_places=2)
+        ),
+        'low_stock_products': Count('id', filter=Q(stock_quantity__lte=F('threshold'))),
+        'out_of_stock_products': Count('id', filter=Q(stock_quantity=0)),
+    }
+
+
+class InventoryValuation(models.Model):
+    """Daily snapshot of a shop's inventory value, taken by ``manage.py snapshot_inventory_valuation``"""
+    shop = models.ForeignKey(User, on_delete=models.CASCADE, related_name='inventory_valuations')
+    date = models.DateField()
+    product_count = models.PositiveIntegerField(default=0)
+    stock_units = models.PositiveBigIntegerField(default=0)
+    total_value = models.DecimalField(max_digits=16, decimal_places=2, default=Decimal('0.00'))
+    low_stock_products = models.PositiveIntegerField(default=0)
+    out_of_stock_products = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['-date']
+        unique_together = ['shop', 'date']
+
+    def __str__(self):
+        return f"{self.shop_id} {self.date}: {self.total_value}"
+
+    @classmethod
+    def take_snapshot(cls, date=None):
+        """Value every shop's products with one grouped query and upsert today's rows"""
+        from inventory.models import Product
+        from .cache import invalidate_shops
+
+        date = date or timezone.now().date()
+        rows = Product.objects.values('shop_id').annotate(**inventory_aggregates()).order_by()
+        snapshots = [
+            cls(
+                shop_id=row['shop_id'],
+                date=date,
+                product_count=row['total_products'],
+                stock_units=row['stock_units'] or 0,
+                total_value=row['total_inventory_value'] or Decimal('0.00'),
+                low_stock_products=row['low_stock_products'],
+                out_of_stock_products=row['out_of_stock_products'],
+            )
+            for row in rows
+        ]
+        cls.objects.bulk_create(
+            snapshots,
+            update_conflicts=True,
+            unique_fields=['shop', 'date'],
+            update_fields=['product_count', 'stock_units', 'total_value',
+                           'low_stock_products', 'out_of_stock_products'],
+        )
+        # The valuation history is a cached report
+        invalidate_shops(*{snapshot.shop_id for snapshot in snapshots})
+        return len(snapshots)
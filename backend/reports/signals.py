@@ -0,0 +1,21 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from billing.models import Customer, Invoice, Payment
+from inventory.models import Category, Product
+
+from .cache import invalidate_shops
+
+
+@receiver([post_save, post_delete], sender=Invoice)
+@receiver([post_save, post_delete], sender=Customer)
+@receiver([post_save, post_delete], sender=Product)
+@receiver([post_save, post_delete], sender=Category)
+def invalidate_shop_reports(sender, instance, **kwargs):
+    """Drop cached reports of the shop owning the saved or deleted object"""
+    invalidate_shops(instance.shop_id)
+
+
+@receiver([post_save, post_delete], sender=Payment)
+def invalidate_payment_reports(sender, instance, **kwargs):
+    invalidate_shops(Invoice.objects.filter(pk=instance.invoice_id).values_list('shop_id', flat=True).first())
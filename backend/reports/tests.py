@@ -1,3 +1,143 @@
-from django.test import TestCase
+from datetime import timedelta
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections
+from django.test import AsyncClient, TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from billing.checkout import checkout
+from billing.models import Invoice, Payment
+from billing.payments import post_payment
+from inventory.models import Category, Product
+from users.models import User
+
+from . import cache as report_cache
+from .async_views import _in_thread, close_pool_connections
+from .models import InventoryValuation
+
+
+class SalesSummaryTests(TestCase):
+    def setUp(self):
+        self.shop = User.objects.create(username='reports', role='admin', shop_name='Reports')
+        category = Category.objects.create(name='General', shop=self.shop)
+        self.product = Product.objects.create(name='Product', sku='SKU-1', price='100.00', stock_quantity=100,
+                                              gst_rate=Decimal('0'), category=category, shop=self.shop,
+                                              created_by=self.shop)
+        self.client = APIClient()
+        self.client.force_authenticate(self.shop)
+
+    def sell(self, paid):
+        receipt = checkout(self.shop, self.shop, [{'sku': 'SKU-1', 'quantity': 1}], payment={'amount': paid})
+        return Invoice.objects.get(pk=receipt['invoice_id'])
+
+    def summary(self):
+        cache.clear()
+        response = self.client.get('/api/reports/sales_summary/', {'shop': self.shop.pk})
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        return data['total_invoices'], data['paid_invoices'], data['pending_invoices']
+
+    def test_counts_follow_payments_and_cancellation(self):
+        paid = self.sell(100)
+        partial = self.sell(40)
+        due = self.sell(0)
+        self.assertEqual(self.summary(), (3, 1, 2))
+
+        post_payment(partial, Decimal('60.00'), self.shop)
+        self.assertEqual(self.summary(), (3, 2, 1))
+
+        due.status = 'cancelled'
+        due.save()
+        self.assertEqual(self.summary(), (2, 2, 0))
+
+        paid.status = 'cancelled'
+        paid.save()
+        self.assertEqual(self.summary(), (1, 1, 0))
+        self.assertEqual(Payment.objects.filter(invoice__shop=self.shop).count(), 3)
+
+    def test_paid_drafts_are_not_counted(self):
+        self.sell(100)
+        customer = self.sell(0).customer
+        draft = Invoice.objects.create(customer=customer, shop=self.shop, created_by=self.shop,
+                                       total_amount=Decimal('50.00'),
+                                       due_date=timezone.now().date() + timedelta(days=30))
+        post_payment(draft, Decimal('50.00'), self.shop)
+        self.assertEqual(self.summary(), (2, 1, 1))
+
+    def test_finalized_invoice_date_is_frozen(self):
+        invoice = self.sell(100)
+        invoice.invoice_date -= timedelta(days=1)
+        with self.assertRaises(ValueError):
+            invoice.save()
+
+
+class ReportCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.admin = User.objects.create(username='cache', role='admin', shop_name='Cache')
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+
+    def total_products(self):
+        return self.client.get('/api/reports/inventory_summary/').json()['total_products']
+
+    def add_product(self):
+        Product.objects.create(name='Product', sku=f'SKU-{Product.objects.count()}', price='1.00',
+                               shop=self.admin, created_by=self.admin)
+
+    def test_single_worker_caches_reports(self):
+        before = self.total_products()
+        # Invalidation runs on commit, which never comes inside this test's transaction
+        self.add_product()
+        self.assertEqual(self.total_products(), before)
+
+    def test_snapshot_invalidates_the_valuation_history(self):
+        self.add_product()
+        history = lambda: self.client.get('/api/reports/inventory_valuation_history/').json()
+        self.assertEqual(history(), [])
+        with self.captureOnCommitCallbacks(execute=True):
+            InventoryValuation.take_snapshot()
+        self.assertEqual([row['product_count'] for row in history()], [1])
+
+    @override_settings(WEB_CONCURRENCY=2)
+    def test_process_local_cache_is_off_with_several_workers(self):
+        self.assertFalse(report_cache.cache_is_shared())
+        before = self.total_products()
+        self.add_product()
+        self.assertEqual(self.total_products(), before + 1)
+
+    @override_settings(WEB_CONCURRENCY=2, CACHES={
+        'default': {'BACKEND': 'django.core.cache.backends.redis.RedisCache', 'LOCATION': 'redis://localhost:6379/0'},
+    })
+    def test_shared_backend_keeps_caching(self):
+        self.assertTrue(report_cache.cache_is_shared())
+
+
+class AsyncReportTests(TransactionTestCase):
+    def setUp(self):
+        cache.clear()
+        self.admin = User.objects.create(username='dashboard', role='admin', shop_name='Dashboard')
+        Product.objects.create(name='Product', sku='SKU-1', price='5.00', stock_quantity=2,
+                               shop=self.admin, created_by=self.admin)
+
+    def tearDown(self):
+        close_pool_connections()
+
+    async def test_dashboard_matches_the_sync_reports(self):
+        token = str(RefreshToken.for_user(self.admin).access_token)
+        response = await AsyncClient().get('/api/reports/dashboard/', headers={'Authorization': f'Bearer {token}'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['inventory'], {
+            'total_products': 1, 'total_inventory_value': 10.0, 'low_stock_products': 1, 'out_of_stock_products': 0,
+        })
+
+    async def test_pool_threads_reuse_their_connections(self):
+        with mock.patch.object(type(connections['default']), 'close', autospec=True) as close:
+            used = {id(await _in_thread(lambda: connections['default'])) for _ in range(20)}
+        self.assertLessEqual(len(used), settings.REPORT_QUERY_CONCURRENCY)
+        close.assert_not_called()
@@ -1,5 +1,6 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
+from . import async_views
 from .views import ReportViewSet
 
 router = DefaultRouter()
@@ -7,5 +8,8 @@ router = DefaultRouter()
 router.register(r'', ReportViewSet, basename='reports')
 
 urlpatterns = [
+    # Async views go before the root-registered router
+    path('dashboard/', async_views.dashboard, name='reports-dashboard'),
+    path('async/<str:name>/', async_views.section, name='reports-async-section'),
     path('', include(router.urls)),
-]
\ No newline at end of file
+]
@@ -1,8 +1,9 @@
 from django.shortcuts import render
-from rest_framework import viewsets, permissions
+from rest_framework import viewsets, permissions, status
 from rest_framework.decorators import action
 from rest_framework.response import Response
-from django.db.models import Sum, Count, Avg, F
+from django.db.models import Sum, Count, Avg, F, Q, DecimalField
+from django.db.models.functions import TruncMonth, TruncWeek
 from django.utils import timezone
 from datetime import datetime, timedelta
 from decimal import Decimal
@@ -10,137 +11,331 @@ from decimal import Decimal
 from billing.models import Invoice, InvoiceItem
 from inventory.models import Product, Category
 from users.permissions import IsAdminOnly
+from .models import SalesFact, InventoryValuation, inventory_aggregates
+from . import cache as report_cache
+from .cache import cached_report
+
+REPORT_PARAMS = ('start_date', 'end_date', 'group_by', 'category', 'product', 'created_by')
+
+BREAKDOWN_GROUPS = {
+    'day': 'day',
+    'week': 'week',
+    'month': 'month',
+    'category': 'category',
+    'product': 'product',
+    'staff': 'created_by',
+}
+
+
+def _parse_date(value, default):
+    if not value:
+        return default
+    try:
+        return datetime.strptime(value, '%Y-%m-%d').date()
+    except ValueError:
+        return default
+
+
+def _date_range(request):
+    """Read start_date/end_date query params, defaulting to the last 30 days"""
+    today = timezone.now().date()
+    start_date = _parse_date(request.query_params.get('start_date'), today - timedelta(days=30))
+    end_date = _parse_date(request.query_params.get('end_date'), today)
+    return start_date, end_date
+
+
+def _int_param(request, name):
+    try:
+        return int(request.query_params[name])
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+def _cache_params(request):
+    """Normalized parameters identifying a report result in the cache"""
+    start_date, end_date = _date_range(request)
+    params = {
+        name: request.query_params[name]
+        for name in REPORT_PARAMS if name in request.query_params
+    }
+    # Parsed dates so equivalent ranges share an entry; unparsable input is kept
+    # verbatim because some reports treat it differently from a missing date
+    for name, value in (('start_date', start_date), ('end_date', end_date)):
+        if name in params and _parse_date(params[name], None) is None:
+            continue
+        params[name] = value.isoformat()
+    params['shop'] = _int_param(request, 'shop')
+    return params
+
+
+CACHED_REPORTS = (
+    'sales_summary', 'sales_breakdown', 'inventory_summary',
+    'inventory_valuation_history', 'customer_analytics', 'category_performance',
+)
+
+
+def _facts(request, start_date, end_date, level):
+    """Sales cube rows for the requested range, shop and slices"""
+    facts = SalesFact.objects.filter(level=level, day__gte=start_date, day__lte=end_date)
+    for param, field in (('shop', 'shop_id'), ('category', 'category_id'),
+                         ('product', 'product_id'), ('created_by', 'created_by_id')):
+        value = _int_param(request, param)
+        if value is not None:
+            facts = facts.filter(**{field: value})
+    return facts
+
+
+class ReportSection:
+    """A report split into independent queries and a step combining their results.
+
+    ``queries(request)`` returns {name: callable running one query}; nothing
+    touches the database until a callable runs, so the async views can run
+    them concurrently while the sync actions run them in turn.
+    """
+
+    def __init__(self, name, queries, combine):
+        self.name = name
+        self.queries = queries
+        self.combine = combine
+
+    def run(self, request):
+        return self.combine(request, {name: query() for name, query in self.queries(request).items()})
+
+
+def _sales_summary_queries(request):
+    start_date, end_date = _date_range(request)
+    facts = _facts(request, start_date, end_date, SalesFact.LEVEL_INVOICE)
+    return {
+        # Revenue and counts of finalized invoices come from the sales cube
+        'totals': lambda: facts.aggregate(
+            revenue=Sum('revenue'), invoices=Sum('invoice_count'),
+            paid=Sum('paid_count'), pending=Sum('pending_count'),
+        ),
+    }
+
+
+def _sales_summary(request, results):
+    start_date, end_date = _date_range(request)
+    total_revenue = results['totals']['revenue'] or Decimal('0.00')
+    total_invoices = results['totals']['invoices'] or 0
+    avg_invoice_value = total_revenue / total_invoices if total_invoices else Decimal('0.00')
+    return {
+        'total_revenue': float(total_revenue),
+        'total_invoices': total_invoices,
+        'paid_invoices': results['totals']['paid'] or 0,
+        'pending_invoices': results['totals']['pending'] or 0,
+        'average_invoice_value': float(avg_invoice_value),
+        'start_date': start_date.isoformat(),
+        'end_date': end_date.isoformat(),
+    }
+
+
+def _inventory_summary_queries(request):
+    products = Product.objects.all()
+    shop_id = _int_param(request, 'shop')
+    if shop_id is not None:
+        products = products.filter(shop_id=shop_id)
+    return {'summary': lambda: products.aggregate(**inventory_aggregates())}
+
+
+def _inventory_summary(request, results):
+    summary = results['summary']
+    return {
+        'total_products': summary['total_products'],
+        'total_inventory_value': float(summary['total_inventory_value'] or 0),
+        'low_stock_products': summary['low_stock_products'],
+        'out_of_stock_products': summary['out_of_stock_products'],
+    }
+
+
+def _customer_analytics_queries(request):
+    from billing.models import Customer
+
+    customers = Customer.objects.all()
+    queries = {'total': customers.count}
+    # New customers since start_date, defaulting to the last 30 days; an
+    # unparsable date counts none
+    start_date = request.query_params.get('start_date')
+    if start_date:
+        start_date = _parse_date(start_date, None)
+    else:
+        start_date = timezone.now().date() - timedelta(days=30)
+    if start_date is not None:
+        queries['new'] = customers.filter(created_at__gte=start_date).count
+    return queries
+
+
+def _customer_analytics(request, results):
+    return {
+        'total_customers': results['total'],
+        'new_customers': results.get('new', 0),
+    }
+
+
+def _category_performance_queries(request):
+    categories = Category.objects.all()
+    shop_id = _int_param(request, 'shop')
+    if shop_id is not None:
+        categories = categories.filter(shop_id=shop_id)
+
+    # One grouped query over categories left-joined to their products
+    categories = categories.annotate(
+        products_total=Count('products'),
+        stock_value=Sum(
+            F('products__price') * F('products__stock_quantity'),
+            output_field=DecimalField(max_digits=16, decimal_places=2)
+        ),
+        low_stock_total=Count('products', filter=Q(products__stock_quantity__lte=F('products__threshold'))),
+    ).values('name', 'products_total', 'stock_value', 'low_stock_total')
+    return {'categories': lambda: list(categories)}
+
+
+def _category_performance(request, results):
+    return [
+        {
+            'category_name': category['name'],
+            'product_count': category['products_total'],
+            'total_value': float(category['stock_value'] or 0),
+            'low_stock_count': category['low_stock_total'],
+        }
+        for category in results['categories']
+    ]
+
+
+SALES_SUMMARY = ReportSection('sales_summary', _sales_summary_queries, _sales_summary)
+INVENTORY_SUMMARY = ReportSection('inventory_summary', _inventory_summary_queries, _inventory_summary)
+CUSTOMER_ANALYTICS = ReportSection('customer_analytics', _customer_analytics_queries, _customer_analytics)
+CATEGORY_PERFORMANCE = ReportSection('category_performance', _category_performance_queries, _category_performance)
+
 
 class ReportViewSet(viewsets.ViewSet):
     permission_classes = [IsAdminOnly]
-    
+
     @action(detail=False, methods=['get'])
+    @cached_report(_cache_params)
     def sales_summary(self, request):
         """Get sales summary for dashboard"""
-        # Get date range from query params
-        start_date = request.query_params.get('start_date')
-        end_date = request.query_params.get('end_date')
-        
-        if not start_date:
-            start_date = timezone.now().date() - timedelta(days=30)
-        else:
-            try:
-                start_date = datetime.strptime(start_date, '%Y-%m-%d').date()
-            except ValueError:
-                start_date = timezone.now().date() - timedelta(days=30)
-            
-        if not end_date:
-            end_date = timezone.now().date()
-        else:
-            try:
-                end_date = datetime.strptime(end_date, '%Y-%m-%d').date()
-            except ValueError:
-                end_date = timezone.now().date()
-        
-        # Get invoice data
-        invoices = Invoice.objects.filter(
-            invoice_date__gte=start_date,
-            invoice_date__lte=end_date
+        return Response(SALES_SUMMARY.run(request))
+
+    @action(detail=False, methods=['get'])
+    @cached_report(_cache_params)
+    def sales_breakdown(self, request):
+        """Slice sales by day/week/month, category, product or staff member"""
+        start_date, end_date = _date_range(request)
+        group_by = request.query_params.get('group_by', 'day')
+        if group_by not in BREAKDOWN_GROUPS:
+            return Response(
+                {'error': f"group_by must be one of: {', '.join(BREAKDOWN_GROUPS)}"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        # Product and category slices need item-level rows; everything else
+        # reads the (smaller) invoice-level rows
+        by_item = group_by in ('category', 'product') or any(
+            param in request.query_params for param in ('category', 'product')
         )
-        
-        total_revenue = invoices.aggregate(
-            total=Sum('total_amount')
-        )['total'] or Decimal('0.00')
-        
-        paid_invoices_count = invoices.filter(status='paid').count()
-        pending_invoices_count = invoices.filter(status__in=['due', 'partial']).count()
-        
-        avg_invoice_value = invoices.aggregate(
-            avg=Avg('total_amount')
-        )['avg'] or Decimal('0.00')
-        
-        summary = {
-            'total_revenue': float(total_revenue),
-            'total_invoices': invoices.count(),
-            'paid_invoices': paid_invoices_count,
-            'pending_invoices': pending_invoices_count,
-            'average_invoice_value': float(avg_invoice_value),
+        level = SalesFact.LEVEL_ITEM if by_item else SalesFact.LEVEL_INVOICE
+        facts = _facts(request, start_date, end_date, level)
+
+        if group_by == 'week':
+            facts = facts.annotate(period=TruncWeek('day'))
+        elif group_by == 'month':
+            facts = facts.annotate(period=TruncMonth('day'))
+        elif group_by == 'day':
+            facts = facts.annotate(period=F('day'))
+
+        group_field = 'period' if group_by in ('day', 'week', 'month') else BREAKDOWN_GROUPS[group_by]
+        label_fields = {
+            'category': ['category__name'],
+            'product': ['product__name', 'product__sku'],
+            'staff': ['created_by__username'],
+        }.get(group_by, [])
+
+        rows = (
+            facts.values(group_field, *label_fields)
+            .annotate(
+                revenue=Sum('revenue'),
+                tax=Sum('tax'),
+                quantity=Sum('quantity'),
+                invoices=Sum('invoice_count'),
+            )
+            .order_by(group_field)
+        )
+
+        results = []
+        for row in rows:
+            key = row[group_field]
+            entry = {
+                group_by: key.isoformat() if hasattr(key, 'isoformat') else key,
+                'revenue': float(row['revenue'] or 0),
+                'tax': float(row['tax'] or 0),
+                'invoices': row['invoices'] or 0,
+            }
+            if by_item:
+                entry['quantity'] = row['quantity'] or 0
+            for field in label_fields:
+                entry[field.replace('__', '_')] = row[field]
+            results.append(entry)
+
+        return Response({
+            'group_by': group_by,
             'start_date': start_date.isoformat(),
             'end_date': end_date.isoformat(),
-        }
-        
-        return Response(summary)
+            'results': results,
+        })
     
     @action(detail=False, methods=['get'])
+    @cached_report(_cache_params)
     def inventory_summary(self, request):
         """Get inventory summary"""
-        products = Product.objects.all()
-        
-        total_inventory_value = sum(
-            float(product.price or 0) * int(product.stock_quantity or 0)
-            for product in products
-        )
-        
-        low_stock_products = products.filter(
-            stock_quantity__lte=F('threshold')
-        ).count()
-        
-        out_of_stock_products = products.filter(stock_quantity=0).count()
-        
-        summary = {
-            'total_products': products.count(),
-            'total_inventory_value': total_inventory_value,
-            'low_stock_products': low_stock_products,
-            'out_of_stock_products': out_of_stock_products,
-        }
-        
-        return Response(summary)
+        return Response(INVENTORY_SUMMARY.run(request))
+
+    @action(detail=False, methods=['get'])
+    @cached_report(_cache_params)
+    def inventory_valuation_history(self, request):
+        """Get periodic inventory valuation snapshots for charting"""
+        start_date, end_date = _date_range(request)
+        snapshots = InventoryValuation.objects.filter(date__gte=start_date, date__lte=end_date)
+        shop_id = _int_param(request, 'shop')
+        if shop_id is not None:
+            snapshots = snapshots.filter(shop_id=shop_id)
+            rows = snapshots.values('date', 'product_count', 'stock_units', 'total_value',
+                                    'low_stock_products', 'out_of_stock_products')
+        else:
+            # Without a shop, chart the total across shops
+            rows = snapshots.values('date').annotate(
+                product_count=Sum('product_count'),
+                stock_units=Sum('stock_units'),
+                total_value=Sum('total_value'),
+                low_stock_products=Sum('low_stock_products'),
+                out_of_stock_products=Sum('out_of_stock_products'),
+            )
+
+        return Response([
+            {
+                'date': row['date'].isoformat(),
+                'product_count': row['product_count'],
+                'stock_units': row['stock_units'],
+                'total_value': float(row['total_value'] or 0),
+                'low_stock_products': row['low_stock_products'],
+                'out_of_stock_products': row['out_of_stock_products'],
+            }
+            for row in rows.order_by('date')
+        ])
     
     @action(detail=False, methods=['get'])
+    @cached_report(_cache_params)
     def customer_analytics(self, request):
         """Get customer analytics"""
-        from billing.models import Customer
-        
-        customers = Customer.objects.all()
-        total_customers = customers.count()
-        
-        # Get date range for new customers
-        start_date = request.query_params.get('start_date')
-        if start_date:
-            try:
-                start_date = datetime.strptime(start_date, '%Y-%m-%d').date()
-                new_customers = customers.filter(
-                    created_at__gte=start_date
-                ).count()
-            except ValueError:
-                new_customers = 0
-        else:
-            # Default to last 30 days
-            start_date = timezone.now().date() - timedelta(days=30)
-            new_customers = customers.filter(
-                created_at__gte=start_date
-            ).count()
-        
-        return Response({
-            'total_customers': total_customers,
-            'new_customers': new_customers,
-        })
-    
+        return Response(CUSTOMER_ANALYTICS.run(request))
+
     @action(detail=False, methods=['get'])
+    @cached_report(_cache_params)
     def category_performance(self, request):
         """Get category performance data"""
-        categories = Category.objects.all()
-        performance_data = []
-        
-        for category in categories:
-            products = Product.objects.filter(category=category)
-            total_value = sum(
-                float(product.price or 0) * int(product.stock_quantity or 0)
-                for product in products
-            )
-            
-            performance_data.append({
-                'category_name': category.name,
-                'product_count': products.count(),
-                'total_value': total_value,
-                'low_stock_count': products.filter(
-                    stock_quantity__lte=F('threshold')
-                ).count(),
-            })
-        
-        return Response(performance_data)
\ No newline at end of file
+        return Response(CATEGORY_PERFORMANCE.run(request))
+
+    @action(detail=False, methods=['get'])
+    def cache_stats(self, request):
+        """Get report cache hit/miss counters"""
+        return Response(report_cache.stats(CACHED_REPORTS))
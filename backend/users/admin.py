@@ -3,6 +3,8 @@ from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
 from django.contrib.auth import get_user_model
 from django.utils.html import format_html
 
+from .models import Notification
+
 User = get_user_model()
 
 @admin.register(User)
@@ -73,4 +75,22 @@ class UserAdmin(BaseUserAdmin):
     def deactivate_users(self, request, queryset):
         updated = queryset.update(is_active=False)
         self.message_user(request, f'{updated} users have been deactivated successfully.')
-    deactivate_users.short_description = "Deactivate selected users"
\ No newline at end of file
+    deactivate_users.short_description = "Deactivate selected users"
+
+
+@admin.register(Notification)
+class NotificationAdmin(admin.ModelAdmin):
+    list_display = ['title', 'user', 'kind', 'quantity', 'occurrences', 'is_read', 'updated_at']
+    list_filter = ['kind', 'is_read', 'updated_at']
+    search_fields = ['title', 'message', 'user__username']
+    readonly_fields = [field.name for field in Notification._meta.fields]
+
+    def has_add_permission(self, request):
+        # Editing rows here would bypass the inbox unread counter
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
@@ -0,0 +1,23 @@
+from asgiref.sync import sync_to_async
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+
+
+async def authenticate_jwt(request, allow_query_token=False):
+    """The user of a plain async view's JWT, or None.
+
+    The token comes from the Authorization header, or from ``?token=`` when
+    allowed (EventSource cannot set headers).
+    """
+    header = request.headers.get('Authorization', '')
+    raw_token = header[7:] if header.startswith('Bearer ') else None
+    if raw_token is None and allow_query_token:
+        raw_token = request.GET.get('token')
+    if not raw_token:
+        return None
+    authentication = JWTAuthentication()
+    try:
+        token = authentication.get_validated_token(raw_token)
+        return await sync_to_async(authentication.get_user)(token)
+    except (InvalidToken, AuthenticationFailed):
+        return None
@@ -0,0 +1,45 @@
+# Generated by Django 5.2.5 on 2026-10-17 01:22
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0011_stock_locations'),
+        ('users', '0002_alter_user_options_user_address_user_business_type_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='NotificationInbox',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='notification_inbox', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('unread_count', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Notification',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('low_stock', 'Low stock'), ('out_of_stock', 'Out of stock')], max_length=20)),
+                ('title', models.CharField(max_length=200)),
+                ('message', models.TextField(blank=True)),
+                ('quantity', models.IntegerField(blank=True, null=True)),
+                ('occurrences', models.PositiveIntegerField(default=1)),
+                ('is_read', models.BooleanField(default=False)),
+                ('read_at', models.DateTimeField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now_add=True)),
+                ('product', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='inventory.product')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='notifications', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['-updated_at', '-id'],
+                'indexes': [models.Index(fields=['user', '-updated_at'], name='users_notif_inbox_idx')],
+                'constraints': [models.UniqueConstraint(condition=models.Q(('is_read', False)), fields=('user', 'kind', 'product'), name='one_unread_alert_per_product')],
+            },
+        ),
+    ]
@@ -65,4 +65,51 @@ class User(AbstractUser):
     def full_name(self):
         if self.first_name and self.last_name:
             return f"{self.first_name} {self.last_name}"
-        return self.username
\ No newline at end of file
+        return self.username
+
+class NotificationInbox(models.Model):
+    """Per-user unread counter, moved with the notification rows so reading it is one lookup"""
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name='notification_inbox')
+    unread_count = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.user_id}: {self.unread_count} unread"
+
+
+class Notification(models.Model):
+    """An inbox entry; a repeated alert bumps ``occurrences`` while it is unread"""
+    LOW_STOCK = 'low_stock'
+    OUT_OF_STOCK = 'out_of_stock'
+    KIND_CHOICES = (
+        (LOW_STOCK, 'Low stock'),
+        (OUT_OF_STOCK, 'Out of stock'),
+    )
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='notifications')
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    # Alerts outlive the product so the unread counter never loses rows behind its back
+    product = models.ForeignKey('inventory.Product', on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    title = models.CharField(max_length=200)
+    message = models.TextField(blank=True)
+    quantity = models.IntegerField(null=True, blank=True)
+    occurrences = models.PositiveIntegerField(default=1)
+    is_read = models.BooleanField(default=False)
+    read_at = models.DateTimeField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['-updated_at', '-id']
+        indexes = [
+            models.Index(fields=['user', '-updated_at'], name='users_notif_inbox_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'kind', 'product'],
+                condition=models.Q(is_read=False),
+                name='one_unread_alert_per_product',
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.user_id}: {self.title}"
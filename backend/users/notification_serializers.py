@@ -0,0 +1,19 @@
+from rest_framework import serializers
+
+from .models import Notification
+
+
+class NotificationSerializer(serializers.ModelSerializer):
+    product_id = serializers.IntegerField(read_only=True)
+
+    class Meta:
+        model = Notification
+        fields = [
+            'id', 'kind', 'product_id', 'title', 'message', 'quantity', 'occurrences',
+            'is_read', 'read_at', 'created_at', 'updated_at',
+        ]
+        read_only_fields = fields
+
+
+class MarkReadSerializer(serializers.Serializer):
+    ids = serializers.ListField(child=serializers.IntegerField(), required=False, max_length=1000)
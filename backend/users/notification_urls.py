@@ -0,0 +1,11 @@
+from django.urls import path, include
+from rest_framework.routers import DefaultRouter
+from .notification_views import NotificationViewSet
+
+router = DefaultRouter()
+# Register at root so paths are /api/notifications/..., not /api/notifications/notifications/...
+router.register(r'', NotificationViewSet, basename='notification')
+
+urlpatterns = [
+    path('', include(router.urls)),
+]
@@ -0,0 +1,49 @@
+from rest_framework import permissions, viewsets
+from rest_framework.decorators import action
+from rest_framework.response import Response
+
+from .models import Notification
+from .notification_serializers import MarkReadSerializer, NotificationSerializer
+from . import notifications
+
+
+class NotificationViewSet(viewsets.ReadOnlyModelViewSet):
+    """The signed-in user's notification inbox"""
+    serializer_class = NotificationSerializer
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get_queryset(self):
+        queryset = Notification.objects.filter(user=self.request.user)
+        if self.request.query_params.get('unread') in ('1', 'true'):
+            queryset = queryset.filter(is_read=False)
+        kind = self.request.query_params.get('kind')
+        if kind:
+            queryset = queryset.filter(kind=kind)
+        return queryset
+
+    def list(self, request, *args, **kwargs):
+        response = super().list(request, *args, **kwargs)
+        if isinstance(response.data, dict):
+            response.data['unread_count'] = notifications.unread_count(request.user)
+        return response
+
+    @action(detail=False, methods=['get'])
+    def unread_count(self, request):
+        """Unread notifications, from the inbox counter"""
+        return Response({'unread_count': notifications.unread_count(request.user)})
+
+    @action(detail=False, methods=['post'])
+    def mark_read(self, request):
+        """Mark the given ids read, or every unread notification when none are given"""
+        serializer = MarkReadSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        marked = notifications.mark_read(request.user, serializer.validated_data.get('ids'))
+        return Response({'marked': marked, 'unread_count': notifications.unread_count(request.user)})
+
+    @action(detail=True, methods=['post'])
+    def read(self, request, pk=None):
+        """Mark one notification read"""
+        notification = self.get_object()
+        notifications.mark_read(request.user, [notification.pk])
+        notification.refresh_from_db()
+        return Response(self.get_serializer(notification).data)
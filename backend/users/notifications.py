@@ -0,0 +1,139 @@
+"""Per-user notification inbox and incremental low-stock alerts.
+
+Stock changes report their net change per product as they are ledgered, so a
+product crossing its threshold is found by comparing its stock before and
+after that change instead of rescanning for low stock. Alerts go to the shop
+owner's inbox with bulk inserts; a product that crosses again while its alert
+is still unread bumps that alert instead of adding another. The unread count is
+a counter on NotificationInbox, moved in the same transaction as the rows, and
+the inbox row is locked while it moves so writers and readers take turns.
+"""
+from django.db import transaction
+from django.db.models import Case, F, IntegerField, Q, Value, When
+from django.db.models.functions import Greatest
+from django.utils import timezone
+
+from .models import Notification, NotificationInbox
+
+NOTIFY_BATCH_SIZE = 1000
+
+
+def _lock_inboxes(user_ids):
+    """Create missing inboxes and lock them, in id order, until commit"""
+    NotificationInbox.objects.bulk_create(
+        [NotificationInbox(user_id=user_id) for user_id in user_ids], ignore_conflicts=True
+    )
+    list(
+        NotificationInbox.objects.select_for_update().filter(user_id__in=user_ids)
+        .order_by('user_id').values_list('user_id', flat=True)
+    )
+
+
+def deliver(notifications):
+    """Write unsaved Notification objects, folding each into an unread one with the same key.
+
+    The key is (user, kind, product). Returns (created, coalesced).
+    """
+    notifications = list(notifications)
+    if not notifications:
+        return 0, 0
+    user_ids = sorted({notification.user_id for notification in notifications})
+    keys = Q()
+    for notification in notifications:
+        keys |= Q(user_id=notification.user_id, kind=notification.kind, product_id=notification.product_id)
+
+    with transaction.atomic():
+        _lock_inboxes(user_ids)
+        unread = {
+            (user_id, kind, product_id): pk for pk, user_id, kind, product_id in
+            Notification.objects.filter(keys, is_read=False).values_list('id', 'user_id', 'kind', 'product_id')
+        }
+        repeats, fresh = {}, []
+        for notification in notifications:
+            pk = unread.get((notification.user_id, notification.kind, notification.product_id))
+            if pk is None:
+                fresh.append(notification)
+            else:
+                repeats[pk] = notification
+
+        if repeats:
+            Notification.objects.filter(id__in=list(repeats)).update(
+                occurrences=F('occurrences') + 1,
+                quantity=Case(*[When(id=pk, then=Value(n.quantity)) for pk, n in repeats.items()],
+                              output_field=IntegerField()),
+                title=Case(*[When(id=pk, then=Value(n.title)) for pk, n in repeats.items()]),
+                message=Case(*[When(id=pk, then=Value(n.message)) for pk, n in repeats.items()]),
+                updated_at=timezone.now(),
+            )
+        if fresh:
+            Notification.objects.bulk_create(fresh, batch_size=NOTIFY_BATCH_SIZE)
+            added = {}
+            for notification in fresh:
+                added[notification.user_id] = added.get(notification.user_id, 0) + 1
+            NotificationInbox.objects.filter(user_id__in=list(added)).update(
+                unread_count=F('unread_count') + Case(
+                    *[When(user_id=user_id, then=Value(count)) for user_id, count in added.items()],
+                    default=Value(0),
+                    output_field=IntegerField(),
+                )
+            )
+    return len(fresh), len(repeats)
+
+
+def _stock_alert(product_id, shop_id, name, sku, stock, threshold):
+    if stock <= 0:
+        kind, title = Notification.OUT_OF_STOCK, f"{name} is out of stock"
+    else:
+        kind, title = Notification.LOW_STOCK, f"{name} is running low"
+    return Notification(
+        user_id=shop_id,
+        kind=kind,
+        product_id=product_id,
+        title=title,
+        message=f"{name} ({sku}) is down to {stock} units; the low-stock threshold is {threshold}.",
+        quantity=stock,
+    )
+
+
+def notify_stock_levels(changes):
+    """Alert shop owners to products that {product_id: net change just applied} took across a level.
+
+    A product alerts when its stock fell from above its threshold to at or
+    below it, or from above zero to zero. Increases are never read.
+    """
+    decreases = [(product_id, change) for product_id, change in changes.items() if change < 0]
+    if not decreases:
+        return 0, 0
+    from inventory.models import Product
+
+    alerts = []
+    for start in range(0, len(decreases), NOTIFY_BATCH_SIZE):
+        chunk = dict(decreases[start:start + NOTIFY_BATCH_SIZE])
+        rows = Product.objects.filter(id__in=list(chunk)).values_list(
+            'id', 'shop_id', 'name', 'sku', 'stock_quantity', 'threshold'
+        )
+        for product_id, shop_id, name, sku, stock, threshold in rows:
+            before = stock - chunk[product_id]
+            if (before > threshold >= stock) or (before > 0 >= stock):
+                alerts.append(_stock_alert(product_id, shop_id, name, sku, stock, threshold))
+    return deliver(alerts)
+
+
+def unread_count(user):
+    """The user's unread notifications, read from the inbox counter"""
+    return NotificationInbox.objects.filter(user=user).values_list('unread_count', flat=True).first() or 0
+
+
+def mark_read(user, ids=None):
+    """Mark the user's unread notifications (or only ``ids``) read; returns how many changed"""
+    with transaction.atomic():
+        _lock_inboxes([user.pk])
+        unread = Notification.objects.filter(user=user, is_read=False)
+        if ids is not None:
+            unread = unread.filter(id__in=list(ids))
+        marked = unread.update(is_read=True, read_at=timezone.now())
+        if marked:
+            NotificationInbox.objects.filter(user=user).update(
+                unread_count=Greatest(F('unread_count') - marked, Value(0))
+            )
+    return marked
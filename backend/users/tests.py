@@ -1,3 +1,49 @@
+from django.db.models import F
 from django.test import TestCase
 
-# Create your tests here.
+from inventory.models import Product
+from inventory.stock import deduct_stock
+
+from .models import Notification, User
+from .notifications import mark_read, unread_count
+
+
+class StockAlertTests(TestCase):
+    def setUp(self):
+        self.shop = User.objects.create(username='alerts', role='shop_owner', shop_name='Alerts')
+        self.product = Product.objects.create(name='Product', sku='SKU-1', price='1.00', stock_quantity=20,
+                                              threshold=5, shop=self.shop, created_by=self.shop)
+
+    def sell(self, quantity):
+        deduct_stock({self.product.pk: quantity}, reference='Sale')
+
+    def alerts(self):
+        return list(Notification.objects.filter(user=self.shop).order_by('id')
+                    .values_list('kind', 'quantity', 'occurrences', 'is_read'))
+
+    def test_alerts_fire_when_stock_crosses_a_level(self):
+        self.sell(14)
+        self.assertEqual(self.alerts(), [])
+        self.sell(2)
+        self.assertEqual(self.alerts(), [(Notification.LOW_STOCK, 4, 1, False)])
+        self.sell(1)
+        # Already below the threshold, so nothing new crossed
+        self.assertEqual(self.alerts(), [(Notification.LOW_STOCK, 4, 1, False)])
+        self.sell(3)
+        self.assertEqual(self.alerts(), [(Notification.LOW_STOCK, 4, 1, False), (Notification.OUT_OF_STOCK, 0, 1, False)])
+        self.assertEqual(unread_count(self.shop), 2)
+
+    def test_repeat_alert_folds_into_the_unread_one(self):
+        self.sell(16)
+        Product.objects.filter(pk=self.product.pk).update(stock_quantity=F('stock_quantity') + 10)
+        self.sell(11)
+        self.assertEqual(self.alerts(), [(Notification.LOW_STOCK, 3, 2, False)])
+        self.assertEqual(unread_count(self.shop), 1)
+
+        self.assertEqual(mark_read(self.shop), 1)
+        self.assertEqual(unread_count(self.shop), 0)
+        Product.objects.filter(pk=self.product.pk).update(stock_quantity=F('stock_quantity') + 10)
+        self.sell(10)
+        # The earlier alert was read, so this one is new
+        self.assertEqual(self.alerts(), [(Notification.LOW_STOCK, 3, 2, True), (Notification.LOW_STOCK, 3, 1, False)])
+        self.assertEqual(unread_count(self.shop), 1)